@@ -0,0 +1,69 @@
+"""
+Shared helpers for the stand-in executables used by `scoreapi benchmark --stubs`.
+
+The stubs accept the same command lines the services use and write outputs of
+the right kind, so the pipelines can be benchmarked (and exercised on CI) without
+Audiveris, HOMR, OEMER, MuseScore, FluidSynth or FFmpeg installed.
+"""
+
+import os
+import shutil
+import struct
+import sys
+import time
+import wave
+from pathlib import Path
+
+# One measure of C major quarter notes.
+SCORE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.1 Partwise//EN"
+  "http://www.musicxml.org/dtds/partwise.dtd">
+<score-partwise version="3.1">
+  <part-list><score-part id="P1"><part-name>Piano</part-name></score-part></part-list>
+  <part id="P1">
+    <measure number="1">
+      <attributes>
+        <divisions>1</divisions>
+        <time><beats>4</beats><beat-type>4</beat-type></time>
+        <clef><sign>G</sign><line>2</line></clef>
+      </attributes>
+{notes}
+    </measure>
+  </part>
+</score-partwise>
+"""
+NOTE = (
+    "      <note><pitch><step>{step}</step><octave>4</octave></pitch>"
+    "<duration>1</duration><type>quarter</type></note>"
+)
+
+
+def write_score(path: Path) -> None:
+    notes = "\n".join(NOTE.format(step=step) for step in "CEGC")
+    path.write_text(SCORE.format(notes=notes))
+
+
+def write_silence(path: Path, seconds: float = 1.0, rate: int = 44100) -> None:
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(struct.pack("<hh", 0, 0) * int(seconds * rate))
+
+
+def copy(src: Path, dst: Path) -> None:
+    shutil.copyfile(src, dst)
+
+
+def simulate_work() -> None:
+    """
+    Sleep for the number of seconds given in STUB_DELAY (default: none), to model
+    the latency of the real tool.
+    """
+    import os
+
+    time.sleep(float(os.environ.get("STUB_DELAY", "0")))
+
+
+def args() -> list[str]:
+    return sys.argv[1:]
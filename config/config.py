@@ -1,3 +1,5 @@
+import os
+
 from dotenv import find_dotenv, load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -11,6 +13,9 @@ class BasicAuthSettings(BaseSettings):
 
     BASIC_USERNAME: str | None = None
     BASIC_PASSWORD: str | None = None
+    # More accounts as JSON, {"username": "password"}; each is its own user
+    # for the fair sharing of the OMR workers (see `USER_WEIGHTS`)
+    BASIC_USERS: dict[str, str] = {}
 
 
 class AppSettings(BaseSettings):
@@ -23,12 +28,116 @@ class AppSettings(BaseSettings):
     APP_HOST: str | None = None
     APP_PORT: int | None = None
     CONTAINER_PORT: int | None = None
+    CACHE_DIR: str = "cache"
+    METRICS_DB: str = "cache/metrics.sqlite3"
+    # Rolling window and cache lifetime (seconds) of the per-tool statistics
+    STATS_WINDOW: int = 24 * 60 * 60
+    STATS_TTL: int = 30
+    DEBUG: bool = False
+    PREWARM: bool = True
+    WORK_DIR: str = "jobs"
+    WEB_WORKERS: int = 2
+    # Requests after which a web worker is replaced by a fresh one; never if None
+    WEB_MAX_REQUESTS: int | None = None
+    OMR_WORKERS: int | None = None
+    OMR_MAX_TASKS_PER_CHILD: int = 20
+    SHUTDOWN_TIMEOUT: int = 600
+    # Queue handing conversions to `scoreapi worker` processes, e.g.
+    # "sqlite:///var/lib/scoreapi/queue.sqlite3" or "redis://queue:6379/0".
+    # Unset, every API process converts in its own OMR pool. With a queue,
+    # WORK_DIR must be on storage shared with the workers, at the same path.
+    JOB_QUEUE: str | None = None
+    JOB_POLL_INTERVAL: float = 0.5
+    # Seconds a queued job may go without a heartbeat from its worker before
+    # another worker takes it over (resuming from its checkpoint)
+    JOB_LEASE: int = 60
+    # Limits of the zip archives in a batch upload, checked before anything is
+    # extracted: scores in the batch once an archive is unpacked, and unpacked
+    # size (MB) of a score and of all the scores of one archive
+    BATCH_MAX_FILES: int = 100
+    BATCH_MAX_FILE_MB: int = 200
+    BATCH_MAX_UNPACKED_MB: int = 1024
+    # Measures of the first page rendered by a preview (`preview=true`)
+    PREVIEW_MEASURES: int = 8
+    # Workspaces of failed conversions are kept this long (seconds) so a retry
+    # can resume them
+    WORKSPACE_TTL: int = 24 * 60 * 60
+    # Cache shared by all nodes behind the local one in CACHE_DIR, so a score
+    # converted on one node is not converted again on another:
+    # "file:///mnt/shared/scoreapi-cache" (a shared filesystem) or
+    # "s3://bucket/prefix" (S3 or a compatible store, see the S3_* settings).
+    # Unset, every node caches on its own.
+    CACHE_STORE: str | None = None
+    # With CACHE_STORE, each local cache (results, pages per tool) is trimmed
+    # to this size (MB), least recently used first
+    CACHE_LOCAL_MB: int = 2048
+    # Endpoint of an S3-compatible store such as MinIO ("http://minio:9000");
+    # AWS S3 if unset. Without keys the bucket is accessed anonymously.
+    S3_ENDPOINT: str | None = None
+    S3_REGION: str = "us-east-1"
+    S3_ACCESS_KEY: str | None = None
+    S3_SECRET_KEY: str | None = None
+    # Share of the OMR workers per user as JSON, {"username": 2.0}; users not
+    # listed weigh 1. Waiting jobs are started so that every user gets work
+    # done in proportion to their weight, shortest job first within a user.
+    USER_WEIGHTS: dict[str, float] = {}
+    # Estimated seconds per page of a tool not measured yet (see `tool_stats`),
+    # as JSON by tool; tools not listed are expected to take as long as the
+    # slowest one. AUTO sends most pages to Audiveris.
+    DEFAULT_SECONDS_PER_PAGE: dict[str, float] = {
+        "AUDIVERIS": 20.0,
+        "HOMR": 70.0,
+        "OEMER": 170.0,
+        "AUTO": 20.0,
+    }
+    # While jobs wait, a running job yields its worker between two pages if it
+    # has more than PREEMPT_FACTOR times the estimated work of the next waiting
+    # job left and ran at least PREEMPT_MIN_RUN seconds. It then waits again
+    # and resumes from its checkpoint.
+    PREEMPT_FACTOR: float = 4.0
+    PREEMPT_MIN_RUN: float = 30.0
+
+    @property
+    def omr_workers(self) -> int:
+        """
+        OMR worker processes per web worker. Unless set, the cores are split
+        evenly between the web workers.
+        """
+        return self.OMR_WORKERS or max(1, (os.cpu_count() or 1) // self.WEB_WORKERS)
+
+
+class ToolSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        extra="allow", env_file="./.env", env_file_encoding="utf-8"
+    )
+
+    AUDIVERIS_BIN: str = "/opt/audiveris/bin/Audiveris"
+    # Command running HOMR on one image; by default the installed homr package
+    HOMR_BIN: str | None = None
+    SOUNDFONT_PATH: str = "/usr/share/sounds/sf2/FluidR3_GM.sf2"
+    # More SoundFonts requests can choose by name, as JSON: {"piano": "/sf2/piano.sf2"}.
+    # SOUNDFONT_PATH is always available as "default".
+    SOUNDFONTS: dict[str, str] = {}
+    # Seconds an external tool may run per call, by stage; it is killed after
+    # that. Stages not listed run without a timeout.
+    TOOL_TIMEOUTS: dict[str, int] = {
+        "omr": 1800,
+        "musescore": 300,
+        "synth": 600,
+        "encode": 600,
+    }
+    # CPU seconds and address space (MB) of every external tool process; unset
+    # means unlimited. The JVM of Audiveris reserves a lot of address space, so
+    # leave room for it when capping memory.
+    TOOL_CPU_SECONDS: int | None = None
+    TOOL_MEMORY_MB: int | None = None
 
 
-class Settings(BasicAuthSettings, AppSettings):
+class Settings(BasicAuthSettings, AppSettings, ToolSettings):
     pass
 
 
 basic_auth_settings = BasicAuthSettings()
 app_settings = AppSettings()
+tool_settings = ToolSettings()
 settings = Settings()
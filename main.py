@@ -8,24 +8,44 @@ from config.config import app_settings
 def run(
     host: Optional[str] = None,
     port: Optional[int] = None,
+    debug: Optional[bool] = None,
 ) -> None:
     """
     Run the server.
+
+    In debug mode the app is served by a single process with the auto-reloader
+    and debug logging. Otherwise `WEB_WORKERS` worker processes are started, each
+    with its own pool of OMR worker processes. On shutdown every worker stops
+    accepting conversions and waits up to `SHUTDOWN_TIMEOUT` seconds for the
+    running ones to finish.
     """
     if not host:
         host = app_settings.APP_HOST
     if not port:
         port = app_settings.APP_PORT
+    if debug is None:
+        debug = app_settings.DEBUG
 
-    uvicorn.run(
-        "server:debug_app",
-        host=host,
-        port=port,
-        reload=True,
-        reload_dirs=["."],
-        log_level="debug",
-        use_colors=True,
-    )
+    if debug:
+        uvicorn.run(
+            "server:debug_app",
+            host=host,
+            port=port,
+            reload=True,
+            reload_dirs=["."],
+            log_level="debug",
+            use_colors=True,
+        )
+    else:
+        uvicorn.run(
+            "server:app",
+            host=host,
+            port=port,
+            workers=app_settings.WEB_WORKERS,
+            limit_max_requests=app_settings.WEB_MAX_REQUESTS,
+            timeout_graceful_shutdown=app_settings.SHUTDOWN_TIMEOUT,
+            log_level="info",
+        )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,21 @@
+from contextlib import asynccontextmanager
+from pathlib import Path
+
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from config.config import app_settings
 from src import constants
 from src.api.handlers import start_exception_handlers
 from src.api.v1 import router as v1_router
+from src.api.v1.music.services.checkpoint import prune_workspaces
+from src.api.v1.music.services.soundfonts import soundfonts
+from src.core.metrics import render_prometheus
+from src.core.queue import job_queue
+from src.core.storage import TieredCache
+from src.core.warmup import is_ready, start_warmup
+from src.core.workers import omr_pool
 
 
 def init_routers(_app: FastAPI) -> None:
@@ -32,6 +42,23 @@ def root_health_path(_app: FastAPI) -> None:
             status_code=status.HTTP_200_OK, content={"message": constants.SUCCESS}
         )
 
+    @_app.get("/readiness", include_in_schema=False)
+    def readiness() -> JSONResponse:
+        if not is_ready() or omr_pool.draining:
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"message": constants.NOT_READY},
+            )
+        return JSONResponse(
+            status_code=status.HTTP_200_OK, content={"message": constants.SUCCESS}
+        )
+
+    @_app.get("/metrics", include_in_schema=False)
+    def metrics() -> PlainTextResponse:
+        return PlainTextResponse(
+            render_prometheus(), media_type="text/plain; version=0.0.4"
+        )
+
 
 def init_middlewares(_app: FastAPI) -> None:
     """
@@ -46,6 +73,27 @@ def init_middlewares(_app: FastAPI) -> None:
     )
 
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Validate the SoundFonts, delete workspaces of failed conversions left too
+    long for a retry, start loading the conversion backends without
+    blocking startup, and let in-flight conversions and cache uploads finish
+    before the worker exits.
+
+    With a job queue configured, conversions run on `scoreapi worker` nodes and
+    this process only accepts uploads and serves results, so it has no OMR pool.
+    """
+    soundfonts.load()
+    prune_workspaces(Path(app_settings.WORK_DIR), app_settings.WORKSPACE_TTL)
+    if job_queue() is None:
+        omr_pool.start()
+    start_warmup(prewarm=app_settings.PREWARM)
+    yield
+    await omr_pool.drain(timeout=app_settings.SHUTDOWN_TIMEOUT)
+    TieredCache.flush()
+
+
 def create_app(debug: bool = False) -> FastAPI:
     """
     Create a Initialize the FastAPI app.
@@ -55,6 +103,7 @@ def create_app(debug: bool = False) -> FastAPI:
         version=app_settings.APP_VERSION,
         docs_url="/docs",
         redoc_url="/redoc" if debug else None,
+        lifespan=lifespan,
     )
     init_routers(_app)
     root_health_path(_app)
@@ -63,4 +112,5 @@ def create_app(debug: bool = False) -> FastAPI:
     return _app
 
 
+app = create_app()
 debug_app = create_app(debug=True)
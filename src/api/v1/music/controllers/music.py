@@ -1,13 +1,20 @@
-from typing import Annotated
+from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, File, UploadFile, Query
+from fastapi import APIRouter, Depends, File
+from fastapi import Path as PathParam
+from fastapi import Query, Request, Response, UploadFile
 from starlette import status
 
-from src.api.v1.music.enums import ToolTypeEnum
-from src.api.v1.music.schemas.response import GetInfoResponse, GetResultResponse
+from config.config import app_settings
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+from src.api.v1.music.schemas.response import (
+    GetEstimateResponse,
+    GetInfoResponse,
+    GetResultResponse,
+)
 from src.api.v1.music.services.music import MusicService
 from src.core.basic_auth import basic_auth
-from src.core.utils import BaseResponse
+from src.core.utils import BaseResponse, etag_response
 
 router = APIRouter(prefix="/music", tags=["Music"])
 
@@ -16,39 +23,142 @@ router = APIRouter(prefix="/music", tags=["Music"])
 async def info(
     service: Annotated[MusicService, Depends()],
     tool: ToolTypeEnum,
+    request: Request,
+    response: Response,
     _auth: bool = Depends(basic_auth),
 ) -> BaseResponse[GetInfoResponse]:
 
-    return BaseResponse(
+    body = BaseResponse(
         data=await service.get_info(tool=tool),
         code=status.HTTP_200_OK,
     )
+    return etag_response(request, response, body, max_age=app_settings.STATS_TTL)
+
+
+@router.post("/estimate/{tool}", name="Estimate a conversion")
+async def estimate(
+    service: Annotated[MusicService, Depends()],
+    tool: ToolTypeEnum,
+    file: UploadFile = File(...),
+    preview: Annotated[
+        bool, Query(description="Only the first page and its first measures")
+    ] = False,
+    pages: Annotated[
+        str | None, Query(description="PDF pages to convert, e.g. 3-7,12")
+    ] = None,
+    _auth: bool = Depends(basic_auth),
+) -> BaseResponse[GetEstimateResponse]:
+    """
+    Page count, raster/vector breakdown, expected processing time and current
+    queue wait of a conversion, without running it
+    """
+
+    return BaseResponse(
+        data=await service.estimate(file=file, tool=tool, preview=preview, pages=pages),
+        code=status.HTTP_200_OK,
+    )
+
+
+# Declared before "/convert/{tool}" so that "batch" is not parsed as a tool
+@router.post("/convert/batch", name="Convert many sheet music files to MP3")
+async def convert_batch(
+    service: Annotated[MusicService, Depends()],
+    tool: ToolTypeEnum,
+    request: Request,
+    files: List[UploadFile] = File(...),
+    tempo: Annotated[int, Query(ge=40, le=240)] = 120,
+    transpose: Annotated[int, Query(ge=-12, le=12)] = 0,
+    soundfont: Annotated[
+        str | None, Query(description="SoundFont name, see the tool info")
+    ] = None,
+    user: str = Depends(basic_auth),
+):
+    """
+    Convert several PDFs/images (or zip archives of them) with shared settings
+    and return a zip of MP3s plus a manifest
+    """
+
+    return await service.convert_batch(
+        request=request,
+        files=files,
+        tool=tool,
+        tempo=tempo,
+        transpose=transpose,
+        soundfont=soundfont,
+        user=user,
+    )
 
 
 @router.post("/convert/{tool}", name="Convert sheet music to MP3")
 async def convert_music(
     service: Annotated[MusicService, Depends()],
     tool: ToolTypeEnum,
+    request: Request,
     file: UploadFile = File(...),
     tempo: Annotated[int, Query(ge=40, le=240)] = 120,
     transpose: Annotated[int, Query(ge=-12, le=12)] = 0,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    soundfont: Annotated[
+        str | None, Query(description="SoundFont name, see the tool info")
+    ] = None,
+    preview: Annotated[
+        bool, Query(description="Only the first page and its first measures")
+    ] = False,
+    pages: Annotated[
+        str | None, Query(description="PDF pages to convert, e.g. 3-7,12")
+    ] = None,
+    user: str = Depends(basic_auth),
+):
+    """
+    Single endpoint to return the converted file with metadata in headers.
+
+    `output` selects MP3, Opus or AAC audio, or stops before synthesis and
+    returns MIDI or MusicXML. `soundfont` picks one of the configured
+    SoundFonts for audio. `preview` quickly converts just the first page
+    with music, cut to its first measures, to check the recognition before a
+    full run; the full run then reuses the recognized page. `pages` limits
+    a PDF to the given pages; the others are never rasterized.
+    """
+
+    return await service.convert(
+        request=request,
+        file=file,
+        tool=tool,
+        tempo=tempo,
+        transpose=transpose,
+        output=output,
+        soundfont=soundfont,
+        preview=preview,
+        pages=pages,
+        user=user,
+    )
+
+
+@router.get("/results/{key}", name="Get result")
+async def get_result(
+    service: Annotated[MusicService, Depends()],
+    request: Request,
+    key: Annotated[str, PathParam(pattern="^[0-9a-f]{64}$")],
     _auth: bool = Depends(basic_auth),
 ):
     """
-    Single endpoint to return MP3 file with metadata in headers
+    Download a converted file again (supports Range requests for seeking)
     """
 
-    return await service.convert(file=file, tool=tool, tempo=tempo, transpose=transpose)
+    return await service.get_result(request=request, key=key)
 
 
 @router.get("/tools/{tool}/results", name="Get results")
 async def results(
     service: Annotated[MusicService, Depends()],
     tool: ToolTypeEnum,
+    request: Request,
+    response: Response,
     _auth: bool = Depends(basic_auth),
 ) -> BaseResponse[GetResultResponse]:
 
-    return BaseResponse(
+    body = BaseResponse(
         data=await service.get_results(tool=tool),
         code=status.HTTP_200_OK,
     )
+    return etag_response(request, response, body, max_age=app_settings.STATS_TTL)
@@ -5,3 +5,41 @@ class ToolTypeEnum(str, enum.Enum):
     AUDIVERIS = "AUDIVERIS"
     HOMR = "HOMR"
     OEMER = "OEMER"
+    AUTO = "AUTO"
+
+
+class OutputFormatEnum(str, enum.Enum):
+    MP3 = "mp3"
+    OPUS = "opus"
+    AAC = "aac"
+    MIDI = "midi"
+    MUSICXML = "musicxml"
+
+    @property
+    def suffix(self) -> str:
+        return _OUTPUT_SUFFIXES[self]
+
+    @property
+    def media_type(self) -> str:
+        return _OUTPUT_MEDIA_TYPES[self]
+
+    @property
+    def is_audio(self) -> bool:
+        return self not in (OutputFormatEnum.MIDI, OutputFormatEnum.MUSICXML)
+
+
+_OUTPUT_SUFFIXES = {
+    OutputFormatEnum.MP3: ".mp3",
+    OutputFormatEnum.OPUS: ".opus",
+    OutputFormatEnum.AAC: ".m4a",
+    OutputFormatEnum.MIDI: ".mid",
+    OutputFormatEnum.MUSICXML: ".musicxml",
+}
+
+_OUTPUT_MEDIA_TYPES = {
+    OutputFormatEnum.MP3: "audio/mpeg",
+    OutputFormatEnum.OPUS: "audio/ogg",
+    OutputFormatEnum.AAC: "audio/mp4",
+    OutputFormatEnum.MIDI: "audio/midi",
+    OutputFormatEnum.MUSICXML: "application/vnd.recordare.musicxml+xml",
+}
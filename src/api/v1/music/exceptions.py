@@ -1,5 +1,10 @@
 from src import constants
-from src.core.exceptions import AlreadyExistsError, NotFoundError, UnauthorizedError
+from src.core.exceptions import (
+    AlreadyExistsError,
+    BadRequestError,
+    NotFoundError,
+    UnauthorizedError,
+)
 
 
 class InvalidCredsException(UnauthorizedError):
@@ -8,3 +13,43 @@ class InvalidCredsException(UnauthorizedError):
     """
 
     message = constants.INVALID_CRED
+
+
+class NoScoresInUploadException(BadRequestError):
+    """
+    Raised when a batch upload contains no PDF or image files.
+    """
+
+    message = constants.NO_SCORES_IN_UPLOAD
+
+
+class ResultNotFoundException(NotFoundError):
+    """
+    Raised when a conversion result is not (or no longer) in the result cache.
+    """
+
+    message = constants.RESULT_NOT_FOUND
+
+
+class UnknownSoundFontException(BadRequestError):
+    """
+    Raised when a request names a SoundFont that is not configured or unusable.
+    """
+
+    message = constants.UNKNOWN_SOUNDFONT
+
+
+class InvalidPageRangeException(BadRequestError):
+    """
+    Raised when the `pages` selection of a conversion cannot be parsed.
+    """
+
+    message = constants.INVALID_PAGE_RANGE
+
+
+class ArchiveTooLargeException(BadRequestError):
+    """
+    Raised when a zip archive in a batch upload exceeds the `BATCH_MAX_*` limits.
+    """
+
+    message = constants.ARCHIVE_TOO_LARGE
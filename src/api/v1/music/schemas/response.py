@@ -3,11 +3,22 @@ from typing import List, Optional
 from src.core.utils import CamelCaseModel
 
 
+class ToolStats(CamelCaseModel):
+    jobs: int
+    success_rate: Optional[float]
+    seconds_per_page_p50: Optional[float]
+    seconds_per_page_p95: Optional[float]
+    queue_wait_p50: Optional[float]
+    queue_wait_p95: Optional[float]
+    window_seconds: int
+
+
 class GetResultResponse(CamelCaseModel):
     processing_time: str
     accuracy: str
     pros: List[str]
     cons: List[str]
+    stats: ToolStats
 
 
 class MusicResponse(CamelCaseModel):
@@ -20,3 +31,17 @@ class MusicResponse(CamelCaseModel):
 
 class GetInfoResponse(CamelCaseModel):
     note: str
+    stats: ToolStats
+    soundfonts: List[str]
+
+
+class GetEstimateResponse(CamelCaseModel):
+    pages: int
+    total_pages: int
+    raster_pages: Optional[int]
+    vector_pages: Optional[int]
+    seconds_per_page: float
+    measured: bool
+    estimated_seconds: float
+    queue_wait_seconds: Optional[float]
+    stats: ToolStats
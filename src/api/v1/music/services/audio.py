@@ -0,0 +1,259 @@
+import logging
+import math
+import os
+import subprocess
+import threading
+import wave
+from pathlib import Path
+from typing import Iterator
+
+from src.api.v1.music.enums import OutputFormatEnum
+from src.core.metrics import timed
+from src.core.processes import kill_tool, start_tool, wait_tool
+
+# Final audio of a job: the rendered WAVs are measured here, in-process, then
+# merged and encoded once with a single gain applied to the whole document.
+# numpy is imported inside the functions (see `src.core.warmup`).
+
+log = logging.getLogger(__name__)
+
+# FFmpeg codec options per audio format. MP3 keeps FFmpeg's defaults.
+ENCODER_ARGS = {
+    OutputFormatEnum.MP3: [],
+    OutputFormatEnum.OPUS: ["-c:a", "libopus", "-b:a", "96k"],
+    OutputFormatEnum.AAC: ["-c:a", "aac", "-b:a", "128k"],
+}
+
+# Loudness target, as the RMS level (dBFS) of the non-silent audio.
+TARGET_LEVEL_DB = -20.0
+# The gain never pushes the loudest sample above this level (dBFS).
+PEAK_CEILING_DB = -1.0
+# Nearly silent documents are not boosted by more than this.
+MAX_GAIN_DB = 20.0
+# Blocks quieter than this (dBFS) are left out of the level, so silence between
+# and after pages does not make the document look quiet.
+SILENCE_GATE_DB = -70.0
+BLOCK_SECONDS = 0.4
+
+# numpy dtype, offset, full scale and FFmpeg raw format per WAV sample width
+# (8-bit WAV is unsigned).
+_SAMPLE_FORMATS = {
+    1: ("uint8", 128, 2**7, "u8"),
+    2: ("<i2", 0, 2**15, "s16le"),
+    4: ("<i4", 0, 2**31, "s32le"),
+}
+
+
+def _db(power: float) -> float:
+    return 10 * math.log10(power)
+
+
+class LoudnessMeter:
+    """
+    Running level statistics of a PCM stream, fed one block at a time so a
+    whole document is measured without holding it in memory.
+
+    Attributes:
+        energy (float): Sum of squared samples of the blocks above the gate.
+        samples (int): Number of samples in those blocks.
+        peak (float): Largest absolute sample seen, as a fraction of full scale.
+    """
+
+    def __init__(self):
+        self.energy = 0.0
+        self.samples = 0
+        self.peak = 0.0
+
+    def add(self, block) -> None:
+        """
+        Add a block of samples (a numpy array scaled to [-1, 1]).
+        """
+
+        if not block.size:
+            return
+        energy = float((block * block).sum())
+        self.peak = max(self.peak, float(abs(block).max()))
+        if energy and _db(energy / block.size) > SILENCE_GATE_DB:
+            self.energy += energy
+            self.samples += block.size
+
+    @property
+    def level_db(self) -> float | None:
+        """
+        RMS level of the non-silent audio in dBFS, or None if all silent.
+        """
+
+        return _db(self.energy / self.samples) if self.samples else None
+
+    def gain_db(self) -> float:
+        """
+        Gain bringing the stream to `TARGET_LEVEL_DB`, limited so the peak stays
+        under `PEAK_CEILING_DB` and boosts stay under `MAX_GAIN_DB`.
+        """
+
+        level = self.level_db
+        if level is None:
+            return 0.0
+        gain = min(TARGET_LEVEL_DB - level, MAX_GAIN_DB)
+        if self.peak:
+            gain = min(gain, PEAK_CEILING_DB - 20 * math.log10(self.peak))
+        return gain
+
+
+def wav_format(wav_path: Path) -> tuple[int, int, int]:
+    """
+    Channels, sample width (bytes) and sample rate of a PCM WAV file.
+
+    Raises:
+        ValueError: If the file is not a WAV file this module can read.
+    """
+
+    try:
+        with wave.open(str(wav_path), "rb") as wav:
+            params = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Cannot read {wav_path.name}: {e}") from e
+    if params[1] not in _SAMPLE_FORMATS:
+        raise ValueError(f"Unsupported sample width in {wav_path.name}")
+    return params
+
+
+def read_frames(wav_path: Path) -> Iterator[bytes]:
+    """
+    Yield the raw PCM frames of a WAV file (headers and trailing chunks left
+    out) in blocks of `BLOCK_SECONDS`.
+    """
+
+    with wave.open(str(wav_path), "rb") as wav:
+        frames = max(1, int(wav.getframerate() * BLOCK_SECONDS))
+        while chunk := wav.readframes(frames):
+            yield chunk
+
+
+def read_pcm(wav_path: Path) -> Iterator:
+    """
+    Yield the samples of a PCM WAV file in blocks of `BLOCK_SECONDS`, scaled to
+    [-1, 1] (channels interleaved).
+    """
+
+    import numpy as np
+
+    dtype, offset, scale, _ = _SAMPLE_FORMATS[wav_format(wav_path)[1]]
+    for chunk in read_frames(wav_path):
+        samples = np.frombuffer(chunk, dtype=dtype).astype(np.float32)
+        yield (samples - offset) / scale
+
+
+@timed("normalize")
+def measure_loudness(wav_paths: list[Path]) -> LoudnessMeter:
+    """
+    Measure the level of several WAV files as one continuous document.
+    """
+
+    meter = LoudnessMeter()
+    for wav_path in wav_paths:
+        try:
+            for block in read_pcm(wav_path):
+                meter.add(block)
+        except (ValueError, wave.Error, EOFError) as e:
+            log.warning(f"Cannot measure {wav_path.name}, ignoring its level: {e}")
+    return meter
+
+
+def encode_wavs(
+    wav_paths: list[Path],
+    audio_path: Path,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+) -> Path:
+    """
+    Merge WAV files, in order, into one normalized audio file.
+
+    The level is measured across all the files first (see `measure_loudness`),
+    so every page gets the same gain. The pages' PCM frames are then piped
+    back to back into a single FFmpeg run, which applies the gain and encodes:
+    the merge is gapless, needs no concat list and spawns one process per
+    document, whatever its page count.
+
+    Parameters:
+        wav_paths (list[Path]): Rendered audio, in playback order. All files
+            must share channels, sample width and rate.
+        audio_path (Path): Output path for the final audio file.
+        output (OutputFormatEnum): Audio format to encode.
+
+    Returns:
+        Path: `audio_path`.
+
+    Raises:
+        ValueError: If a WAV file is unreadable or the formats differ.
+        subprocess.CalledProcessError: If FFmpeg fails.
+        subprocess.TimeoutExpired: If FFmpeg runs longer than its timeout.
+        JobCancelled: If the job was cancelled meanwhile.
+    """
+
+    formats = {wav_format(wav_path) for wav_path in wav_paths}
+    if len(formats) != 1:
+        raise ValueError(f"WAV files differ in format: {sorted(formats)}")
+    channels, sample_width, rate = formats.pop()
+
+    meter = measure_loudness(wav_paths)
+    gain = meter.gain_db()
+    log.info(
+        f"Encoding {len(wav_paths)} WAV file(s) → {output.value}, "
+        f"level {meter.level_db} dBFS, gain {gain:+.2f} dB"
+    )
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        _SAMPLE_FORMATS[sample_width][3],
+        "-ar",
+        str(rate),
+        "-ac",
+        str(channels),
+        "-i",
+        "pipe:0",
+        "-filter:a",
+        f"volume={gain:.2f}dB",
+        *ENCODER_ARGS[output],
+        str(audio_path),
+    ]
+    errors: list[Exception] = []
+
+    def feed(pipe) -> None:
+        # In a thread, so that a stalled FFmpeg is still killed by the stage
+        # timeout or a cancellation (see `wait_tool`)
+        try:
+            with pipe:
+                for wav_path in wav_paths:
+                    for chunk in read_frames(wav_path):
+                        pipe.write(chunk)
+        except BrokenPipeError:
+            # FFmpeg exited early or was killed; its return code tells why
+            pass
+        except Exception as e:
+            errors.append(e)
+            kill_tool(process)
+
+    with timed("encode"):
+        read_end, write_end = os.pipe()
+        try:
+            process = start_tool(command, stdin=read_end)
+        except BaseException:
+            os.close(write_end)
+            raise
+        finally:
+            os.close(read_end)
+        feeder = threading.Thread(
+            target=feed, args=(open(write_end, "wb"),), name="encode-feed"
+        )
+        feeder.start()
+        try:
+            wait_tool(process, "encode")
+        finally:
+            feeder.join()
+    if errors:
+        raise errors[0]
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return audio_path
@@ -1,27 +1,36 @@
 import logging
-import os
 import shutil
 import subprocess
+from itertools import islice
 from pathlib import Path
+from typing import Callable, Iterator
 
-import fitz  # PyMuPDF
-from dotenv import load_dotenv
-from music21 import chord, converter, note, stream, tempo
 from natsort import natsorted
-from pdf2image import convert_from_path
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageStat
 
-load_dotenv()
+from config.config import tool_settings
+from src.api.v1.music.enums import OutputFormatEnum
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.api.v1.music.services.export import export_scores
+from src.api.v1.music.services.pages import (
+    PageCache,
+    filter_pages,
+    is_raster_page,
+    select_pages,
+)
+from src.api.v1.music.services.pipeline import JobResult, Stage, run_pipeline
+from src.core.metrics import timed
+from src.core.processes import run_tool
 
-# Optionally set TESSDATA_PREFIX
-tessdata_prefix = os.getenv("TESSDATA_PREFIX")
-if tessdata_prefix:
-    os.environ["TESSDATA_PREFIX"] = tessdata_prefix
+# music21, pdf2image, PyMuPDF and PIL are imported inside the functions that need
+# them, so importing this module stays cheap (see `src.core.warmup`).
 
-audiveris_bin = Path(os.getenv("AUDIVERIS_BIN", "/opt/audiveris/bin/Audiveris"))
-soundfont_path = Path(
-    os.getenv("SOUNDFONT_PATH", "/usr/share/sounds/sf2/FluidR3_GM.sf2")
-)
+audiveris_bin = Path(tool_settings.AUDIVERIS_BIN)
+soundfont_path = Path(tool_settings.SOUNDFONT_PATH)
+
+# Most pages Audiveris is started on at once. Every run pays for starting the
+# JVM and loading Audiveris, so pages that queued up while it was busy share one
+# run; the first page still starts alone, without waiting for the others.
+BATCH_PAGES = 8
 
 # === Logging setup ===
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -52,6 +61,9 @@ def check_dependencies():
 
 
 def preprocess_images(input_path: Path, temp_dir: Path):
+    from pdf2image import convert_from_path
+    from PIL import Image
+
     temp_dir.mkdir(exist_ok=True)
     images = []
 
@@ -73,7 +85,25 @@ def preprocess_images(input_path: Path, temp_dir: Path):
     return images
 
 
-def enhance_image(img_path: Path):
+@timed("enhance")
+def enhance_image(img_path: Path, out_dir: Path, target_width=2480) -> Path:
+    """
+    Clean up a scanned page for Audiveris.
+
+    The page is inverted if dark, contrast-stretched, sharpened, upscaled to
+    at least `target_width` pixels and binarized. It is saved as a 1-bit PNG:
+    an eighth of the pixel data of a grayscale page on disk and when Audiveris
+    decodes it, which it reads like any other PNG.
+
+    The original is left alone: the page may be rasterized again over it (a
+    resumed job) and slower fallbacks read it as it was.
+
+    Returns:
+        Path: The enhanced copy, `{stem}_audiveris.png` in `out_dir`.
+    """
+
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+
     img = Image.open(img_path).convert("L")
 
     # Invert if dark
@@ -86,62 +116,67 @@ def enhance_image(img_path: Path):
     # Step 2: Unsharp mask (improves line detection)
     img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150))
 
-    # Step 3: Binarize
+    # Step 3: Upscale small pages, before binarizing so edges stay sharp
+    if img.width < target_width:
+        h_size = int(img.height * target_width / img.width)
+        img = img.resize((target_width, h_size), Image.LANCZOS)
+
+    # Step 4: Binarize, and keep the page bilevel
     threshold = 180
     img = img.point(lambda x: 255 if x > threshold else 0, "1")
-
-    # Final conversion back to grayscale
-    img = img.convert("L")
-    img.save(img_path)
-
-
-def resize_image(img_path: Path, target_width=2480):
-
-    img = Image.open(img_path)
-    if img.width >= target_width:
-        return  # already large enough
-    w_percent = target_width / float(img.size[0])
-    h_size = int((float(img.size[1]) * float(w_percent)))
-    img = img.resize((target_width, h_size), Image.LANCZOS)
-    img.save(img_path)
+    enhanced = out_dir / f"{img_path.stem}_audiveris.png"
+    img.save(enhanced)
+    return enhanced
 
 
 # === Convert input to images ===
-def convert_to_images(input_path: Path, temp_dir: Path) -> list[Path]:
+def convert_to_images(
+    input_path: Path, temp_dir: Path, pages: list[int] | None = None
+) -> Iterator[Path]:
     """
     Convert a PDF file or copy a single image into a temporary image directory.
 
     Parameters:
         input_path (Path): Path to input PDF or image.
         temp_dir (Path): Directory to store output images.
+        pages (list[int] | None): PDF pages to convert (see
+            `pages.select_pages`); all if None. Ignored for images.
 
-    Returns:
-        list[Path]: List of generated or copied image paths.
+    Yields:
+        Path: Generated or copied image paths, one page at a time.
 
     Notes:
-    - PDFs are split into 400 DPI grayscale PNGs.
+    - PDFs are split into 400 DPI grayscale PNGs, rasterizing a single page per step
+      so later stages can start on page 1 while page 2 is still being rendered.
+      Pages that are not selected are never decoded.
     - Single image files (JPG, PNG) are copied and renamed as page_001.png.
     """
 
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
     temp_dir.mkdir(parents=True, exist_ok=True)
-    image_paths = []
     if input_path.suffix.lower() == ".pdf":
         log.info("Converting PDF to high-res grayscale images...")
-        pages = convert_from_path(str(input_path), dpi=400)
-        for i, page in enumerate(pages):
-            page = page.convert("L")
-            img_path = temp_dir / f"page_{i+1:03}.png"
-            page.save(img_path)
-            image_paths.append(img_path)
+        page_count = pdfinfo_from_path(str(input_path))["Pages"]
+        for i in select_pages(pages, page_count):
+            with timed("rasterize"):
+                page = convert_from_path(
+                    str(input_path), dpi=400, first_page=i, last_page=i
+                )[0]
+                page = page.convert("L")
+                img_path = temp_dir / f"page_{i:03}.png"
+                page.save(img_path)
+            yield img_path
     else:
         log.info(f"Copying input image: {input_path.name}")
-        img_path = temp_dir / "page_001.png"
-        shutil.copy(input_path, img_path)
-        image_paths.append(img_path)
-    return image_paths
+        with timed("rasterize"):
+            img_path = temp_dir / "page_001.png"
+            shutil.copy(input_path, img_path)
+        yield img_path
 
 
 # === Run Audiveris ===
+@timed("omr")
 def run_audiveris(images: list[Path], out_dir: Path):
     """
     Run Audiveris OMR in batch mode on a list of image files to extract MusicXML.
@@ -159,7 +194,7 @@ def run_audiveris(images: list[Path], out_dir: Path):
 
     try:
         with open(log_path, "w") as logfile:
-            subprocess.run(
+            run_tool(
                 [
                     str(audiveris_bin),
                     "-batch",
@@ -168,7 +203,7 @@ def run_audiveris(images: list[Path], out_dir: Path):
                     str(out_dir),
                     *map(str, images),  # Unpacks each image path
                 ],
-                check=True,
+                "omr",
                 stdout=logfile,
                 stderr=subprocess.STDOUT,
             )
@@ -183,7 +218,7 @@ def run_audiveris(images: list[Path], out_dir: Path):
             per_image_log = out_dir / f"{img.stem}_audiveris.log"
             try:
                 with open(per_image_log, "w") as logfile:
-                    subprocess.run(
+                    run_tool(
                         [
                             str(audiveris_bin),
                             "-batch",
@@ -192,7 +227,7 @@ def run_audiveris(images: list[Path], out_dir: Path):
                             str(out_dir),
                             str(img),
                         ],
-                        check=True,
+                        "omr",
                         stdout=logfile,
                         stderr=subprocess.STDOUT,
                     )
@@ -201,13 +236,17 @@ def run_audiveris(images: list[Path], out_dir: Path):
 
 
 # === MuseScore fallback ===
-def try_musescore_fallback(input_file: Path, out_dir: Path) -> list[Path]:
+def try_musescore_fallback(
+    input_file: Path, out_dir: Path, pages: list[int] | None = None
+) -> list[Path]:
     """
     Fallback method to convert a PDF to MusicXML using MuseScore's CLI export.
 
     Parameters:
         input_file (Path): Path to PDF file.
         out_dir (Path): Directory to store the converted MusicXML.
+        pages (list[int] | None): Pages to convert, copied to a PDF of their
+            own for MuseScore; all if None.
 
     Returns:
         list[Path]: List containing the generated .mxl file, or empty list on failure.
@@ -222,17 +261,38 @@ def try_musescore_fallback(input_file: Path, out_dir: Path) -> list[Path]:
     )
     if not musescore or input_file.suffix.lower() != ".pdf":
         return []
+    if pages is not None:
+        input_file = extract_pages(input_file, pages, out_dir)
     output_xml = out_dir / (input_file.stem + ".mxl")
     log.info("Running MuseScore fallback...")
     try:
-        subprocess.run([musescore, str(input_file), "-o", str(output_xml)], check=True)
+        run_tool([musescore, str(input_file), "-o", str(output_xml)], "musescore")
         if output_xml.exists():
             return [output_xml]
-    except subprocess.CalledProcessError:
+    except subprocess.SubprocessError:
         log.error("MuseScore fallback failed.")
     return []
 
 
+def extract_pages(pdf_path: Path, pages: list[int], out_dir: Path) -> Path:
+    """
+    Copy some pages of a PDF to a new PDF in `out_dir`.
+
+    Returns:
+        Path: The new PDF, or `pdf_path` itself if `pages` are all of its pages.
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(str(pdf_path)) as doc:
+        if pages == list(range(1, doc.page_count + 1)):
+            return pdf_path
+        doc.select([number - 1 for number in pages])
+        target = out_dir / f"{pdf_path.stem}_pages.pdf"
+        doc.save(str(target))
+    return target
+
+
+@timed("musescore_fix")
 def fix_musicxml_with_musescore(
     input_file: Path, musescore_exe: str = "musescore3"
 ) -> Path:
@@ -245,214 +305,216 @@ def fix_musicxml_with_musescore(
 
     cmd = [musescore_exe, str(input_file), "--export-to", str(fixed_file)]
 
-    subprocess.run(cmd, check=True)
+    run_tool(cmd, "musescore")
     return fixed_file
 
 
-# === MusicXML → MIDI ===
-def convert_to_midi(
-    mp3_base: str,
-    mxl_files: list[Path],
-    out_dir: Path,
-    bpm: int,
-    transpose_interval: int = 0,
-) -> Path | None:
+def load_musicxml(mxl_file: Path):
     """
-    Convert one or more MusicXML files into a single MIDI file.
+    Fix a MusicXML file with MuseScore and parse it with music21.
 
     Parameters:
-        mp3_base (str): Base name for output MIDI file.
-        mxl_files (list[Path]): List of MusicXML (.mxl/.xml) files.
-        out_dir (Path): Directory to save the MIDI file.
+        mxl_file (Path): MusicXML (.mxl/.xml) file produced by OMR.
 
     Returns:
-        Path | None: Path to the generated MIDI file, or None if failed.
-
-    Additional Features:
-    - Removes repeat marks and tempo anomalies.
-    - Inserts consistent tempo (160 BPM).
-    - Applies quantization to fix note timing artifacts.
+        music21.stream.Score: The parsed score.
     """
 
-    midi_path = out_dir / f"{mp3_base}.mid"
-    log.info("Converting MusicXML to MIDI...")
+    from music21 import converter
+
+    fixed_file = fix_musicxml_with_musescore(mxl_file)
+    with timed("parse"):
+        return converter.parse(fixed_file)
+
+
+def is_raster_pdf(pdf_path: Path, page_index: int = 0) -> bool:
+    """
+    Determine if a PDF page is raster (scanned/screenshot) or vector (digital).
+    Inspects the first page unless `page_index` is given.
+    Returns True if raster, False if vector.
+    """
+    import fitz  # PyMuPDF
 
     try:
-        if len(mxl_files) == 1:
-            fixed_file = fix_musicxml_with_musescore(mxl_files[0])
-            score = converter.parse(fixed_file)
-        else:
-            score = stream.Score()
-            for f in natsorted(mxl_files):
-                fixed_file = fix_musicxml_with_musescore(f)
-                part = converter.parse(fixed_file)
-                score.append(part)
-
-        if transpose_interval != 0:
-            log.info(f"Transposing all notes by {transpose_interval} semitone(s)...")
-            score = score.transpose(transpose_interval)
-
-        # Remove broken repeat marks
-        for el in score.recurse():
-            if el.classes and ("Repeat" in el.classes or "RepeatBracket" in el.classes):
-                el.activeSite.remove(el)
-
-        # Clean tempo and add uniform tempo
-        for t in score.recurse().getElementsByClass(tempo.MetronomeMark):
-            t.activeSite.remove(t)
-        score.insert(0, tempo.MetronomeMark(number=bpm))
-
-        score.quantize(inPlace=True)
-        score.write("midi", fp=str(midi_path))
-        log.info(f"MIDI saved: {midi_path}")
-        return midi_path
+        with fitz.open(str(pdf_path)) as doc:
+            return is_raster_page(doc.load_page(page_index))
     except Exception as e:
-        log.error(f"MIDI conversion failed: {e}")
-        return None
+        log.warning(f"Unable to inspect PDF structure: {e}")
+    return True  # fallback: assume raster
 
 
-# === MIDI → MP3 ===
-def convert_midi_to_mp3(midi_path: Path, mp3_path: Path):
+def find_musicxml(img_path: Path, out_dir: Path) -> Path | None:
+    """
+    Locate the MusicXML exported by Audiveris for a single page image.
     """
-    Convert a MIDI file to MP3 using FluidSynth and FFmpeg.
 
-    Parameters:
-        midi_path (Path): Path to the input .mid file.
-        mp3_path (Path): Output path for the final MP3.
+    matches = natsorted(out_dir.rglob(f"{img_path.stem}*.mxl")) or natsorted(
+        out_dir.rglob(f"{img_path.stem}*.xml")
+    )
+    matches = [m for m in matches if not m.name.endswith(".fixed.xml")]
+    return matches[0] if matches else None
 
-    Workflow:
-    - FluidSynth renders the MIDI to a WAV file using the configured SoundFont.
-    - FFmpeg normalizes and encodes the WAV file to MP3.
-    - The temporary WAV is deleted after use.
 
-    Plays the MP3 if successfully created.
+def recognize_pages(
+    images: list[Path],
+    work_dir: Path,
+    page_cache: PageCache,
+    enhance: Callable[[Path], Path] | None = None,
+) -> list[Path | None]:
     """
+    Recognize pages with a single Audiveris run, reusing the MusicXML of pages
+    recognized before.
 
-    if not midi_path or not midi_path.exists():
-        log.error("No valid MIDI to convert.")
-        return
-
-    wav_path = midi_path.with_suffix(".wav")
-    log.info("Converting MIDI → MP3 with normalization...")
-    try:
-        subprocess.run(
-            [
-                "fluidsynth",
-                "-ni",
-                str(soundfont_path),
-                str(midi_path),
-                "-F",
-                str(wav_path),
-                "-r",
-                "44100",
-                "-g",
-                "1.0",
-            ],
-            check=True,
-        )
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                str(wav_path),
-                "-filter:a",
-                "loudnorm",
-                str(mp3_path),
-            ],
-            check=True,
-        )
-        wav_path.unlink(missing_ok=True)
-        log.info(f"MP3 created: {mp3_path}")
-    except subprocess.CalledProcessError:
-        log.error("Error converting MIDI to MP3.")
+    Pages are looked up in `page_cache` as rasterized, before any enhancement,
+    so AUTO and AUDIVERIS jobs share their results.
 
+    Parameters:
+        images (list[Path]): Rasterized pages.
+        work_dir (Path): Directory for the output of Audiveris.
+        page_cache (PageCache): Cache of the Audiveris results.
+        enhance (Callable | None): Prepares a page missing from the cache for
+            Audiveris, returning the image to read instead (see `enhance_image`);
+            pages are read as they are if None.
 
-def is_raster_pdf(pdf_path: Path) -> bool:
-    """
-    Determine if a PDF is raster (scanned/screenshot) or vector (digital).
-    Returns True if raster, False if vector.
+    Returns:
+        list[Path | None]: MusicXML of each page, or None if nothing was recognized.
     """
-    try:
-        with fitz.open(str(pdf_path)) as doc:
-            page = doc.load_page(0)  # first page
-            text = page.get_text()
-            drawings = page.get_drawings()
-            images = page.get_images(full=True)
-
-            # Heuristics:
-            if text.strip():
-                return False  # text exists → likely vector
-            if drawings:
-                return False  # vector shapes → vector
-            if images and not drawings:
-                return True  # image-only page → raster
-    except Exception as e:
-        log.warning(f"Unable to inspect PDF structure: {e}")
-    return True  # fallback: assume raster
+
+    def run(pages: list[Path]) -> list[Path | None]:
+        if enhance:
+            pages = [enhance(img_path) for img_path in pages]
+        run_audiveris(pages, work_dir)
+        return [find_musicxml(img_path, work_dir) for img_path in pages]
+
+    return page_cache.recognize_batch(images, run)
 
 
 # === Pipeline ===
 def process_input(
-    input_file: Path, output_dir: Path, bpm: int = 120, transpose_interval: int = 0
-):
+    input_file: Path,
+    output_dir: Path,
+    bpm: int = 120,
+    transpose_interval: int = 0,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    soundfont: Path | None = None,
+    checkpoint: Checkpoint | None = None,
+    max_pages: int | None = None,
+    max_measures: int | None = None,
+    pages: list[int] | None = None,
+) -> JobResult:
     """
     Full pipeline for processing a single sheet music input file.
 
     Parameters:
         input_file (Path): Input file (PDF or image).
         output_dir (Path): Root output directory.
+        output (OutputFormatEnum): Format of the result.
+        soundfont (Path | None): SoundFont for audio output; the default if None.
+        checkpoint (Checkpoint | None): Manifest to resume from and record in;
+            one in `output_dir` if None.
+        max_pages (int | None): Stop after this many pages with music (the
+            later pages are not even rasterized); all pages if None.
+        max_measures (int | None): Measures of the first page to keep (see
+            `export.prepare_score`); everything if None.
+        pages (list[int] | None): PDF pages to convert, e.g. from
+            `pages.parse_page_ranges`; all if None.
+
+    Returns:
+        JobResult: The output file (if any) and the pages skipped before OMR.
 
     Workflow:
-    - Converts input to image(s).
-    - Runs Audiveris to generate MusicXML.
-    - Falls back to MuseScore if Audiveris fails.
-    - Converts MusicXML → MIDI → MP3.
-    - Plays final audio output.
+    - Streams pages through rasterize → enhance/Audiveris → MuseScore fix/parse,
+      so each page moves to the next stage as soon as it is ready. Pages waiting
+      for Audiveris are recognized together, in one run of up to `BATCH_PAGES`.
+    - Skips pages without staves and reuses MusicXML of identical pages.
+    - Falls back to MuseScore if Audiveris produced nothing for the pages with
+      music (not if there were none), converting only those pages.
+    - Exports the combined pages as MusicXML, MIDI or audio.
     """
 
     base_name = input_file.stem
     work_dir = output_dir / base_name
     image_dir = work_dir / "images"
     work_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = checkpoint or Checkpoint(output_dir)
+    result = JobResult()
 
     # Check if raster PDF (before converting to images)
     raster_like = False
-    if input_file.suffix.lower() == ".pdf":
-        raster_like = is_raster_pdf(input_file)
+    is_pdf = input_file.suffix.lower() == ".pdf"
+    if is_pdf:
+        raster_like = is_raster_pdf(input_file, pages[0] - 1 if pages else 0)
         log.info(
             f"PDF is {'raster (screenshot/scan)' if raster_like else 'vector (clean print)'}"
         )
 
-    images = convert_to_images(input_file, image_dir)
-    if not images:
-        log.error("No images found or converted.")
-        return
+    def enhance(img_path: Path) -> Path:
+        log.info(f"Enhancing image (raster source): {img_path.name}")
+        return enhance_image(img_path, work_dir)
 
-    # Preprocess only if the PDF is raster
-    if raster_like:
-        for img_path in images:
-            log.info(f"Enhancing image (raster source): {img_path.name}")
-            enhance_image(img_path)
-            resize_image(img_path)
+    page_cache = PageCache("AUDIVERIS")
 
-    else:
-        for img_path in images:
-            log.info(f"Skipping enhancement (vector source): {img_path.name}")
+    def recognize(images: list[Path]) -> list[Path | None]:
+        # Preprocess only if the PDF is raster; the checkpoint keeps a resumed
+        # job from enhancing a page twice
+        return recognize_pages(
+            images,
+            work_dir,
+            page_cache,
+            checkpoint.stage("enhance", enhance) if raster_like else None,
+        )
 
-    run_audiveris(images, work_dir)
+    # Pages with music, i.e. those that reach OMR
+    music_pages: list[Path] = []
+
+    def read_pages() -> Iterator[Path]:
+        for img_path in islice(
+            filter_pages(
+                checkpoint.pages(convert_to_images(input_file, image_dir, pages)),
+                result.skipped_pages,
+                pages if is_pdf else None,
+            ),
+            max_pages,
+        ):
+            music_pages.append(img_path)
+            yield img_path
+
+    scores = run_pipeline(
+        read_pages(),
+        [
+            Stage(
+                "audiveris",
+                checkpoint.batch_stage("musicxml", recognize),
+                batch=BATCH_PAGES,
+            ),
+            Stage("musicxml", load_musicxml),
+        ],
+    )
 
-    mxl_files = list(work_dir.rglob("*.mxl")) or list(work_dir.rglob("*.xml"))
-    if not mxl_files:
+    # Nothing to fall back for if every page was dropped as blank or without
+    # staves: MuseScore would only import the text or artwork they hold
+    if not scores and music_pages:
         log.info("Trying MuseScore fallback...")
-        mxl_files = try_musescore_fallback(input_file, work_dir)
-
-    if not mxl_files:
+        # Only the selected pages with music, not all of the PDF
+        page_numbers = [int(img_path.stem.split("_")[-1]) for img_path in music_pages]
+        scores = [
+            load_musicxml(f)
+            for f in try_musescore_fallback(input_file, work_dir, sorted(page_numbers))
+        ]
+
+    if not scores:
         log.error("No MusicXML files found.")
-        return
-
-    midi_path = convert_to_midi(
-        base_name, mxl_files, work_dir, bpm=bpm, transpose_interval=transpose_interval
+        return result
+
+    result.output_path = export_scores(
+        base_name,
+        scores,
+        work_dir,
+        bpm=bpm,
+        transpose_interval=transpose_interval,
+        output=output,
+        soundfont=soundfont,
+        checkpoint=checkpoint,
+        max_measures=max_measures,
     )
-    mp3_path = work_dir / f"{base_name}.mp3"
-    convert_midi_to_mp3(midi_path, mp3_path)
+    return result
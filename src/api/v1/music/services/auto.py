@@ -0,0 +1,288 @@
+import logging
+from itertools import islice
+from pathlib import Path
+
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+from src.api.v1.music.services import audiveris, homr, oemer
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.api.v1.music.services.export import export_scores
+from src.api.v1.music.services.pages import PageCache, filter_pages
+from src.api.v1.music.services.pipeline import JobResult, Stage, run_pipeline
+from src.core.metrics import timed
+
+log = logging.getLogger(__name__)
+
+# Backends ordered from fastest to slowest; fallbacks only ever move to the right.
+SPEED_ORDER = [ToolTypeEnum.AUDIVERIS, ToolTypeEnum.HOMR, ToolTypeEnum.OEMER]
+
+# Pages are analysed at this width; enough to see staff lines, cheap to compute.
+ANALYSIS_WIDTH = 1000
+
+# Share of pixels that are neither ink nor paper. Clean prints and good scans are
+# almost purely bimodal, phone photos carry shadows and gradients.
+MAX_MIDTONE_RATIO = 0.12
+
+# Share of edge energy that is close to horizontal or vertical. Engraved notation
+# is dominated by staff lines and stems; handwriting is much more isotropic.
+MIN_AXIS_ALIGNED_RATIO = 0.6
+
+
+def midtone_ratio(img) -> float:
+    """
+    Fraction of pixels in the 64–192 gray range.
+    """
+
+    histogram = img.histogram()
+    return sum(histogram[64:192]) / max(sum(histogram), 1)
+
+
+def axis_aligned_ratio(img) -> float:
+    """
+    Fraction of gradient magnitude whose direction is within 10° of an axis.
+    """
+
+    import cv2
+    import numpy as np
+
+    pixels = np.asarray(img, dtype=np.float32)
+    gx = cv2.Sobel(pixels, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(pixels, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = np.hypot(gx, gy)
+    total = float(magnitude.sum())
+    if total == 0:
+        return 1.0
+
+    angle = np.degrees(np.arctan2(np.abs(gy), np.abs(gx)))  # 0–90
+    aligned = (angle < 10) | (angle > 80)
+    return float(magnitude[aligned].sum()) / total
+
+
+@timed("route")
+def choose_tool(img_path: Path, raster: bool) -> ToolTypeEnum:
+    """
+    Pick the fastest backend likely to read a single page.
+
+    Parameters:
+        img_path (Path): Rasterized page.
+        raster (bool): Whether the page came from a scan/photo rather than a vector PDF.
+
+    Returns:
+        ToolTypeEnum: AUDIVERIS for clean prints, HOMR for handwriting,
+        OEMER for noisy photos of printed music.
+    """
+
+    from PIL import Image, ImageStat
+
+    if not raster:
+        return ToolTypeEnum.AUDIVERIS
+
+    img = Image.open(img_path).convert("L")
+    img.thumbnail((ANALYSIS_WIDTH, ANALYSIS_WIDTH * 2))
+
+    # Invert if dark, as `audiveris.enhance_image` does
+    if ImageStat.Stat(img).mean[0] < 100:
+        img = img.point(lambda x: 255 - x)
+
+    if axis_aligned_ratio(img) < MIN_AXIS_ALIGNED_RATIO:
+        return ToolTypeEnum.HOMR
+    if midtone_ratio(img) > MAX_MIDTONE_RATIO:
+        return ToolTypeEnum.OEMER
+    return ToolTypeEnum.AUDIVERIS
+
+
+def recognize(img_path: Path, tool: ToolTypeEnum, work_dir: Path) -> Path | None:
+    """
+    Run HOMR or OEMER on one page image; Audiveris reads pages in batches (see
+    `audiveris.recognize_pages`).
+
+    Parameters:
+        img_path (Path): Rasterized page.
+        tool (ToolTypeEnum): Backend to run.
+        work_dir (Path): Directory for the backend's output.
+
+    Returns:
+        Path | None: The MusicXML produced, or None if the backend found nothing.
+    """
+
+    if tool == ToolTypeEnum.HOMR:
+        return homr.run_homr(img_path)
+    return oemer.run_oemer(img_path, work_dir)
+
+
+def main(
+    input_file: Path,
+    output_dir: Path,
+    bpm: int = 120,
+    transpose_interval: int = 0,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    soundfont: Path | None = None,
+    checkpoint: Checkpoint | None = None,
+    max_pages: int | None = None,
+    max_measures: int | None = None,
+    pages: list[int] | None = None,
+) -> JobResult:
+    """
+    Convert a PDF or image by routing every page to its own OMR backend.
+
+    Parameters:
+        input_file (Path): Input file (PDF or image).
+        output_dir (Path): Root output directory.
+        output (OutputFormatEnum): Format of the result.
+        soundfont (Path | None): SoundFont for audio output; the default if None.
+        checkpoint (Checkpoint | None): Manifest to resume from and record in;
+            one in `output_dir` if None.
+        max_pages (int | None): Stop after this many pages with music (the
+            later pages are not even rasterized); all pages if None.
+        max_measures (int | None): Measures of the first page to keep (see
+            `export.prepare_score`); everything if None.
+        pages (list[int] | None): PDF pages to convert, e.g. from
+            `pages.parse_page_ranges`; all if None.
+
+    Returns:
+        JobResult: The output file (if any) and the pages skipped before OMR.
+
+    Workflow:
+    - Rasterizes pages and classifies each one (vector vs raster via PyMuPDF,
+      gray-level statistics, edge orientation as a handwriting signal).
+    - Runs the chosen backend; only if it recognizes nothing does the page move
+      on to the next slower backend. Pages for Audiveris are recognized in
+      batches, as `audiveris.process_input` does.
+    - Combines the pages and exports them like Audiveris does.
+    """
+
+    base_name = input_file.stem
+    work_dir = output_dir / base_name
+    image_dir = work_dir / "images"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    is_pdf = input_file.suffix.lower() == ".pdf"
+    checkpoint = checkpoint or Checkpoint(output_dir)
+    page_caches = {tool: PageCache(tool.value) for tool in SPEED_ORDER}
+    result = JobResult()
+
+    def route(img_path: Path) -> tuple[Path, ToolTypeEnum, bool]:
+        page_index = int(img_path.stem.split("_")[-1]) - 1
+        raster = audiveris.is_raster_pdf(input_file, page_index) if is_pdf else True
+        tool = choose_tool(img_path, raster)
+        log.info(f"Routing {img_path.name} to {tool.value}")
+        return img_path, tool, raster
+
+    def done(img_path: Path) -> tuple[Path, ToolTypeEnum] | None:
+        if (recorded := checkpoint.get("omr", checkpoint.relative(img_path))) and (
+            xml_path := checkpoint.resolve(recorded["path"])
+        ):
+            return xml_path, ToolTypeEnum(recorded["tool"])
+        return None
+
+    def finish(img_path: Path, xml_path: Path, tool: ToolTypeEnum) -> None:
+        checkpoint.record(
+            "omr",
+            checkpoint.relative(img_path),
+            {"path": checkpoint.relative(xml_path), "tool": tool.value},
+        )
+
+    def recognize_batch(
+        batch: list[tuple[Path, ToolTypeEnum, bool]]
+    ) -> list[tuple[Path, ToolTypeEnum, bool]]:
+        # The pages routed to Audiveris are recognized together, as
+        # `audiveris.process_input` does; those it finds nothing in move on to
+        # the next backend. Other pages pass through.
+        images = [
+            img_path
+            for img_path, tool, _ in batch
+            if tool == ToolTypeEnum.AUDIVERIS and not done(img_path)
+        ]
+        if not images:
+            return batch
+        raster = {img_path: is_raster for img_path, _, is_raster in batch}
+
+        def enhance(img_path: Path) -> Path:
+            # Only raster pages, as `audiveris.process_input` does; slower
+            # fallbacks still see the original page
+            if raster[img_path]:
+                return audiveris.enhance_image(img_path, work_dir)
+            return img_path
+
+        try:
+            results = audiveris.recognize_pages(
+                images, work_dir, page_caches[ToolTypeEnum.AUDIVERIS], enhance
+            )
+        except Exception as e:
+            log.warning(f"AUDIVERIS failed for {len(images)} page(s): {e}")
+            results = [None] * len(images)
+
+        missed = set()
+        for img_path, xml_path in zip(images, results):
+            if xml_path:
+                finish(img_path, xml_path, ToolTypeEnum.AUDIVERIS)
+            else:
+                log.warning(f"AUDIVERIS found no music in {img_path.name}")
+                missed.add(img_path)
+        return [
+            (img_path, SPEED_ORDER[1] if img_path in missed else tool, is_raster)
+            for img_path, tool, is_raster in batch
+        ]
+
+    def omr(
+        routed: tuple[Path, ToolTypeEnum, bool]
+    ) -> tuple[Path, ToolTypeEnum] | None:
+        img_path, tool, _ = routed
+        if recognized := done(img_path):
+            return recognized
+        for candidate in SPEED_ORDER[SPEED_ORDER.index(tool) :]:
+            try:
+                xml_path = page_caches[candidate].recognize(
+                    img_path, lambda page: recognize(page, candidate, work_dir)
+                )
+            except Exception as e:
+                log.warning(f"{candidate.value} failed for {img_path.name}: {e}")
+                continue
+            if xml_path:
+                finish(img_path, xml_path, candidate)
+                return xml_path, candidate
+            log.warning(f"{candidate.value} found no music in {img_path.name}")
+        return None
+
+    def parse(recognized: tuple[Path, ToolTypeEnum]):
+        from music21 import converter
+
+        xml_path, tool = recognized
+        if tool == ToolTypeEnum.AUDIVERIS:
+            return audiveris.load_musicxml(xml_path)
+        with timed("parse"):
+            return converter.parse(str(xml_path))
+
+    scores = run_pipeline(
+        islice(
+            filter_pages(
+                checkpoint.pages(
+                    audiveris.convert_to_images(input_file, image_dir, pages)
+                ),
+                result.skipped_pages,
+                pages if is_pdf else None,
+            ),
+            max_pages,
+        ),
+        [
+            Stage("route", route),
+            Stage("audiveris", recognize_batch, batch=audiveris.BATCH_PAGES),
+            Stage("omr", omr),
+            Stage("musicxml", parse),
+        ],
+    )
+
+    if not scores:
+        log.error("No MusicXML files found.")
+        return result
+
+    result.output_path = export_scores(
+        base_name,
+        scores,
+        work_dir,
+        bpm=bpm,
+        transpose_interval=transpose_interval,
+        output=output,
+        soundfont=soundfont,
+        checkpoint=checkpoint,
+        max_measures=max_measures,
+    )
+    return result
@@ -0,0 +1,290 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from src.api.v1.music.services.pipeline import JobResult
+from src.core.metrics import observe
+
+log = logging.getLogger(__name__)
+
+# Lock files of a job workspace (see `workspace_lock` and `job_lock`).
+LOCK_NAME = ".lock"
+JOB_LOCK_NAME = ".job.lock"
+
+
+class Checkpoint:
+    """
+    Manifest of the work a job has finished, kept as `checkpoint.json` in the
+    job's output directory.
+
+    Every stage records what it produced per page (the rasterized images, the
+    MusicXML, the WAV, ...) as soon as it is done, so a job that is run again in
+    the same directory after a crash or restart picks up from the last finished
+    stage and page instead of starting over. Paths are stored relative to the
+    directory, which makes the manifest valid wherever the workspace is mounted.
+    """
+
+    FILENAME = "checkpoint.json"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.path = root / self.FILENAME
+        self._lock = threading.Lock()
+        try:
+            self._data: dict[str, dict] = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self._data = {}
+        self.resuming = bool(self._data)
+        if self.resuming:
+            log.info(
+                "Resuming from checkpoint: "
+                + ", ".join(
+                    f"{stage} ({len(entries)})" for stage, entries in self._data.items()
+                )
+            )
+
+    def _save(self) -> None:
+        partial = self.path.with_name(f".{self.FILENAME}.{os.getpid()}.tmp")
+        partial.write_text(json.dumps(self._data))
+        partial.replace(self.path)
+
+    def relative(self, path: Path) -> str:
+        """
+        `path` as stored in the manifest.
+        """
+
+        try:
+            return str(path.relative_to(self.root))
+        except ValueError:
+            return str(path)
+
+    def resolve(self, value: str) -> Path | None:
+        """
+        The file a manifest entry refers to, or None if it is gone.
+        """
+
+        path = self.root / value
+        return path if path.exists() else None
+
+    def get(self, stage: str, key: str = "") -> Any:
+        with self._lock:
+            return self._data.get(stage, {}).get(key)
+
+    def record(self, stage: str, key: str, value: Any) -> None:
+        """
+        Record that `stage` finished `key` with `value` (any JSON value).
+        """
+
+        with self._lock:
+            self._data.setdefault(stage, {})[key] = value
+            self._save()
+
+    def get_path(self, stage: str, key: Path | str = "") -> Path | None:
+        value = self.get(stage, self.relative(key) if isinstance(key, Path) else key)
+        return self.resolve(value) if value else None
+
+    def record_path(self, stage: str, key: Path | str, path: Path) -> Path:
+        self.record(
+            stage,
+            self.relative(key) if isinstance(key, Path) else key,
+            self.relative(path),
+        )
+        return path
+
+    def stage(
+        self, name: str, func: Callable[[Path], Path | None]
+    ) -> Callable[[Path], Path | None]:
+        """
+        Wrap a per-page stage from file to file, so pages it already finished
+        are not processed again.
+        """
+
+        def run(page: Path) -> Path | None:
+            if done := self.get_path(name, page):
+                log.info(f"{name}: reusing {done.name} from checkpoint")
+                return done
+            produced = func(page)
+            if produced is not None:
+                self.record_path(name, page, produced)
+            return produced
+
+        return run
+
+    def batch_stage(
+        self, name: str, func: Callable[[list[Path]], list[Path | None]]
+    ) -> Callable[[list[Path]], list[Path | None]]:
+        """
+        Like `stage`, for a stage working on a batch of pages (see
+        `pipeline.Stage.batch`): only the pages not finished yet reach `func`.
+        """
+
+        def run(pages: list[Path]) -> list[Path | None]:
+            done = {page: self.get_path(name, page) for page in pages}
+            for page, path in done.items():
+                if path:
+                    log.info(f"{name}: reusing {path.name} from checkpoint")
+            todo = [page for page in pages if not done[page]]
+            if todo:
+                for page, produced in zip(todo, func(todo)):
+                    if produced is not None:
+                        done[page] = self.record_path(name, page, produced)
+            return [done[page] for page in pages]
+
+        return run
+
+    def pages(self, images: Iterable[Path]) -> Iterator[Path]:
+        """
+        Rasterized pages: those of the checkpoint if rasterizing had finished,
+        otherwise `images` (a lazy generator, only started if needed), recorded
+        as they come.
+        """
+
+        recorded = self._data.get("images", {})
+        if self.get("images:done", "count") == len(recorded) and recorded:
+            replay = [self.resolve(recorded[str(n)]) for n in range(len(recorded))]
+            if all(replay):
+                log.info(f"Reusing {len(replay)} rasterized page(s) from checkpoint")
+                for img_path in replay:
+                    # Still counts as a page of this job (see `metrics.finish_job`)
+                    observe("rasterize", 0.0)
+                    yield img_path
+                return
+
+        count = 0
+        for count, img_path in enumerate(images, start=1):
+            self.record_path("images", str(count - 1), img_path)
+            yield img_path
+        self.record("images:done", "count", count)
+
+    def finished(self) -> JobResult | None:
+        """
+        The result of the job if it already ran to the end.
+        """
+
+        done = self.get("result", "output")
+        if not done:
+            return None
+        output_path = self.resolve(done["output_path"])
+        if output_path is None:
+            return None
+        return JobResult(output_path=output_path, skipped_pages=done["skipped_pages"])
+
+    def finish(self, result: JobResult) -> None:
+        if result.output_path:
+            self.record(
+                "result",
+                "output",
+                {
+                    "output_path": self.relative(result.output_path),
+                    "skipped_pages": result.skipped_pages,
+                },
+            )
+
+
+def _lock(lock_path: Path, operation: int) -> int | None:
+    """
+    Lock `lock_path` with flock `operation`, creating its directory if needed;
+    returns the open file descriptor, or None if a non-blocking lock is taken.
+
+    The lock file is removed together with the workspace, so after waiting
+    for a lock the file is checked to still be the one in the directory.
+    """
+
+    while True:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            current = os.stat(lock_path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            return fd
+        os.close(fd)
+
+
+@contextmanager
+def _locked(lock_path: Path, operation: int):
+    fd = _lock(lock_path, operation)
+    try:
+        yield
+    finally:
+        os.close(fd)
+
+
+def workspace_lock(directory: Path):
+    """
+    Use a job workspace, creating it if needed. The workspace is not deleted
+    (see `remove_workspace`) while anyone uses it.
+
+    Requests for the same conversion share one workspace, so a retried
+    request resumes from the checkpoint left by the failed one.
+    """
+
+    return _locked(directory / LOCK_NAME, fcntl.LOCK_SH)
+
+
+def job_lock(directory: Path):
+    """
+    Run a job in a workspace. Duplicate jobs for the same workspace (e.g. a
+    job re-queued while its first run is still going) wait for each other
+    instead of writing into the same files.
+    """
+
+    return _locked(directory / JOB_LOCK_NAME, fcntl.LOCK_EX)
+
+
+def remove_workspace(directory: Path) -> bool:
+    """
+    Delete a workspace unless it is in use.
+
+    Returns:
+        bool: Whether it was deleted.
+    """
+
+    if not directory.exists():
+        return True
+    fd = _lock(directory / LOCK_NAME, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if fd is None:
+        return False
+    try:
+        shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        os.close(fd)
+    return True
+
+
+def prune_workspaces(root: Path, max_age: float) -> int:
+    """
+    Delete the unused workspaces below `root` not modified for `max_age`
+    seconds: those kept for resuming that were never retried.
+
+    Returns:
+        int: Number of workspaces deleted.
+    """
+
+    if not root.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for directory in root.iterdir():
+        try:
+            stale = directory.is_dir() and directory.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if stale and remove_workspace(directory):
+            removed += 1
+    if removed:
+        log.info(f"Removed {removed} stale job workspace(s)")
+    return removed
@@ -0,0 +1,135 @@
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+from config.config import app_settings
+from src.api.v1.music.enums import ToolTypeEnum
+from src.api.v1.music.services.pages import is_raster_page
+from src.core import metrics
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class JobEstimate:
+    """
+    Expected size of a conversion, worked out without running it.
+
+    Attributes:
+        pages (int): Pages that will be converted.
+        seconds_per_page (float): Measured median for the tool (see
+            `metrics.tool_stats`), or the tool's `DEFAULT_SECONDS_PER_PAGE`
+            before any job was measured.
+        seconds (float): Expected processing time.
+        measured (bool): Whether `seconds_per_page` was measured.
+        total_pages (int): Pages of the upload.
+        raster_pages (int | None): Converted pages that are scans or photos;
+            None unless the pages were classified.
+        vector_pages (int | None): Converted pages that are digital (vector).
+    """
+
+    pages: int
+    seconds_per_page: float
+    seconds: float
+    measured: bool = False
+    total_pages: int = 1
+    raster_pages: int | None = None
+    vector_pages: int | None = None
+
+
+def inspect_pages(
+    input_path: Path,
+    pages: list[int] | None = None,
+    max_pages: int | None = None,
+    classify: bool = False,
+) -> tuple[int, list[int], int | None]:
+    """
+    Read the page tree of an uploaded score without rendering anything.
+
+    Parameters:
+        input_path (Path): Uploaded PDF or image.
+        pages (list[int] | None): Selected PDF pages; all if None.
+        max_pages (int | None): Only the first this many selected pages.
+        classify (bool): Also count the selected pages that are raster (see
+            `pages.is_raster_page`), which reads their content streams.
+
+    Returns:
+        tuple: Page count of the upload, the selected page numbers that
+            exist, and how many of them are raster (None unless `classify`).
+    """
+
+    if input_path.suffix.lower() != ".pdf":
+        return 1, [1], 1 if classify else None
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(str(input_path)) as doc:
+            page_count = doc.page_count
+            selected = [
+                number
+                for number in (pages or range(1, page_count + 1))
+                if number <= page_count
+            ][:max_pages]
+            raster = None
+            if classify:
+                raster = sum(
+                    is_raster_page(doc.load_page(number - 1)) for number in selected
+                )
+            return page_count, selected, raster
+    except Exception as e:
+        log.warning(f"Unable to inspect the pages of {input_path.name}: {e}")
+        return 1, [1], None
+
+
+def seconds_per_page(tool: ToolTypeEnum) -> float | None:
+    """
+    Median seconds per page of the tool's recent jobs, None if not measured.
+    """
+
+    return metrics.tool_stats(tool.value)["seconds_per_page_p50"]
+
+
+def default_seconds_per_page(tool: ToolTypeEnum) -> float:
+    """
+    Seconds per page expected of a tool before any of its jobs was measured.
+    """
+
+    defaults = app_settings.DEFAULT_SECONDS_PER_PAGE
+    return defaults.get(tool.value, max(defaults.values(), default=0.0))
+
+
+def estimate_job(
+    tool: ToolTypeEnum,
+    input_path: Path,
+    pages: list[int] | None = None,
+    preview: bool = False,
+    classify: bool = False,
+) -> JobEstimate:
+    """
+    Estimate a conversion from its page count and the tool's recent speed.
+
+    Parameters:
+        tool (ToolTypeEnum): Backend to use.
+        input_path (Path): Uploaded PDF or image.
+        pages (list[int] | None): Selected PDF pages; all if None.
+        preview (bool): Whether only a preview is converted (one page).
+        classify (bool): Also break the pages down into raster and vector.
+
+    Returns:
+        JobEstimate: Page counts and expected seconds.
+    """
+
+    total_pages, selected, raster = inspect_pages(
+        input_path, pages, 1 if preview else None, classify
+    )
+    measured = seconds_per_page(tool)
+    per_page = measured if measured is not None else default_seconds_per_page(tool)
+    return JobEstimate(
+        pages=len(selected),
+        seconds_per_page=per_page,
+        seconds=round(len(selected) * per_page, 2),
+        measured=measured is not None,
+        total_pages=total_pages,
+        raster_pages=raster,
+        vector_pages=len(selected) - raster if raster is not None else None,
+    )
@@ -0,0 +1,244 @@
+import logging
+import subprocess
+from pathlib import Path
+
+from config.config import tool_settings
+from src.api.v1.music.enums import OutputFormatEnum
+from src.api.v1.music.services.audio import encode_wavs
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.core.metrics import timed
+from src.core.processes import run_tool
+
+# Export of recognized scores to the output formats, shared by the pipelines.
+# music21 is imported inside the functions (see `src.core.warmup`).
+
+log = logging.getLogger(__name__)
+
+
+def first_measures(score, count: int | None):
+    """
+    Cut a parsed page down to its first `count` measures (all of it if None).
+    """
+
+    if not count:
+        return score
+    try:
+        return score.measures(1, count)
+    except Exception as e:
+        log.warning(f"Cannot cut the score to {count} measures, keeping it all: {e}")
+        return score
+
+
+def prepare_score(
+    scores: list,
+    bpm: int,
+    transpose_interval: int = 0,
+    max_measures: int | None = None,
+):
+    """
+    Combine parsed pages into one score ready for playback.
+
+    - With `max_measures` (previews), keeps only that many measures of the
+      first page.
+    - Removes repeat marks and tempo anomalies.
+    - Inserts one uniform tempo.
+    - Applies quantization to fix note timing artifacts.
+    """
+
+    from music21 import stream, tempo
+
+    if max_measures:
+        scores = [first_measures(scores[0], max_measures)]
+    if len(scores) == 1:
+        score = scores[0]
+    else:
+        score = stream.Score()
+        for part in scores:
+            score.append(part)
+
+    if transpose_interval != 0:
+        log.info(f"Transposing all notes by {transpose_interval} semitone(s)...")
+        score = score.transpose(transpose_interval)
+
+    # Remove broken repeat marks
+    for el in score.recurse():
+        if el.classes and ("Repeat" in el.classes or "RepeatBracket" in el.classes):
+            el.activeSite.remove(el)
+
+    # Clean tempo and add uniform tempo
+    for t in score.recurse().getElementsByClass(tempo.MetronomeMark):
+        t.activeSite.remove(t)
+    score.insert(0, tempo.MetronomeMark(number=bpm))
+
+    score.quantize(inPlace=True)
+    return score
+
+
+# === MusicXML → MIDI ===
+@timed("midi")
+def convert_to_midi(
+    mp3_base: str,
+    scores: list,
+    out_dir: Path,
+    bpm: int,
+    transpose_interval: int = 0,
+    max_measures: int | None = None,
+) -> Path | None:
+    """
+    Convert one or more parsed MusicXML scores into a single MIDI file.
+
+    Parameters:
+        mp3_base (str): Base name for output MIDI file.
+        scores (list): Parsed scores (see `audiveris.load_musicxml`), in page order.
+        out_dir (Path): Directory to save the MIDI file.
+
+    Returns:
+        Path | None: Path to the generated MIDI file, or None if failed.
+    """
+
+    midi_path = out_dir / f"{mp3_base}.mid"
+    log.info("Converting MusicXML to MIDI...")
+
+    try:
+        score = prepare_score(scores, bpm, transpose_interval, max_measures)
+        score.write("midi", fp=str(midi_path))
+        log.info(f"MIDI saved: {midi_path}")
+        return midi_path
+    except Exception as e:
+        log.error(f"MIDI conversion failed: {e}")
+        return None
+
+
+@timed("musicxml")
+def convert_to_musicxml(
+    base_name: str,
+    scores: list,
+    out_dir: Path,
+    bpm: int,
+    transpose_interval: int = 0,
+    max_measures: int | None = None,
+) -> Path | None:
+    """
+    Write one or more parsed scores as a single MusicXML file, prepared like
+    the MIDI (see `prepare_score`).
+
+    Returns:
+        Path | None: Path to the MusicXML file, or None if failed.
+    """
+
+    xml_path = out_dir / f"{base_name}.musicxml"
+    log.info("Combining pages into one MusicXML...")
+
+    try:
+        score = prepare_score(scores, bpm, transpose_interval, max_measures)
+        score.write("musicxml", fp=str(xml_path))
+        log.info(f"MusicXML saved: {xml_path}")
+        return xml_path
+    except Exception as e:
+        log.error(f"MusicXML export failed: {e}")
+        return None
+
+
+# === MIDI → audio ===
+def convert_midi_to_audio(
+    midi_path: Path,
+    audio_path: Path,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    soundfont: Path | None = None,
+):
+    """
+    Convert a MIDI file to audio using FluidSynth and FFmpeg.
+
+    Parameters:
+        midi_path (Path): Path to the input .mid file.
+        audio_path (Path): Output path for the final audio file.
+        output (OutputFormatEnum): Audio format to encode.
+        soundfont (Path | None): SoundFont to render with; the default if None.
+
+    Workflow:
+    - FluidSynth renders the MIDI to a WAV file using the SoundFont.
+    - The WAV is normalized and encoded in one pass (see `audio.encode_wavs`).
+    - The temporary WAV is deleted after use.
+    """
+
+    if not midi_path or not midi_path.exists():
+        log.error("No valid MIDI to convert.")
+        return
+
+    wav_path = midi_path.with_suffix(".wav")
+    log.info(f"Converting MIDI → {output.value} with normalization...")
+    try:
+        with timed("synth"):
+            run_tool(
+                [
+                    "fluidsynth",
+                    "-ni",
+                    str(soundfont or tool_settings.SOUNDFONT_PATH),
+                    str(midi_path),
+                    "-F",
+                    str(wav_path),
+                    "-r",
+                    "44100",
+                    "-g",
+                    "1.0",
+                ],
+                "synth",
+            )
+        encode_wavs([wav_path], audio_path, output)
+        wav_path.unlink(missing_ok=True)
+        log.info(f"Audio created: {audio_path}")
+    except (subprocess.SubprocessError, ValueError):
+        log.error(f"Error converting MIDI to {output.value}.")
+
+
+def export_scores(
+    base_name: str,
+    scores: list,
+    out_dir: Path,
+    bpm: int,
+    transpose_interval: int = 0,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    soundfont: Path | None = None,
+    checkpoint: Checkpoint | None = None,
+    max_measures: int | None = None,
+) -> Path | None:
+    """
+    Export parsed pages as one file in the requested format.
+
+    MusicXML stops right after combining the pages and MIDI after writing the
+    MIDI, so neither pays for synthesis and encoding. With a `checkpoint`, a
+    MIDI written by an earlier run of the job is reused. `max_measures` cuts
+    the result down for previews (see `prepare_score`).
+
+    Returns:
+        Path | None: The output file, or None if it could not be produced.
+    """
+
+    if output == OutputFormatEnum.MUSICXML:
+        return convert_to_musicxml(
+            base_name,
+            scores,
+            out_dir,
+            bpm,
+            transpose_interval=transpose_interval,
+            max_measures=max_measures,
+        )
+
+    midi_path = checkpoint and checkpoint.get_path("midi", base_name)
+    if not midi_path:
+        midi_path = convert_to_midi(
+            base_name,
+            scores,
+            out_dir,
+            bpm,
+            transpose_interval=transpose_interval,
+            max_measures=max_measures,
+        )
+        if checkpoint and midi_path:
+            checkpoint.record_path("midi", base_name, midi_path)
+    if output == OutputFormatEnum.MIDI:
+        return midi_path
+
+    audio_path = out_dir / f"{base_name}{output.suffix}"
+    convert_midi_to_audio(midi_path, audio_path, output, soundfont)
+    return audio_path if audio_path.exists() else None
@@ -1,13 +1,24 @@
+import logging
 import os
 import shutil
 import subprocess
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
+from typing import Iterator
 
-from music21 import converter, tempo
-from pdf2image import convert_from_path
+from config.config import tool_settings
+from src.api.v1.music.enums import OutputFormatEnum
+from src.api.v1.music.services.audio import encode_wavs
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.api.v1.music.services.export import export_scores, first_measures
+from src.api.v1.music.services.pages import PageCache, filter_pages, select_pages
+from src.api.v1.music.services.pipeline import JobResult, Stage, run_pipeline
+from src.core.metrics import timed
+from src.core.processes import run_tool
+
+log = logging.getLogger(__name__)
 
 # Disable GPU
 os.environ["CUDA_VISIBLE_DEVICES"] = ""
@@ -17,26 +28,49 @@ OUTPUT_DIR = ROOT_DIR / "output"
 IMG_DIR = OUTPUT_DIR / "images"
 
 
-def prepare_image_dir():
-    if IMG_DIR.exists():
-        shutil.rmtree(IMG_DIR)
-    IMG_DIR.mkdir(parents=True)
+def prepare_image_dir(img_dir: Path = IMG_DIR):
+    if img_dir.exists():
+        shutil.rmtree(img_dir)
+    img_dir.mkdir(parents=True)
+
+
+def pdf_to_images(
+    pdf_path: Path, img_dir: Path = IMG_DIR, pages: list[int] | None = None
+) -> Iterator[Path]:
+    from pdf2image import convert_from_path, pdfinfo_from_path
 
+    if pdf_path.suffix.lower() != ".pdf":
+        with timed("rasterize"):
+            img_path = img_dir / f"page_1{pdf_path.suffix.lower()}"
+            shutil.copy(pdf_path, img_path)
+        yield img_path
+        return
 
-def pdf_to_images(pdf_path: Path):
-    images = convert_from_path(str(pdf_path), dpi=300)
-    img_paths = []
-    for i, img in enumerate(images, start=1):
-        img_path = IMG_DIR / f"page_{i}.png"
-        img.save(img_path, "PNG")
-        img_paths.append(img_path)
-    return img_paths
+    # Rasterize one page at a time so HOMR can start before the whole PDF is
+    # decoded; pages that are not selected are never decoded at all
+    page_count = pdfinfo_from_path(str(pdf_path))["Pages"]
+    for i in select_pages(pages, page_count):
+        with timed("rasterize"):
+            img = convert_from_path(str(pdf_path), dpi=300, first_page=i, last_page=i)[
+                0
+            ]
+            img_path = img_dir / f"page_{i}.png"
+            img.save(img_path, "PNG")
+        yield img_path
 
 
+@timed("omr")
 def run_homr(img_path: Path) -> Path:
-    print(f"🎵 Running HOMR on: {img_path.name}")
-    result = subprocess.run(
-        [sys.executable, "-m", "homr.main", str(img_path)],
+    log.info(f"Running HOMR on: {img_path.name}")
+    command = (
+        [tool_settings.HOMR_BIN]
+        if tool_settings.HOMR_BIN
+        else [sys.executable, "-m", "homr.main"]
+    )
+    result = run_tool(
+        [*command, str(img_path)],
+        "omr",
+        check=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=True,
@@ -47,62 +81,56 @@ def run_homr(img_path: Path) -> Path:
     xml_path = img_path.with_suffix(".musicxml")
     if not xml_path.exists():
         raise FileNotFoundError(f"MusicXML not found for: {img_path.name}")
-    print(f"✅ HOMR done: {img_path.name}")
+    log.info(f"HOMR done: {img_path.name}")
     return xml_path
 
 
-def xml_to_midi_mp3(
-    xml_path: Path, sf2_path: Path, bpm: int, transpose_interval: int = 0
+def xml_to_wav(
+    xml_path: Path,
+    sf2_path: Path,
+    bpm: int,
+    transpose_interval: int = 0,
+    max_measures: int | None = None,
 ) -> Path:
+    from music21 import converter, tempo
+
     midi = xml_path.with_suffix(".mid")
     wav = xml_path.with_suffix(".wav")
-    mp3 = xml_path.with_suffix(".mp3")
 
-    print(f"🎶 Converting to MP3: {xml_path.name}")
+    log.info(f"Rendering audio: {xml_path.name}")
     # MusicXML → MIDI
-    score = converter.parse(str(xml_path))
-    score.insert(0, tempo.MetronomeMark(number=bpm))
+    with timed("parse"):
+        score = converter.parse(str(xml_path))
 
-    # --- Transpose the score if needed ---
+    with timed("midi"):
+        score = first_measures(score, max_measures)
+        score.insert(0, tempo.MetronomeMark(number=bpm))
 
-    if transpose_interval != 0:
-        score = score.transpose(transpose_interval)
+        # --- Transpose the score if needed ---
 
-    score.write("midi", fp=str(midi))
+        if transpose_interval != 0:
+            score = score.transpose(transpose_interval)
 
-    # MIDI → WAV
-    subprocess.run(
-        ["fluidsynth", "-ni", str(sf2_path), str(midi), "-F", str(wav)], check=True
-    )
-    # WAV → MP3
-    subprocess.run(["ffmpeg", "-y", "-i", str(wav), str(mp3)], check=True)
-    print(f"🟢 Done MP3: {xml_path.name}")
+        score.write("midi", fp=str(midi))
 
-    return mp3
+    # MIDI → WAV (pages are encoded together, see `encode_wavs`)
+    with timed("synth"):
+        run_tool(
+            [
+                "fluidsynth",
+                "-ni",
+                str(sf2_path),
+                str(midi),
+                "-F",
+                str(wav),
+                "-r",
+                "44100",
+            ],
+            "synth",
+        )
+    log.info(f"Done WAV: {xml_path.name}")
 
-
-def merge_mp3s(mp3_files: list[Path], output_path: Path):
-    concat_file = output_path.with_suffix(".txt")
-    with open(concat_file, "w") as f:
-        for mp3 in mp3_files:
-            f.write(f"file '{mp3.resolve()}'\n")
-    subprocess.run(
-        [
-            "ffmpeg",
-            "-y",
-            "-f",
-            "concat",
-            "-safe",
-            "0",
-            "-i",
-            str(concat_file),
-            "-c",
-            "copy",
-            str(output_path),
-        ],
-        check=True,
-    )
-    concat_file.unlink()
+    return wav
 
 
 def main(
@@ -111,45 +139,92 @@ def main(
     bpm: int = 120,
     max_workers: int = 4,
     transpose_interval: int = 0,
-):
+    output_dir: Path = OUTPUT_DIR,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    checkpoint: Checkpoint | None = None,
+    max_pages: int | None = None,
+    max_measures: int | None = None,
+    pages: list[int] | None = None,
+) -> JobResult:
     start_time = time.time()
-    prepare_image_dir()
-    img_paths = pdf_to_images(pdf_path)
-
-    # --- Run HOMR sequentially to avoid deadlocks ---
-    xml_paths = []
-    for img in img_paths:
-        try:
-            xml = run_homr(img)
-            xml_paths.append(xml)
-        except Exception as e:
-            print(f"⚠️ Error HOMR {img.name}: {e}")
-
-    if not xml_paths:
-        print("❌ No MusicXMLs generated. Exiting.")
-        return
-
-    # --- Convert MusicXML → MP3 in parallel using threads ---
-    mp3_files = []
+    img_dir = output_dir / "images"
+    checkpoint = checkpoint or Checkpoint(output_dir)
+    if checkpoint.resuming:
+        img_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        prepare_image_dir(img_dir)
+    page_cache = PageCache("HOMR")
+    result = JobResult()
+    is_pdf = pdf_path.suffix.lower() == ".pdf"
+    pages = islice(
+        filter_pages(
+            checkpoint.pages(pdf_to_images(pdf_path, img_dir, pages)),
+            result.skipped_pages,
+            pages if is_pdf else None,
+        ),
+        max_pages,
+    )
+    # HOMR runs one page at a time to avoid deadlocks
+    recognize = Stage(
+        "homr",
+        checkpoint.stage("musicxml", lambda img: page_cache.recognize(img, run_homr)),
+    )
 
-    def worker(xml):
-        try:
-            return xml_to_midi_mp3(
-                xml, sf2_path, bpm, transpose_interval=transpose_interval
+    if not output.is_audio:
+        # --- MIDI/MusicXML: rasterize → HOMR → parse, then one export ---
+        def parse(xml_path: Path):
+            from music21 import converter
+
+            with timed("parse"):
+                return converter.parse(str(xml_path))
+
+        scores = run_pipeline(pages, [recognize, Stage("musicxml", parse)])
+        if scores:
+            result.output_path = export_scores(
+                f"{pdf_path.stem}_merged",
+                scores,
+                output_dir,
+                bpm=bpm,
+                transpose_interval=transpose_interval,
+                output=output,
+                checkpoint=checkpoint,
+                max_measures=max_measures,
             )
-        except Exception as e:
-            print(f"⚠️ Error converting {xml.name}: {e}")
-            return None
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(worker, xml_paths))
-    mp3_files = [f for f in results if f is not None]
-
-    if mp3_files:
-        merged = OUTPUT_DIR / f"{pdf_path.stem}_merged.mp3"
-        merge_mp3s(mp3_files, merged)
-        print(f"✅ Merged MP3 saved to: {merged}")
+        else:
+            log.error("No MusicXML recognized.")
+        log.info(f"Total time: {time.time() - start_time:.2f} sec")
+        return result
+
+    # --- Stream pages: rasterize → HOMR → MusicXML → WAV ---
+    # Audio rendering of earlier pages overlaps with recognition of later ones.
+    wav_files = run_pipeline(
+        pages,
+        [
+            recognize,
+            Stage(
+                "audio",
+                checkpoint.stage(
+                    "audio",
+                    lambda xml: xml_to_wav(
+                        xml,
+                        sf2_path,
+                        bpm,
+                        transpose_interval=transpose_interval,
+                        max_measures=max_measures,
+                    ),
+                ),
+                workers=max_workers,
+            ),
+        ],
+    )
+
+    # --- One normalized encode for the whole document ---
+    if wav_files:
+        merged = output_dir / f"{pdf_path.stem}_merged{output.suffix}"
+        result.output_path = encode_wavs(wav_files, merged, output)
+        log.info(f"Merged {output.value} saved to: {merged}")
     else:
-        print("❌ No MP3s generated.")
+        log.error(f"No {output.value} generated.")
 
-    print(f"⏱️ Total time: {time.time() - start_time:.2f} sec")
+    log.info(f"Total time: {time.time() - start_time:.2f} sec")
+    return result
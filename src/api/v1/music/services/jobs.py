@@ -0,0 +1,338 @@
+import asyncio
+import uuid
+from os import cpu_count
+from pathlib import Path
+
+from config.config import app_settings
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+from src.api.v1.music.services.checkpoint import Checkpoint, job_lock
+from src.api.v1.music.services.pipeline import JobResult
+from src.api.v1.music.services.soundfonts import soundfonts
+from src.core import metrics
+from src.core.processes import (
+    JobPreempted,
+    cancel_file,
+    check_cancelled,
+    preempt_file,
+    watch_cancellation,
+)
+from src.core.queue import job_queue
+from src.core.scheduler import Ticket
+from src.core.storage import TieredCache
+from src.core.workers import omr_pool
+
+
+def run_job(
+    tool: ToolTypeEnum,
+    input_path: Path,
+    output_dir: Path,
+    tempo: int = 120,
+    transpose: int = 0,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    job_id: str | None = None,
+    submitted_at: float | None = None,
+    soundfont: str | None = None,
+    preview: bool = False,
+    pages: list[int] | None = None,
+) -> JobResult:
+    """
+    Run one conversion with the selected tool.
+
+    This is the unit of work handed to the OMR worker processes, so it only takes
+    and returns picklable values and imports the backend lazily.
+
+    Parameters:
+        tool (ToolTypeEnum): Backend to use.
+        input_path (Path): Uploaded PDF or image.
+        output_dir (Path): Job-private output directory.
+        tempo (int): Playback tempo in BPM.
+        transpose (int): Transposition in semitones.
+        output (OutputFormatEnum): Format of the result.
+        job_id (str | None): Identifier the stage timings are recorded under
+            and the job is cancelled by (see `cancel_job`).
+        submitted_at (float | None): Epoch time the job was accepted, used to
+            measure how long it waited for a worker.
+        soundfont (str | None): Name of the SoundFont for audio output (see
+            `SoundFontRegistry.resolve`); the default if None.
+        preview (bool): Convert only the first page with music, cut down to
+            `PREVIEW_MEASURES` measures.
+        pages (list[int] | None): PDF pages to convert (see
+            `pages.parse_page_ranges`); all if None.
+
+    Returns:
+        JobResult: The output file (if any), the pages skipped before OMR and the
+            measured timings.
+
+    Raises:
+        JobCancelled: If the job was cancelled before or while it ran.
+        JobPreempted: If the job gave up its worker between two pages (see
+            `OMRPool.run`); running it again resumes it.
+    """
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    job_id = job_id or uuid.uuid4().hex
+    metrics.start_job(job_id, tool.value, submitted_at)
+    # Maps the fonts once per worker process, before the first one is rendered
+    soundfont_path = soundfonts.resolve(soundfont)
+    cancel_path = cancel_file(output_dir, job_id)
+    preempt_path = preempt_file(output_dir, job_id)
+    watch_cancellation(cancel_path, preempt_path)
+
+    result = None
+    try:
+        # Cancelled while it waited for a worker
+        check_cancelled()
+        # A job run again in the same directory (after a crash, or re-queued)
+        # resumes from its checkpoint; a duplicate running there is waited for.
+        with job_lock(output_dir):
+            checkpoint = Checkpoint(output_dir)
+            result = checkpoint.finished() or _dispatch(
+                tool,
+                input_path,
+                output_dir,
+                tempo,
+                transpose,
+                output,
+                soundfont_path,
+                checkpoint,
+                preview,
+                pages,
+            )
+            checkpoint.finish(result)
+    except JobPreempted:
+        # Not finished: its timings keep adding up when it runs again
+        metrics.suspend_job()
+        raise
+    finally:
+        watch_cancellation(None)
+        cancel_path.unlink(missing_ok=True)
+        preempt_path.unlink(missing_ok=True)
+        # Page cache uploads, before this worker process may be recycled
+        TieredCache.flush()
+        stats = metrics.finish_job(success=bool(result and result.output_path))
+    result.stats = stats
+    return result
+
+
+def cancel_job(output_dir: Path, job_id: str) -> None:
+    """
+    Cancel a submitted job, whether it is still queued or running: it stops at
+    its next check, killing the tool it runs, and frees its worker.
+    """
+
+    path = cancel_file(output_dir, job_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def run_queued_job(payload: dict) -> dict:
+    """
+    Run a job taken from the job queue (see `submit_job`) and return its result
+    as JSON-serializable values. Runs in a worker's OMR pool.
+    """
+
+    result = run_job(
+        ToolTypeEnum(payload["tool"]),
+        Path(payload["input_path"]),
+        Path(payload["output_dir"]),
+        payload["tempo"],
+        payload["transpose"],
+        OutputFormatEnum(payload["output"]),
+        payload["job_id"],
+        payload["submitted_at"],
+        payload["soundfont"],
+        payload.get("preview", False),
+        payload.get("pages"),
+    )
+    return {
+        "output_path": str(result.output_path) if result.output_path else None,
+        "skipped_pages": result.skipped_pages,
+        "stats": result.stats,
+    }
+
+
+def cancel_queued_job(payload: dict) -> None:
+    """
+    Cancel a job taken from the job queue (see `run_queued_job`).
+    """
+
+    cancel_job(Path(payload["output_dir"]), payload["job_id"])
+
+
+def queued_job_ticket(payload: dict) -> Ticket:
+    """
+    Scheduling ticket of a job taken from the job queue, as `submit_job`
+    gives a job run in this process's pool, so it can be preempted.
+    """
+
+    return Ticket(
+        payload.get("user", ""),
+        payload.get("cost", 0.0),
+        preempt_file(Path(payload["output_dir"]), payload["job_id"]),
+    )
+
+
+async def submit_job(
+    tool: ToolTypeEnum,
+    input_path: Path,
+    output_dir: Path,
+    tempo: int,
+    transpose: int,
+    output: OutputFormatEnum,
+    job_id: str,
+    submitted_at: float,
+    soundfont: str | None = None,
+    preview: bool = False,
+    pages: list[int] | None = None,
+    user: str = "",
+    cost: float = 0.0,
+) -> JobResult:
+    """
+    Run a job (see `run_job`) and wait for its result.
+
+    Without `JOB_QUEUE` the job runs in this process's OMR pool. Otherwise it is
+    queued for whichever `scoreapi worker` takes it first, and the result is
+    polled every `JOB_POLL_INTERVAL` seconds. Queued jobs refer to their files
+    by absolute path, so the workers must see `WORK_DIR` at the same path.
+
+    In this process's pool and with a SQLite queue, waiting jobs are started
+    fairly between users, shortest first within a user, by `user` and the
+    estimated seconds of work `cost` (see `estimate.estimate_job`). A Redis
+    queue starts them in the order they were queued (see `RedisQueue`).
+
+    Raises:
+        RuntimeError: If a queued job failed on the worker.
+    """
+
+    queue = job_queue()
+    if queue is None:
+        return await omr_pool.run(
+            run_job,
+            tool,
+            input_path,
+            output_dir,
+            tempo,
+            transpose,
+            output,
+            job_id,
+            submitted_at,
+            soundfont,
+            preview,
+            pages,
+            ticket=Ticket(user, cost, preempt_file(output_dir, job_id)),
+        )
+
+    payload = {
+        "tool": tool.value,
+        "input_path": str(input_path.resolve()),
+        "output_dir": str(output_dir.resolve()),
+        "tempo": tempo,
+        "transpose": transpose,
+        "output": output.value,
+        "job_id": job_id,
+        "submitted_at": submitted_at,
+        "soundfont": soundfont,
+        "preview": preview,
+        "pages": pages,
+        "user": user,
+        "cost": cost,
+    }
+    await asyncio.to_thread(queue.put, job_id, payload)
+    while (result := await asyncio.to_thread(queue.pop_result, job_id)) is None:
+        await asyncio.sleep(app_settings.JOB_POLL_INTERVAL)
+
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return JobResult(
+        output_path=Path(result["output_path"]) if result["output_path"] else None,
+        skipped_pages=result["skipped_pages"],
+        stats=result["stats"],
+    )
+
+
+def queue_wait(tool: ToolTypeEnum) -> float | None:
+    """
+    Seconds a job submitted now is expected to wait for a worker: from the
+    work ahead of it in this process's OMR pool (see `OMRPool.expected_wait`),
+    or with `JOB_QUEUE` the measured median wait of the tool's recent jobs
+    (None before any), as the workers' load is not known here.
+    """
+
+    if job_queue() is None:
+        return omr_pool.expected_wait()
+    return metrics.tool_stats(tool.value)["queue_wait_p50"]
+
+
+def _dispatch(
+    tool: ToolTypeEnum,
+    input_path: Path,
+    output_dir: Path,
+    tempo: int,
+    transpose: int,
+    output: OutputFormatEnum,
+    soundfont: Path,
+    checkpoint: Checkpoint,
+    preview: bool = False,
+    pages: list[int] | None = None,
+) -> JobResult:
+    limits = {
+        "pages": pages,
+        "max_pages": 1 if preview else None,
+        "max_measures": app_settings.PREVIEW_MEASURES if preview else None,
+    }
+    match tool:
+        case ToolTypeEnum.AUDIVERIS:
+            from src.api.v1.music.services.audiveris import process_input
+
+            return process_input(
+                input_file=input_path,
+                output_dir=output_dir,
+                bpm=tempo,
+                transpose_interval=transpose,
+                output=output,
+                soundfont=soundfont,
+                checkpoint=checkpoint,
+                **limits,
+            )
+        case ToolTypeEnum.HOMR:
+            from src.api.v1.music.services.homr import main
+
+            return main(
+                input_path,
+                soundfont,
+                bpm=tempo,
+                transpose_interval=transpose,
+                output_dir=output_dir,
+                output=output,
+                checkpoint=checkpoint,
+                **limits,
+            )
+        case ToolTypeEnum.OEMER:
+            from src.api.v1.music.services import oemer
+
+            # Share the cores between the OMR worker processes
+            return oemer.main(
+                input_path,
+                soundfont,
+                transpose_interval=transpose,
+                bpm=tempo,
+                output_dir=output_dir,
+                max_workers=max(1, (cpu_count() or 1) // app_settings.omr_workers),
+                output=output,
+                checkpoint=checkpoint,
+                **limits,
+            )
+        case ToolTypeEnum.AUTO:
+            from src.api.v1.music.services import auto
+
+            return auto.main(
+                input_file=input_path,
+                output_dir=output_dir,
+                bpm=tempo,
+                transpose_interval=transpose,
+                output=output,
+                soundfont=soundfont,
+                checkpoint=checkpoint,
+                **limits,
+            )
+    raise ValueError("Unsupported tool")
@@ -1,119 +1,509 @@
+import asyncio
 import json
 import shutil
+import time
+import zipfile
 from pathlib import Path
+from typing import Awaitable, Callable, TypeVar
+from uuid import uuid4
 
-from fastapi import UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi import Request, Response, UploadFile, status
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
 
-from src.api.v1.music.enums import ToolTypeEnum
-from src.api.v1.music.schemas.response import GetInfoResponse, GetResultResponse
+from config.config import app_settings
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+from src.api.v1.music.exceptions import (
+    ArchiveTooLargeException,
+    InvalidPageRangeException,
+    NoScoresInUploadException,
+    ResultNotFoundException,
+)
+from src.api.v1.music.schemas.response import (
+    GetEstimateResponse,
+    GetInfoResponse,
+    GetResultResponse,
+    ToolStats,
+)
+from src.api.v1.music.services.checkpoint import remove_workspace, workspace_lock
+from src.api.v1.music.services.estimate import estimate_job
+from src.api.v1.music.services.jobs import cancel_job, queue_wait, submit_job
+from src.api.v1.music.services.pages import parse_page_ranges
+from src.api.v1.music.services.results import CachedResult, ResultCache, save_upload
+from src.api.v1.music.services.soundfonts import DEFAULT_SOUNDFONT, soundfonts
+from src.core import metrics
+from src.core.exceptions import CustomException
+from src.core.utils import core_logger, etag_matches
+
+SCORE_SUFFIXES = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+T = TypeVar("T")
+
+# Seconds between checks whether the client of a running conversion is still there.
+DISCONNECT_POLL_INTERVAL = 1.0
+
+
+def conversion_key(
+    input_hash: str,
+    tool: ToolTypeEnum,
+    tempo: int,
+    transpose: int,
+    output: OutputFormatEnum,
+    soundfont: str | None = None,
+    preview: bool = False,
+    pages: list[int] | None = None,
+) -> str:
+    """
+    Result cache key of converting the input with SHA-256 `input_hash` with
+    these settings (see `ResultCache.key`).
+    """
+
+    return ResultCache.key(
+        input_hash,
+        tool=tool.value,
+        tempo=tempo,
+        transpose=transpose,
+        output=output.value,
+        # MIDI and MusicXML are not rendered, so the font does not matter
+        soundfont=(soundfont or DEFAULT_SOUNDFONT) if output.is_audio else None,
+        preview=preview,
+        pages=pages,
+    )
+
+
+def unpack_scores(upload_path: Path, input_dir: Path, start: int) -> list[Path]:
+    """
+    Return the scores contained in an uploaded file.
+
+    Zip archives are extracted (flattened, non-score members ignored) and removed;
+    PDFs and images are returned as they are. Extracted files are numbered from
+    `start` so equal names from different folders don't collide.
+
+    Raises:
+        ArchiveTooLargeException: If an archive would take the batch past
+            `BATCH_MAX_FILES` scores, or unpack to more than `BATCH_MAX_FILE_MB`
+            per score or `BATCH_MAX_UNPACKED_MB` in all.
+    """
+
+    if not zipfile.is_zipfile(upload_path):
+        return [upload_path] if upload_path.suffix.lower() in SCORE_SUFFIXES else []
+
+    scores = []
+    with zipfile.ZipFile(upload_path) as archive:
+        members = [
+            member
+            for member in archive.infolist()
+            if not member.is_dir()
+            and Path(member.filename).suffix.lower() in SCORE_SUFFIXES
+        ]
+        # Extraction stops at the size a member declares, so checking the
+        # declared sizes is enough
+        if (
+            start + len(members) > app_settings.BATCH_MAX_FILES
+            or any(
+                member.file_size > app_settings.BATCH_MAX_FILE_MB * 2**20
+                for member in members
+            )
+            or sum(member.file_size for member in members)
+            > app_settings.BATCH_MAX_UNPACKED_MB * 2**20
+        ):
+            raise ArchiveTooLargeException
+        for member in members:
+            name = Path(member.filename).name
+            member_path = input_dir / f"{start + len(scores):03}_{name}"
+            with archive.open(member) as src, open(member_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            scores.append(member_path)
+    upload_path.unlink()
+    return scores
+
+
+async def cancel_on_disconnect(
+    request: Request, job: Awaitable[T], cancel: Callable[[], None]
+) -> T:
+    """
+    Wait for submitted job(s), calling `cancel` if the client disconnects
+    meanwhile, so the workers stop instead of finishing a result nobody will
+    fetch. Still waits for the cancelled job(s) to stop, so their workspace is
+    not removed under them.
+    """
+
+    task = asyncio.ensure_future(job)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            core_logger.info("Client disconnected, cancelling its conversion")
+            cancel()
+            return await task
+
+
+def get_tool_stats(tool: ToolTypeEnum) -> ToolStats:
+    """
+    Measured performance of a tool over the recent jobs on this node.
+    """
+
+    return ToolStats(**metrics.tool_stats(tool.value))
+
+
+def describe_processing_time(stats: ToolStats) -> str:
+    if stats.seconds_per_page_p50 is None:
+        return "Not measured yet"
+    hours = stats.window_seconds // 3600
+    return (
+        f"~{stats.seconds_per_page_p50} sec/page "
+        f"(p95 {stats.seconds_per_page_p95} sec/page, "
+        f"{stats.jobs} job(s) in the last {hours} h)"
+    )
+
+
+def serve_result(
+    request: Request,
+    result: CachedResult,
+    tool: ToolTypeEnum | None = None,
+    hit: bool = False,
+) -> Response:
+    """
+    Send a cached result as a file, with metadata in headers.
+
+    `FileResponse` streams the file from disk, closes it when done and answers
+    Range requests (Accept-Ranges, 206 partial content), so players can seek.
+    The ETag is the hash of the contents; a matching If-None-Match gets a 304.
+    """
+
+    etag = f'"{result.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=86400",
+        "Content-Location": request.url_for("Get result", key=result.key).path,
+        "X-Cache": "HIT" if hit else "MISS",
+        "X-Meta": json.dumps(result.stats),
+        "X-Skipped-Pages": json.dumps(result.skipped_pages),
+    }
+    if tool:
+        headers["X-Tool"] = tool
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(
+        result.path,
+        media_type=result.media_type,
+        filename=result.filename,
+        headers=headers,
+    )
 
 
 class MusicService:
 
     async def get_info(self, tool: ToolTypeEnum) -> GetInfoResponse:
+        stats = get_tool_stats(tool)
         match tool:
             case ToolTypeEnum.AUDIVERIS:
                 return GetInfoResponse(
-                    note="Audiveris is best with clean, printed PDFs. Not recommended for handwriting or phone pictures."
+                    note="Audiveris is best with clean, printed PDFs. Not recommended for handwriting or phone pictures.",
+                    stats=stats,
+                    soundfonts=soundfonts.names,
                 )
             case ToolTypeEnum.HOMR:
                 return GetInfoResponse(
-                    note="HOMR is best with handwritten notes, sketches, or informal lead sheets."
+                    note="HOMR is best with handwritten notes, sketches, or informal lead sheets.",
+                    stats=stats,
+                    soundfonts=soundfonts.names,
                 )
             case ToolTypeEnum.OEMER:
                 return GetInfoResponse(
-                    note="OEMER is best with scanned pages or mobile photos of simple sheet music."
+                    note="OEMER is best with scanned pages or mobile photos of simple sheet music.",
+                    stats=stats,
+                    soundfonts=soundfonts.names,
+                )
+            case ToolTypeEnum.AUTO:
+                return GetInfoResponse(
+                    note="AUTO picks the fastest suitable tool for every page and only falls back to a slower one if recognition fails.",
+                    stats=stats,
+                    soundfonts=soundfonts.names,
                 )
 
-    async def convert(
-        self, file: UploadFile, tool: ToolTypeEnum, tempo: int = 160, transpose: int = 0
-    ):
-        # Create input/output dirs
-        input_dir = Path("input")
-        # output_dir = Path("output")
-        input_dir.mkdir(exist_ok=True)
-        # output_dir.mkdir(exist_ok=True)
+    async def estimate(
+        self,
+        file: UploadFile,
+        tool: ToolTypeEnum,
+        preview: bool = False,
+        pages: str | None = None,
+    ) -> GetEstimateResponse:
+        """
+        Predict a conversion without running it: the pages it covers (raster or
+        vector), the expected processing time from the tool's recent speed and
+        the current wait for a worker. Only the PDF's page tree and content
+        streams are read, nothing is rendered.
+        """
 
-        ROOT_DIR = Path("/home/mind/Desktop/fastapi-demo-app/ScoreAPI")
-        output_dir = ROOT_DIR / "output"
+        try:
+            selected_pages = parse_page_ranges(pages) if pages else None
+        except ValueError:
+            raise InvalidPageRangeException
+
+        upload_dir = Path(app_settings.WORK_DIR) / uuid4().hex
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            upload_path = upload_dir / Path(file.filename or "uploaded_file.pdf").name
+            await save_upload(file, upload_path)
+            estimate = await asyncio.to_thread(
+                estimate_job, tool, upload_path, selected_pages, preview, True
+            )
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
 
-        # Clear the output folder
-        if output_dir.exists():
-            shutil.rmtree(output_dir)
+        return GetEstimateResponse(
+            pages=estimate.pages,
+            total_pages=estimate.total_pages,
+            raster_pages=estimate.raster_pages,
+            vector_pages=estimate.vector_pages,
+            seconds_per_page=estimate.seconds_per_page,
+            measured=estimate.measured,
+            estimated_seconds=estimate.seconds,
+            queue_wait_seconds=queue_wait(tool),
+            stats=get_tool_stats(tool),
+        )
+
+    async def convert(
+        self,
+        request: Request,
+        file: UploadFile,
+        tool: ToolTypeEnum,
+        tempo: int = 160,
+        transpose: int = 0,
+        output: OutputFormatEnum = OutputFormatEnum.MP3,
+        soundfont: str | None = None,
+        preview: bool = False,
+        pages: str | None = None,
+        user: str = "",
+    ) -> Response:
+        # Fails early for unknown fonts and malformed page selections
+        soundfonts.resolve(soundfont)
+        try:
+            selected_pages = parse_page_ranges(pages) if pages else None
+        except ValueError:
+            raise InvalidPageRangeException
 
-        # Recreate the empty folder
-        output_dir.mkdir(parents=True, exist_ok=True)
+        # The upload lands in a directory of its own until its key is known
+        upload_dir = Path(app_settings.WORK_DIR) / uuid4().hex
+        upload_dir.mkdir(parents=True, exist_ok=True)
 
         # Safe filename
         filename = Path(file.filename or "uploaded_file.pdf").name
-        input_path = input_dir / filename
+        upload_path = upload_dir / filename
+        job_dir = None
 
-        # Save uploaded file
-        with open(input_path, "wb") as f:
-            f.write(await file.read())
+        try:
+            # Save uploaded file
+            input_hash = await save_upload(file, upload_path)
+            submitted_at = time.time()
 
-        SOUNDFONT_PATH = Path(
-            "/home/mind/Downloads/twinkle-twinkle-little-star-piano-solo.sf2"
-        )
+            result_cache = ResultCache()
+            key = conversion_key(
+                input_hash,
+                tool,
+                tempo,
+                transpose,
+                output,
+                soundfont,
+                preview,
+                selected_pages,
+            )
+            # May download the result from the cache store, so off the event loop
+            if cached := await asyncio.to_thread(result_cache.get, key):
+                return serve_result(request, cached, tool, hit=True)
 
-        try:
-            if tool == "AUDIVERIS":
-                from .audiveris import process_input
-
-                # ✅ Only pass 2 arguments (input and output)
-                process_input(
-                    input_file=input_path,
-                    output_dir=output_dir,
-                    bpm=tempo,
-                    transpose_interval=transpose,
+            # The workspace is named after the key, so a request retrying a
+            # conversion that failed midway resumes from its checkpoint
+            job_dir = Path(app_settings.WORK_DIR) / key
+            with workspace_lock(job_dir):
+                # A concurrent duplicate may have finished meanwhile
+                if cached := await asyncio.to_thread(result_cache.get, key):
+                    return serve_result(request, cached, tool, hit=True)
+
+                input_path = job_dir / "input" / f"score{upload_path.suffix.lower()}"
+                input_path.parent.mkdir(exist_ok=True)
+                upload_path.replace(input_path)
+                output_dir, job_id = job_dir / "output", uuid4().hex
+                # Reads the PDF's page tree, so off the event loop
+                estimate = await asyncio.to_thread(
+                    estimate_job, tool, input_path, selected_pages, preview
+                )
+                result = await cancel_on_disconnect(
+                    request,
+                    submit_job(
+                        tool,
+                        input_path,
+                        output_dir,
+                        tempo,
+                        transpose,
+                        output,
+                        job_id,
+                        submitted_at,
+                        soundfont,
+                        preview,
+                        selected_pages,
+                        user,
+                        estimate.seconds,
+                    ),
+                    lambda: cancel_job(output_dir, job_id),
+                )
+
+                output_path = result.output_path
+                if not output_path or not output_path.exists():
+                    raise FileNotFoundError(f"{output.value} not created")
+
+                # Copies the result and may upload it to the cache store
+                cached = await asyncio.to_thread(
+                    result_cache.put,
+                    key,
+                    output_path,
+                    filename=(
+                        f"{upload_path.stem}{'_preview' if preview else ''}"
+                        f"{output.suffix}"
+                    ),
+                    media_type=output.media_type,
+                    skipped_pages=result.skipped_pages,
+                    stats=result.stats,
                 )
+            # The result is served from the cache, so the workspace can go now
+            await asyncio.to_thread(remove_workspace, job_dir)
+            return serve_result(request, cached, tool)
 
-                mp3_path = output_dir / input_path.stem / f"{input_path.stem}.mp3"
+        except CustomException:
+            # Retrying will not help
+            if job_dir:
+                await asyncio.to_thread(remove_workspace, job_dir)
+            raise
+        except Exception as e:
+            # The workspace stays for a retry to resume (see `WORKSPACE_TTL`)
+            raise RuntimeError(f"Conversion failed: {str(e)}")
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
 
-                meta = {"processingTime": "~18–20 sec/page", "accuracy": "85–95%"}
+    async def get_result(self, request: Request, key: str) -> Response:
+        """
+        Serve a finished conversion again by its key, e.g. for seeking in it.
+        """
 
-            elif tool == "HOMR":
-                from .homr import main
+        cached = await asyncio.to_thread(ResultCache().get, key)
+        if not cached:
+            raise ResultNotFoundException
+        return serve_result(request, cached, hit=True)
 
-                main(
-                    input_path, SOUNDFONT_PATH, bpm=tempo, transpose_interval=transpose
-                )
-                mp3_path = output_dir / f"{input_path.stem}_merged.mp3"
+    async def convert_batch(
+        self,
+        request: Request,
+        files: list[UploadFile],
+        tool: ToolTypeEnum,
+        tempo: int = 160,
+        transpose: int = 0,
+        soundfont: str | None = None,
+        user: str = "",
+    ):
+        """
+        Convert many scores with shared settings and return the MP3s as one zip.
 
-                meta = {"processingTime": "~60–80 sec/image", "accuracy": "70–85%"}
+        Uploads may be PDFs/images or zip archives of them. All files are queued on
+        the same (already warm) OMR worker pool at once, so setup is paid once per
+        worker rather than once per file. The zip also holds `manifest.json` with
+        the outcome for every file.
+        """
 
-            elif tool == "OEMER":
-                from src.api.v1.music.services import oemer
+        soundfonts.resolve(soundfont)
+        job_dir = Path(app_settings.WORK_DIR) / uuid4().hex
+        input_dir = job_dir / "input"
+        input_dir.mkdir(parents=True, exist_ok=True)
 
-                oemer.main(
-                    input_path, SOUNDFONT_PATH, transpose_interval=transpose, bpm=tempo
+        try:
+            inputs = []
+            for upload in files:
+                filename = Path(upload.filename or "uploaded_file.pdf").name
+                upload_path = input_dir / f"{len(inputs):03}_{filename}"
+                await save_upload(upload, upload_path)
+                # Extracting archives writes up to BATCH_MAX_UNPACKED_MB
+                inputs.extend(
+                    await asyncio.to_thread(
+                        unpack_scores, upload_path, input_dir, len(inputs)
+                    )
                 )
-                mp3_path = Path("output") / f"{input_path.stem}_merged.mp3"
 
-                meta = {"processingTime": "~160–170 sec/image", "accuracy": "60–70%"}
+            if not inputs:
+                raise NoScoresInUploadException
 
-            else:
-                raise ValueError("Unsupported tool")
+            submitted_at = time.time()
+            # Reads the PDFs' page trees, so off the event loop
+            costs = await asyncio.to_thread(
+                lambda: [estimate_job(tool, path).seconds for path in inputs]
+            )
+            jobs = [
+                (job_dir / "output" / input_path.stem, f"{job_dir.name}-{index}")
+                for index, input_path in enumerate(inputs)
+            ]
+            results = await cancel_on_disconnect(
+                request,
+                asyncio.gather(
+                    *(
+                        submit_job(
+                            tool,
+                            input_path,
+                            output_dir,
+                            tempo,
+                            transpose,
+                            OutputFormatEnum.MP3,
+                            job_id,
+                            submitted_at,
+                            soundfont,
+                            user=user,
+                            cost=cost,
+                        )
+                        for input_path, cost, (output_dir, job_id) in zip(
+                            inputs, costs, jobs
+                        )
+                    ),
+                    return_exceptions=True,
+                ),
+                lambda: [cancel_job(output_dir, job_id) for output_dir, job_id in jobs],
+            )
 
-            if not mp3_path.exists():
-                raise FileNotFoundError("MP3 not created")
+            manifest = []
+            zip_path = job_dir / "scores.zip"
+            # MP3 is already compressed, so store instead of deflating again
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+                for input_path, result in zip(inputs, results):
+                    entry = {"file": input_path.name.split("_", 1)[1]}
+                    if isinstance(result, BaseException):
+                        entry["error"] = str(result)
+                    elif not result.output_path or not result.output_path.exists():
+                        entry["error"] = "MP3 not created"
+                    else:
+                        entry["mp3"] = f"{input_path.stem}.mp3"
+                        entry["skippedPages"] = result.skipped_pages
+                        entry["meta"] = result.stats
+                        archive.write(result.output_path, entry["mp3"])
+                    manifest.append(entry)
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2))
 
-            # Return MP3 directly with metadata in headers
-            return StreamingResponse(
-                open(mp3_path, "rb"),
-                media_type="audio/mpeg",
-                headers={
-                    "Content-Disposition": f"attachment; filename={mp3_path.name}",
-                    "X-Tool": tool,
-                    "X-Meta": json.dumps(meta),
-                },
+            return FileResponse(
+                zip_path,
+                media_type="application/zip",
+                filename="scores.zip",
+                headers={"X-Tool": tool},
+                background=BackgroundTask(shutil.rmtree, job_dir, ignore_errors=True),
             )
 
+        except CustomException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
         except Exception as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
             raise RuntimeError(f"Conversion failed: {str(e)}")
 
     async def get_results(self, tool: ToolTypeEnum) -> GetResultResponse:
+        stats = get_tool_stats(tool)
+        processing_time = describe_processing_time(stats)
         match tool:
             case ToolTypeEnum.AUDIVERIS:
                 return GetResultResponse(
@@ -128,7 +518,8 @@ class MusicService:
                         "May be tricky to set up without help",
                     ],
                     accuracy="85–95% (best with clear prints)",
-                    processing_time="~18-20 sec/page",
+                    processing_time=processing_time,
+                    stats=stats,
                 )
             case ToolTypeEnum.HOMR:
                 return GetResultResponse(
@@ -142,7 +533,8 @@ class MusicService:
                         "Still in testing — not for professional use yet",
                     ],
                     accuracy="70–85% (best with handwritten scores)",
-                    processing_time="~60–80 sec/image",
+                    processing_time=processing_time,
+                    stats=stats,
                 )
             case ToolTypeEnum.OEMER:
                 return GetResultResponse(
@@ -157,5 +549,21 @@ class MusicService:
                         "Unclear or low-quality sheet music can introduce extra noise or timing discrepancies in the output.",
                     ],
                     accuracy="60–70% (best with simple scores)",
-                    processing_time="~160–170 sec/image without GPU",
+                    processing_time=processing_time,
+                    stats=stats,
+                )
+            case ToolTypeEnum.AUTO:
+                return GetResultResponse(
+                    pros=[
+                        "No need to know which tool fits your sheet music",
+                        "Clean pages go to the fastest tool, difficult pages to the specialised ones",
+                        "Mixed documents (printed and handwritten pages) are handled page by page",
+                    ],
+                    cons=[
+                        "Pages that fail recognition are retried with slower tools",
+                        "Processing time varies with the content of each page",
+                    ],
+                    accuracy="60–95% (depends on the tool chosen for each page)",
+                    processing_time=processing_time,
+                    stats=stats,
                 )
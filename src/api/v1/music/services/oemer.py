@@ -1,65 +1,73 @@
+import logging
 import shutil
-import subprocess
+import time
+from itertools import islice
 from multiprocessing import Pool, cpu_count
 from pathlib import Path
-
-from music21 import converter, midi, tempo
-from pdf2image import convert_from_path
-
-
-def run_oemer(img_path: Path, out_dir: Path):
+from typing import Iterator
+
+from src.api.v1.music.enums import OutputFormatEnum
+from src.api.v1.music.services.audio import encode_wavs
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.api.v1.music.services.export import export_scores, first_measures
+from src.api.v1.music.services.pages import PageCache, filter_pages, select_pages
+from src.api.v1.music.services.pipeline import JobResult, Stage, run_pipeline
+from src.core.metrics import adopt_job, job_context, observe, timed
+from src.core.processes import (
+    JobCancelled,
+    run_tool,
+    watch_cancellation,
+    watched_cancel_file,
+)
+
+log = logging.getLogger(__name__)
+
+
+@timed("omr")
+def run_oemer(img_path: Path, out_dir: Path) -> Path | None:
     cmd = ["oemer", str(img_path), "-o", str(out_dir)]
-    subprocess.run(cmd, check=True)
-
-
-def merge_mp3s(mp3_files: list[Path], output_path: Path):
-    concat_file = output_path.with_suffix(".txt")
-    with open(concat_file, "w") as f:
-        for mp3 in mp3_files:
-            f.write(f"file '{mp3.resolve()}'\n")
-
-    subprocess.run(
-        [
-            "ffmpeg",
-            "-y",
-            "-f",
-            "concat",
-            "-safe",
-            "0",
-            "-i",
-            str(concat_file),
-            "-c",
-            "copy",
-            str(output_path),
-        ],
-        check=True,
-    )
-    concat_file.unlink()
+    run_tool(cmd, "omr")
+    xml_path = out_dir / f"{img_path.stem}.musicxml"
+    return xml_path if xml_path.exists() else None
+
 
+def convert_pdf_parallel(
+    pdf: Path, out_dir: Path, pages: list[int] | None = None
+) -> Iterator[Path]:
+    from pdf2image import convert_from_path, pdfinfo_from_path
 
-def convert_pdf_parallel(pdf: Path, out_dir: Path):
-    pages = convert_from_path(str(pdf), dpi=300)
-    args = []
+    # Rasterize lazily, one page per step, so OEMER can start on the first page;
+    # pages that are not selected are never decoded
+    page_count = pdfinfo_from_path(str(pdf))["Pages"]
+    for i in select_pages(pages, page_count):
+        with timed("rasterize"):
+            page = convert_from_path(str(pdf), dpi=300, first_page=i, last_page=i)[0]
+            img = out_dir / f"{pdf.stem}_pg{i}.png"
+            page.save(img, "PNG")
+        yield img
 
-    for i, page in enumerate(pages, start=1):
-        img = out_dir / f"{pdf.stem}_pg{i}.png"
-        page.save(img, "PNG")
-        args.append((img, out_dir))
 
-    # Run OEMER on all pages in parallel
-    with Pool(cpu_count()) as pool:
-        pool.starmap(run_oemer, args)
+def adopt_context(context: dict, cancel_file: Path | None) -> None:
+    # Audio workers record timings for, and stop with, the job that started them
+    adopt_job(context)
+    watch_cancellation(cancel_file)
 
 
-def musicxml_to_midi_and_mp3(
+def musicxml_to_wav(
     xml_path: Path,
     out_dir: Path,
     sf2: Path,
     transpose_interval: int = 0,
     tempo_bpm: int = 120,
+    max_measures: int | None = None,
 ):
+    from music21 import converter, midi, tempo
+
     try:
-        score = converter.parse(str(xml_path))
+        with timed("parse"):
+            score = converter.parse(str(xml_path))
+        midi_start = time.perf_counter()
+        score = first_measures(score, max_measures)
 
         # Remove all tempo marks
         for el in score.recurse().getElementsByClass("MetronomeMark"):
@@ -68,7 +76,6 @@ def musicxml_to_midi_and_mp3(
 
         # Transpose if needed
         if transpose_interval != 0:
-            print(transpose_interval)
             score = score.transpose(transpose_interval)
 
         # Flatten to avoid part overlaps
@@ -77,7 +84,7 @@ def musicxml_to_midi_and_mp3(
         # 🔍 Extract note times
         note_offsets = [n.offset for n in score.recurse().notes]
         if not note_offsets:
-            print(f"⚠️ No notes found in {xml_path.name}")
+            log.warning(f"No notes found in {xml_path.name}")
             return
 
         start_time = min(note_offsets)
@@ -86,7 +93,7 @@ def musicxml_to_midi_and_mp3(
         # Clamp very long note durations
         for n in score.recurse().notes:
             if n.quarterLength > 100:
-                print(f"⚠️ Clamping note {n} with duration {n.quarterLength:.2f}")
+                log.warning(f"Clamping note {n} with duration {n.quarterLength:.2f}")
                 n.quarterLength = 1.0
 
         # Trim score to only actual notes (+10s padding)
@@ -96,8 +103,8 @@ def musicxml_to_midi_and_mp3(
 
         # 🔒 Hard cap duration: 10 minutes (600s)
         if trimmed_score.highestTime > 600:
-            print(
-                f"⚠️ Trimming {xml_path.name} to 600s max (was {trimmed_score.highestTime:.2f}s)"
+            log.warning(
+                f"Trimming {xml_path.name} to 600s max (was {trimmed_score.highestTime:.2f}s)"
             )
             trimmed_score = trimmed_score.getElementsByOffset(
                 0, 600, includeEndBoundary=True
@@ -105,8 +112,8 @@ def musicxml_to_midi_and_mp3(
 
         # Final check
         if trimmed_score.highestTime > 1000:
-            print(
-                f"❌ Still too long after trim: {trimmed_score.highestTime:.2f}s → Skipping {xml_path.name}"
+            log.error(
+                f"Still too long after trim: {trimmed_score.highestTime:.2f}s → Skipping {xml_path.name}"
             )
             return
 
@@ -116,76 +123,155 @@ def musicxml_to_midi_and_mp3(
         mf.open(str(midi_path), "wb")
         mf.write()
         mf.close()
+        observe("midi", time.perf_counter() - midi_start)
 
-        # Convert to WAV using FluidSynth
+        # Convert to WAV using FluidSynth (pages are encoded together, see `encode_wavs`)
         wav_path = midi_path.with_suffix(".wav")
-        mp3_path = midi_path.with_suffix(".mp3")
-        subprocess.run(
-            ["fluidsynth", "-ni", str(sf2), str(midi_path), "-F", str(wav_path)],
-            check=True,
-        )
-
-        # Convert WAV to MP3
-        subprocess.run(["ffmpeg", "-y", "-i", str(wav_path), str(mp3_path)], check=True)
+        with timed("synth"):
+            run_tool(
+                [
+                    "fluidsynth",
+                    "-ni",
+                    str(sf2),
+                    str(midi_path),
+                    "-F",
+                    str(wav_path),
+                    "-r",
+                    "44100",
+                ],
+                "synth",
+            )
 
         # Clean up
         midi_path.unlink()
-        wav_path.unlink()
-
-    except Exception as e:
-        print(f"❌ Failed processing {xml_path.name}: {e}")
 
+        return wav_path
 
-def musicxml_to_mp3_parallel(
-    xml_files, out_dir, sf2, transpose_interval: int = 0, tempo_bpm: int = 120
-):
-    args = [(xml, out_dir, sf2, transpose_interval, tempo_bpm) for xml in xml_files]
-    with Pool(cpu_count()) as pool:
-        pool.starmap(musicxml_to_midi_and_mp3, args)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        log.error(f"Failed processing {xml_path.name}: {e}")
 
 
 def main(
-    input_file: Path, soundfont: Path, transpose_interval: int = 0, bpm: int = 120
-):
-    output = Path("output")
-
-    # 🧹 Step 1: Clean previous output
-    if output.exists():
-        for file in output.iterdir():
+    input_file: Path,
+    soundfont: Path,
+    transpose_interval: int = 0,
+    bpm: int = 120,
+    output_dir: Path = Path("output"),
+    max_workers: int | None = None,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    checkpoint: Checkpoint | None = None,
+    max_pages: int | None = None,
+    max_measures: int | None = None,
+    pages: list[int] | None = None,
+) -> JobResult:
+    result = JobResult()
+    checkpoint = checkpoint or Checkpoint(output_dir)
+
+    # 🧹 Step 1: Clean previous output, unless resuming from it
+    if checkpoint.resuming:
+        log.info("Resuming from checkpoint")
+    elif output_dir.exists():
+        for file in output_dir.iterdir():
+            if file.name.startswith("."):
+                # Lock and cancel files of the running job
+                continue
             if file.is_file():
                 file.unlink()
             elif file.is_dir():
                 shutil.rmtree(file)
     else:
-        output.mkdir(parents=True, exist_ok=True)
+        output_dir.mkdir(parents=True, exist_ok=True)
 
-    # ---------------- PDF → OEMER ---------------- #
+    # ---------------- Stream pages: rasterize → OEMER → audio ---------------- #
     if input_file.suffix.lower() == ".pdf":
-        convert_pdf_parallel(input_file, output)
+        images = checkpoint.pages(convert_pdf_parallel(input_file, output_dir, pages))
     else:
-        run_oemer(input_file, output)
-
-    # ---------------- Sort XML files by page number ---------------- #
-    xml_files = sorted(
-        output.glob("*.musicxml"), key=lambda x: int(x.stem.split("_pg")[-1])
+        # A single image needs no rasterizing, but still counts as a page
+        observe("rasterize", 0.0)
+        images, pages = iter([input_file]), None
+
+    workers = max_workers or cpu_count()
+    page_cache = PageCache("OEMER")
+    pages = islice(filter_pages(images, result.skipped_pages, pages), max_pages)
+    recognize = Stage(
+        "oemer",
+        checkpoint.stage(
+            "musicxml",
+            lambda img: page_cache.recognize(
+                img, lambda page: run_oemer(page, output_dir)
+            ),
+        ),
+        workers=workers,
     )
 
-    # ---------------- MusicXML → MP3 in parallel ---------------- #
-    musicxml_to_mp3_parallel(
-        xml_files,
-        output,
-        soundfont,
-        transpose_interval=transpose_interval,
-        tempo_bpm=bpm,
-    )
+    if not output.is_audio:
+        # ---------------- MIDI/MusicXML: OEMER → parse, then one export ---------------- #
+        def parse(xml_path: Path):
+            from music21 import converter
+
+            with timed("parse"):
+                return converter.parse(str(xml_path))
+
+        scores = run_pipeline(
+            pages, [recognize, Stage("musicxml", parse)], maxsize=workers
+        )
+        if scores:
+            result.output_path = export_scores(
+                f"{input_file.stem}_merged",
+                scores,
+                output_dir,
+                bpm=bpm,
+                transpose_interval=transpose_interval,
+                output=output,
+                checkpoint=checkpoint,
+                max_measures=max_measures,
+            )
+        else:
+            log.warning("No MusicXML was recognized. Skipping export.")
+        return result
+
+    # music21 work is CPU bound, so the audio stage hands pages to a process pool
+    # while the OEMER stage keeps recognizing the following pages.
+    with Pool(
+        workers,
+        initializer=adopt_context,
+        initargs=(job_context(), watched_cancel_file()),
+    ) as pool:
+        wav_files = run_pipeline(
+            pages,
+            [
+                recognize,
+                Stage(
+                    "audio",
+                    checkpoint.stage(
+                        "audio",
+                        lambda xml: pool.apply(
+                            musicxml_to_wav,
+                            (
+                                xml,
+                                output_dir,
+                                soundfont,
+                                transpose_interval,
+                                bpm,
+                                max_measures,
+                            ),
+                        ),
+                    ),
+                    workers=workers,
+                ),
+            ],
+            maxsize=workers,
+        )
 
-    # ---------------- Merge MP3s ---------------- #
-    mp3_files = [
-        xml.with_suffix(".mp3") for xml in xml_files if xml.with_suffix(".mp3").exists()
-    ]
-    if mp3_files:
-        merged_mp3 = output / f"{input_file.stem}_merged.mp3"
-        merge_mp3s(mp3_files, merged_mp3)
-        print(f"🎵 Merged MP3 available at: {merged_mp3}")
+    # ---------------- One normalized encode for the whole document ---------------- #
+    if wav_files:
+        merged = output_dir / f"{input_file.stem}_merged{output.suffix}"
+        result.output_path = encode_wavs(wav_files, merged, output)
+        for wav_path in wav_files:
+            wav_path.unlink()
+        log.info(f"Merged {output.value} available at: {merged}")
     else:
-        print("⚠️ No MP3s were generated. Skipping merge.")
+        log.warning(f"No {output.value} files were generated. Skipping merge.")
+    return result
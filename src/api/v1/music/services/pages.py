@@ -0,0 +1,361 @@
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from config.config import app_settings
+from src.core.storage import TieredCache, shared_store
+
+log = logging.getLogger(__name__)
+
+# A page is blank when less than this share of its pixels is ink.
+BLANK_INK_RATIO = 0.001
+
+# Pages are downscaled to this width before looking for staff lines.
+STAFF_ANALYSIS_WIDTH = 1200
+
+# The page is cut into this many vertical strips, so lines that are not quite
+# straight (a bent page in a photo) are still found within each strip.
+STAFF_STRIPS = 4
+
+# Pages photographed or scanned at up to this angle (degrees) are straightened
+# before looking for staff lines, in steps of SKEW_STEP.
+MAX_SKEW = 6.0
+SKEW_STEP = 0.25
+
+# Share of a strip's width a row must be covered by to count as a staff line.
+MIN_LINE_COVERAGE = 0.5
+
+# Suffixes of the MusicXML the OMR tools produce, as kept by `PageCache`.
+MUSICXML_SUFFIXES = (".musicxml", ".mxl", ".xml")
+
+# Highest page number a page selection may name.
+MAX_PAGE_NUMBER = 10_000
+
+
+def parse_page_ranges(spec: str) -> list[int]:
+    """
+    Parse a page selection such as "3-7,12" (1-based, inclusive ranges).
+
+    Returns:
+        list[int]: The selected page numbers, sorted and without duplicates.
+
+    Raises:
+        ValueError: If the selection is malformed, empty or out of bounds.
+    """
+
+    pages = set()
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        start, end = int(first), int(last if dash else first)
+        if not 1 <= start <= end <= MAX_PAGE_NUMBER:
+            raise ValueError(f"Invalid page range: {part.strip()}")
+        pages.update(range(start, end + 1))
+    return sorted(pages)
+
+
+def select_pages(pages: list[int] | None, page_count: int) -> list[int]:
+    """
+    Page numbers to convert out of a document with `page_count` pages: the
+    selected ones that exist, or all of them if `pages` is None.
+    """
+
+    if pages is None:
+        return list(range(1, page_count + 1))
+    selected = [number for number in pages if number <= page_count]
+    if len(selected) < len(pages):
+        log.warning(f"Ignoring selected pages beyond the last page ({page_count})")
+    return selected
+
+
+def is_raster_page(page) -> bool:
+    """
+    Determine if a PDF page (a PyMuPDF `Page`) is raster (scanned/screenshot)
+    or vector (digital), from its text, vector drawings and images.
+    """
+
+    # Text exists → likely vector; checked first as it is the cheapest
+    if page.get_text().strip():
+        return False
+    # Vector shapes → vector; image-only (or empty) page → raster
+    return not page.get_drawings()
+
+
+def page_hash(img_path: Path) -> str:
+    """
+    Compute the digest of a page image's pixels.
+
+    The page is decoded to grayscale and its size and pixels are hashed, so the
+    same page saved in another format, or rendered again, gives the same digest,
+    while a page differing in a single pixel (a hollow instead of a filled
+    notehead, a staccato dot) does not. Perceptual hashes are deliberately not
+    used: at any useful resolution they also match such pages.
+
+    Returns:
+        str: Hex digest of the page.
+    """
+
+    from PIL import Image
+
+    with Image.open(img_path) as img:
+        img = img.convert("L")
+    digest = hashlib.sha256(f"{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def is_blank(img_path: Path) -> bool:
+    """
+    Check whether a page image carries (almost) no ink.
+    """
+
+    from PIL import Image
+
+    img = Image.open(img_path).convert("L")
+    img.thumbnail((500, 1000))
+    histogram = img.histogram()
+    dark = sum(histogram[:128])
+    # Light-on-dark pages: count the bright pixels instead
+    if dark > sum(histogram) / 2:
+        dark = sum(histogram[128:])
+    return dark / max(sum(histogram), 1) < BLANK_INK_RATIO
+
+
+def _rotate(img, angle: float):
+    import cv2
+
+    height, width = img.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (width, height), flags=cv2.INTER_NEAREST)
+
+
+def skew_angle(ink) -> float:
+    """
+    Angle (degrees) by which a binarized page must be rotated to make its
+    lines horizontal: the one giving the sharpest horizontal projection
+    profile, up to MAX_SKEW either way.
+    """
+
+    import cv2
+    import numpy as np
+
+    # Half the analysis width is enough to tell the angles apart
+    small = cv2.resize(ink, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    angles = np.arange(-MAX_SKEW, MAX_SKEW + SKEW_STEP / 2, SKEW_STEP)
+    scores = [
+        np.square(_rotate(small, angle).sum(axis=1, dtype=np.float64)).sum()
+        for angle in angles
+    ]
+    return float(angles[int(np.argmax(scores))])
+
+
+def count_staves(img_path: Path) -> int:
+    """
+    Count five-line staves on a page using a horizontal projection profile.
+
+    The page is downscaled, binarized and straightened (see `skew_angle`), a
+    morphological opening keeps only long horizontal runs (text, lyrics and
+    note heads disappear), and each vertical strip is scanned for groups of
+    five evenly spaced lines.
+
+    Returns:
+        int: Number of staves found in the strip that shows the most.
+    """
+
+    import cv2
+    import numpy as np
+
+    img = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return 0
+    scale = STAFF_ANALYSIS_WIDTH / img.shape[1]
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    _, ink = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    if ink.mean() > 127:  # light-on-dark page
+        ink = 255 - ink
+    if angle := skew_angle(ink):
+        ink = _rotate(ink, angle)
+
+    strip_width = ink.shape[1] // STAFF_STRIPS
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(strip_width // 4, 1), 1))
+    lines = cv2.morphologyEx(ink, cv2.MORPH_OPEN, kernel)
+
+    best = 0
+    for strip in range(STAFF_STRIPS):
+        part = lines[:, strip * strip_width : (strip + 1) * strip_width]
+        profile = part.sum(axis=1) / (255 * max(part.shape[1], 1))
+        rows = np.flatnonzero(profile > MIN_LINE_COVERAGE)
+        if rows.size == 0:
+            continue
+
+        # Adjacent rows belong to the same (thick) line
+        groups = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1)
+        centres = [group.mean() for group in groups]
+
+        staves, i = 0, 0
+        while i + 4 < len(centres):
+            gaps = np.diff(centres[i : i + 5])
+            if gaps.max() <= 1.5 * gaps.min() and gaps.max() < ink.shape[0] / 20:
+                staves += 1
+                i += 5
+            else:
+                i += 1
+        best = max(best, staves)
+    return best
+
+
+def filter_pages(
+    images: Iterable[Path], skipped: list[int], pages: list[int] | None = None
+) -> Iterator[Path]:
+    """
+    Drop pages without music before they reach an OMR tool.
+
+    Parameters:
+        images (Iterable[Path]): Rasterized pages, in page order.
+        skipped (list[int]): Receives the 1-based numbers of dropped pages.
+        pages (list[int] | None): Page numbers of `images` if only some pages
+            were rasterized (see `select_pages`); 1, 2, ... if None.
+
+    Yields:
+        Path: Pages that are not blank and contain at least one staff.
+    """
+
+    numbers = pages or itertools.count(1)
+    for img_path, number in zip(images, numbers):
+        if is_blank(img_path):
+            log.info(f"Skipping blank page: {img_path.name}")
+        elif not count_staves(img_path):
+            log.info(f"Skipping page without staves: {img_path.name}")
+        else:
+            yield img_path
+            continue
+        skipped.append(number)
+
+
+class PageCache:
+    """
+    MusicXML produced for earlier pages, keyed by OMR tool and page digest.
+
+    Identical pages (repeated exercises, duplicated title pages, the same page in
+    another upload) are recognized once; later occurrences get a copy of the cached
+    MusicXML. With `CACHE_STORE` that holds for pages recognized on other nodes
+    too (see `TieredCache`); uploads still running when the job ends are waited
+    for by `run_job`.
+    """
+
+    _locks: dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, tool: str, root: Path | None = None):
+        self.root = (root or Path(app_settings.CACHE_DIR)) / "pages" / tool
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.tiers = TieredCache(self.root, f"pages/{tool}", shared_store())
+
+    def _lock(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(f"{self.root}/{key}", threading.Lock())
+
+    def recognize(
+        self, img_path: Path, recognize: Callable[[Path], Path | None]
+    ) -> Path | None:
+        """
+        Return MusicXML for a page, running `recognize` only on a cache miss.
+
+        Parameters:
+            img_path (Path): Rasterized page.
+            recognize (Callable): OMR function returning the MusicXML path (or None).
+
+        Returns:
+            Path | None: MusicXML for the page, or None if nothing was recognized.
+        """
+
+        key = page_hash(img_path)
+        # Holding the lock makes a duplicate page in the same job wait for the
+        # first occurrence instead of running OMR twice.
+        with self._lock(key):
+            if cached := self._lookup(key):
+                return self._reuse(cached, img_path)
+            xml_path = recognize(img_path)
+            if xml_path and xml_path.exists():
+                self._add(key, xml_path)
+            return xml_path
+
+    def recognize_batch(
+        self,
+        images: list[Path],
+        recognize: Callable[[list[Path]], list[Path | None]],
+    ) -> list[Path | None]:
+        """
+        Like `recognize` for several pages, with a single `recognize` call for
+        the pages missing from the cache (identical pages only once).
+
+        Parameters:
+            images (list[Path]): Rasterized pages.
+            recognize (Callable): OMR function returning the MusicXML path (or
+                None) of each page it is given, in order.
+
+        Returns:
+            list[Path | None]: MusicXML of each page, or None if nothing was
+                recognized.
+        """
+
+        keys = [page_hash(img_path) for img_path in images]
+        cached: dict[str, Path] = {}
+        missing: dict[str, Path] = {}
+        for img_path, key in zip(images, keys):
+            if key in cached or key in missing:
+                continue
+            if found := self._lookup(key):
+                cached[key] = found
+            else:
+                missing[key] = img_path
+
+        recognized: dict[str, Path] = {}
+        if missing:
+            for key, xml_path in zip(missing, recognize(list(missing.values()))):
+                if xml_path and xml_path.exists():
+                    recognized[key] = xml_path
+                    cached[key] = self._add(key, xml_path)
+
+        results = []
+        for img_path, key in zip(images, keys):
+            if missing.get(key) == img_path:
+                results.append(recognized.get(key))
+            elif key in cached:
+                results.append(self._reuse(cached[key], img_path))
+            else:
+                results.append(None)
+        return results
+
+    def _lookup(self, key: str) -> Path | None:
+        cached = next(self.root.glob(f"{key}.*"), None) or next(
+            (
+                self.root / f"{key}{suffix}"
+                for suffix in MUSICXML_SUFFIXES
+                if self.tiers.fetch(self.root / f"{key}{suffix}")
+            ),
+            None,
+        )
+        if cached:
+            self.tiers.touch(cached)
+        return cached
+
+    def _reuse(self, cached: Path, img_path: Path) -> Path:
+        log.info(f"Reusing MusicXML of an identical page for {img_path.name}")
+        target = img_path.with_suffix(cached.suffix)
+        shutil.copy(cached, target)
+        return target
+
+    def _add(self, key: str, xml_path: Path) -> Path:
+        partial = self.root / f".{key}.{os.getpid()}.tmp"
+        shutil.copy(xml_path, partial)
+        cached = self.root / f"{key}{xml_path.suffix}"
+        partial.replace(cached)
+        self.tiers.store_later(cached)
+        return cached
@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from src.core.processes import (
+    JobCancelled,
+    JobPreempted,
+    check_cancelled,
+    check_preempted,
+)
+
+log = logging.getLogger(__name__)
+
+# Marks the end of the stream on a stage queue.
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of a page pipeline.
+
+    Attributes:
+        name (str): Name used in log messages.
+        func (Callable): Called with the output of the previous stage for a single page.
+            Returning None drops the page from the rest of the pipeline.
+        workers (int): Number of pages this stage may work on concurrently.
+        batch (int): If more than 1, `func` is called with a list of up to this
+            many pages (those already waiting, never waiting for more) and
+            returns a list with the output for each of them.
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    batch: int = 1
+
+
+@dataclass
+class JobResult:
+    """
+    Outcome of a conversion job.
+
+    Attributes:
+        output_path (Path | None): Final output (audio, MIDI or MusicXML), or None if
+            nothing could be converted.
+        skipped_pages (list[int]): 1-based numbers of pages dropped before OMR
+            (blank pages, covers, text-only pages).
+        stats (dict): Measured timings of the job (see `metrics.finish_job`).
+    """
+
+    output_path: Path | None = None
+    skipped_pages: list[int] = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+def run_pipeline(
+    pages: Iterable[Any], stages: list[Stage], maxsize: int = 2
+) -> list[Any]:
+    """
+    Stream pages through stages connected by bounded queues.
+
+    Each stage runs in its own worker thread(s), so page k can be in the last stage
+    while page k+1 is in the middle one and page k+2 is still being produced by
+    `pages`. The bounded queues keep a fast producer from rasterizing the whole
+    document ahead of a slow OMR stage.
+
+    Parameters:
+        pages (Iterable): Source of pages, typically a generator that rasterizes lazily.
+        stages (list[Stage]): Stages to apply, in order.
+        maxsize (int): Capacity of each queue between stages.
+
+    Returns:
+        list: Output of the last stage for every page that made it through, in page order.
+
+    A page is dropped (and logged) when a stage returns None for it or raises (a
+    batching stage drops its whole batch). Errors raised by `pages` itself are
+    re-raised once the pipeline has drained. Once the job is cancelled or
+    preempted (see `processes.JobCancelled` and `JobPreempted`) no more pages are
+    produced or processed, and the interruption is raised as soon as the pipeline
+    has drained.
+    """
+
+    # A batching stage may hold a whole batch waiting in its inbox
+    sizes = [max(maxsize, stage.batch) for stage in stages] + [maxsize]
+    queues = [queue.Queue(maxsize=size) for size in sizes]
+    source_error: list[BaseException] = []
+    interrupted: list[JobCancelled | JobPreempted] = []
+
+    def feed():
+        try:
+            for index, page in enumerate(pages):
+                if interrupted:
+                    break
+                queues[0].put((index, page))
+        except BaseException as e:
+            source_error.append(e)
+        finally:
+            for _ in range(stages[0].workers if stages else 1):
+                queues[0].put(_DONE)
+
+    def take(stage: Stage, inbox: queue.Queue) -> tuple[list, bool]:
+        # The next page, plus those already waiting if the stage batches
+        items = [inbox.get()]
+        while items[-1] is not _DONE and len(items) < stage.batch:
+            try:
+                items.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        done = items[-1] is _DONE
+        return (items[:-1] if done else items), done
+
+    def work(stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            items, done = take(stage, inbox)
+            if items and not interrupted:
+                try:
+                    check_cancelled()
+                    check_preempted()
+                    if stage.batch > 1:
+                        results = stage.func([page for _, page in items])
+                    else:
+                        results = [stage.func(items[0][1])]
+                except (JobCancelled, JobPreempted) as e:
+                    interrupted.append(e)
+                    results = []
+                except Exception as e:
+                    pages = ", ".join(str(index + 1) for index, _ in items)
+                    log.warning(f"{stage.name} failed for page {pages}: {e}")
+                    results = []
+                for (index, _), result in zip(items, results):
+                    if result is None:
+                        log.warning(
+                            f"{stage.name} produced nothing for page {index + 1}"
+                        )
+                        continue
+                    outbox.put((index, result))
+            if done:
+                return
+
+    def close(threads: list[threading.Thread], outbox: queue.Queue, consumers: int):
+        for thread in threads:
+            thread.join()
+        for _ in range(consumers):
+            outbox.put(_DONE)
+
+    threading.Thread(target=feed, daemon=True).start()
+
+    for position, stage in enumerate(stages):
+        inbox, outbox = queues[position], queues[position + 1]
+        threads = [
+            threading.Thread(target=work, args=(stage, inbox, outbox), daemon=True)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        consumers = stages[position + 1].workers if position + 1 < len(stages) else 1
+        threading.Thread(
+            target=close, args=(threads, outbox, consumers), daemon=True
+        ).start()
+
+    results = []
+    while (item := queues[-1].get()) is not _DONE:
+        results.append(item)
+
+    if interrupted:
+        raise interrupted[0]
+    if source_error:
+        raise source_error[0]
+
+    return [result for _, result in sorted(results, key=lambda item: item[0])]
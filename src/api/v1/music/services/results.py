@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from config.config import app_settings
+from src.core.storage import TieredCache, shared_store
+
+log = logging.getLogger(__name__)
+
+# Read size for hashing and copying uploads.
+CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path: Path) -> str:
+    """
+    SHA-256 of a file's contents, read in chunks.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def save_upload(upload: UploadFile, path: Path) -> str:
+    """
+    Write an uploaded file to `path` and return the SHA-256 of its contents.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := await upload.read(CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedResult:
+    """
+    A finished conversion stored in the result cache.
+
+    Attributes:
+        key (str): Cache key (see `ResultCache.key`).
+        path (Path): The output file.
+        filename (str): Name to offer the client for the file.
+        media_type (str): Content type of the file.
+        etag (str): SHA-256 of the file contents.
+        skipped_pages (list[int]): Pages dropped before OMR.
+        stats (dict): Measured timings of the job that produced it.
+    """
+
+    key: str
+    path: Path
+    filename: str
+    media_type: str
+    etag: str
+    skipped_pages: list[int] = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+class ResultCache:
+    """
+    Finished conversions, keyed by the uploaded file and the conversion settings.
+
+    Each result is stored as `<key><suffix>` next to `<key>.json`, which holds
+    what is needed to serve it again. Both are written atomically, the metadata
+    last, so a result is only visible once complete. Uploading the same score
+    with the same settings is then answered without running OMR, and clients
+    can fetch (and seek in) a result again by its key.
+
+    With `CACHE_STORE` the results are shared by all nodes: a result missing
+    here is fetched from the store (read-through) and new ones are uploaded to
+    it in the background (write-behind), the metadata last, while this node
+    keeps the recently used ones as a local hot tier (see `TieredCache`).
+    """
+
+    def __init__(self, root: Path | None = None):
+        self.root = root or Path(app_settings.CACHE_DIR) / "results"
+        self.tiers = TieredCache(self.root, "results", shared_store())
+
+    @staticmethod
+    def key(input_hash: str, **settings) -> str:
+        """
+        Cache key of a conversion: the hash of the input, the settings that
+        change the output and the app version.
+        """
+
+        payload = json.dumps(
+            {"input": input_hash, "version": app_settings.APP_VERSION, **settings},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> CachedResult | None:
+        meta_path = self.root / f"{key}.json"
+        if not self.tiers.fetch(meta_path):
+            return None
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        path = self.root / meta.pop("file")
+        if not self.tiers.fetch(path):
+            return None
+        self.tiers.touch(meta_path)
+        self.tiers.touch(path)
+        return CachedResult(key=key, path=path, **meta)
+
+    def _write(self, key: str, target: Path, write) -> None:
+        partial = self.root / f".{key}.{os.getpid()}.tmp"
+        write(partial)
+        partial.replace(target)
+
+    def put(
+        self,
+        key: str,
+        source: Path,
+        filename: str,
+        media_type: str,
+        skipped_pages: list[int] | None = None,
+        stats: dict | None = None,
+    ) -> CachedResult:
+        """
+        Store a finished conversion and return the cached copy.
+        """
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        result = CachedResult(
+            key=key,
+            path=self.root / f"{key}{source.suffix}",
+            filename=filename,
+            media_type=media_type,
+            etag=file_hash(source),
+            skipped_pages=skipped_pages or [],
+            stats=stats or {},
+        )
+
+        self._write(key, result.path, lambda partial: shutil.copyfile(source, partial))
+        meta = {**asdict(result), "file": result.path.name}
+        del meta["key"], meta["path"]
+        meta_path = self.root / f"{key}.json"
+        self._write(
+            key, meta_path, lambda partial: partial.write_text(json.dumps(meta))
+        )
+        self.tiers.store_later(result.path, meta_path)
+        log.info(f"Cached result {key} ({filename})")
+        return result
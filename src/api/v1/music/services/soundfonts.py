@@ -0,0 +1,155 @@
+import logging
+import mmap
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config.config import tool_settings
+from src.api.v1.music.exceptions import UnknownSoundFontException
+
+log = logging.getLogger(__name__)
+
+# Name under which `SOUNDFONT_PATH` is registered; used when a request names none.
+DEFAULT_SOUNDFONT = "default"
+
+# LIST chunks every SoundFont 2 file holds below its RIFF "sfbk" form.
+_REQUIRED_LISTS = {b"INFO", b"sdta", b"pdta"}
+
+
+def validate_soundfont(data) -> None:
+    """
+    Check that `data` (bytes or a memory map) is a complete SoundFont 2 file.
+
+    Raises:
+        ValueError: If it is not, with the reason.
+    """
+
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"sfbk":
+        raise ValueError("not a SoundFont 2 file")
+    end = 8 + struct.unpack_from("<I", data, 4)[0]
+    if end > len(data):
+        raise ValueError(f"truncated ({len(data)} of {end} bytes)")
+
+    lists = set()
+    offset = 12
+    while offset + 8 <= end:
+        chunk_id, chunk_size = struct.unpack_from("<4sI", data, offset)
+        if chunk_id == b"LIST":
+            lists.add(bytes(data[offset + 8 : offset + 12]))
+        # RIFF chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+    if missing := _REQUIRED_LISTS - lists:
+        raise ValueError(f"missing {', '.join(sorted(m.decode() for m in missing))}")
+
+
+@dataclass
+class SoundFont:
+    """
+    A validated SoundFont, mapped into memory.
+
+    Attributes:
+        name (str): Name requests choose it by.
+        path (Path): The .sf2 file, as handed to FluidSynth.
+        size (int): File size in bytes.
+        mapping (mmap.mmap): Read-only mapping of the whole file.
+    """
+
+    name: str
+    path: Path
+    size: int
+    mapping: mmap.mmap = field(repr=False)
+
+
+def map_soundfont(name: str, path: Path) -> SoundFont:
+    """
+    Map a SoundFont read-only and validate it.
+
+    Raises:
+        OSError: If the file cannot be opened or mapped.
+        ValueError: If it is empty or not a valid SoundFont.
+    """
+
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        validate_soundfont(mapping)
+    except ValueError:
+        mapping.close()
+        raise
+    if hasattr(mapping, "madvise"):
+        # Read the font into the page cache now rather than on the first job
+        mapping.madvise(mmap.MADV_WILLNEED)
+    return SoundFont(name=name, path=path.resolve(), size=len(mapping), mapping=mapping)
+
+
+class SoundFontRegistry:
+    """
+    The SoundFonts requests can choose from: `SOUNDFONT_PATH` as "default" plus
+    the named fonts in `SOUNDFONTS`.
+
+    Each font is validated and memory-mapped once per process. The mappings are
+    file-backed, so every worker process shares the same page-cache pages, and
+    keeping them mapped keeps the fonts resident: FluidSynth, which loads the
+    font by path on every run, then reads it from memory instead of disk.
+    Fonts that fail validation are logged and left out.
+    """
+
+    def __init__(self, fonts: dict[str, str] | None = None):
+        self._configured = fonts
+        self._fonts: dict[str, SoundFont] = {}
+        self.errors: dict[str, str] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        """
+        Validate and map every configured font. Runs once per process.
+        """
+
+        if self._loaded:
+            return
+        self._loaded = True
+        configured = self._configured or {
+            DEFAULT_SOUNDFONT: tool_settings.SOUNDFONT_PATH,
+            **tool_settings.SOUNDFONTS,
+        }
+        for name, path in configured.items():
+            try:
+                self._fonts[name] = map_soundfont(name, Path(path))
+            except (OSError, ValueError) as e:
+                self.errors[name] = str(e)
+                log.error(f"SoundFont '{name}' ({path}) is unusable: {e}")
+        if self._fonts:
+            log.info(
+                "SoundFonts ready: "
+                + ", ".join(
+                    f"{font.name} ({font.size / 2**20:.1f} MB)"
+                    for font in self._fonts.values()
+                )
+            )
+
+    @property
+    def names(self) -> list[str]:
+        self.load()
+        return list(self._fonts)
+
+    def resolve(self, name: str | None = None) -> Path:
+        """
+        Path of the SoundFont called `name`, or of the default one.
+
+        The default is returned even if it failed validation, so FluidSynth
+        reports the problem as it did before the registry existed.
+
+        Raises:
+            UnknownSoundFontException: If `name` is not a usable font.
+        """
+
+        self.load()
+        if name in (None, DEFAULT_SOUNDFONT):
+            font = self._fonts.get(DEFAULT_SOUNDFONT)
+            return font.path if font else Path(tool_settings.SOUNDFONT_PATH)
+        if name not in self._fonts:
+            raise UnknownSoundFontException
+        return self._fonts[name].path
+
+
+soundfonts = SoundFontRegistry()
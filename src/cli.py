@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+
+app = typer.Typer(help="ScoreAPI command line tools.")
+
+
+@app.callback()
+def main() -> None:
+    """
+    ScoreAPI command line tools.
+    """
+
+
+@app.command()
+def benchmark(
+    corpus: Path = typer.Argument(
+        ..., exists=True, help="Sample PDF/image, or a directory of them."
+    ),
+    tools: List[ToolTypeEnum] = typer.Option(
+        [ToolTypeEnum.AUDIVERIS, ToolTypeEnum.HOMR, ToolTypeEnum.OEMER],
+        "--tool",
+        "-t",
+        help="Tool to benchmark; repeat the option for several.",
+    ),
+    repeat: int = typer.Option(1, min=1, help="Runs per tool and score."),
+    output: Path = typer.Option(
+        Path("benchmark.json"), "--output", "-o", help="Report to write."
+    ),
+    stubs: Optional[Path] = typer.Option(
+        None,
+        exists=True,
+        file_okay=False,
+        help="Directory of stand-in executables for the external tools "
+        "(see benchmarks/stubs).",
+    ),
+    baseline: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="Earlier report to compare against."
+    ),
+    tolerance: float = typer.Option(
+        0.2, help="Allowed relative slowdown before a timing counts as regressed."
+    ),
+    keep: Optional[Path] = typer.Option(
+        None, file_okay=False, help="Keep the outputs of every run in this directory."
+    ),
+) -> None:
+    """
+    Run a corpus of scores through the OMR pipelines and write a JSON report with
+    per-stage wall time, CPU time, peak RSS and output note counts.
+
+    Exits with status 1 if a baseline is given and the results regressed.
+    """
+    from src.core.benchmark import build_report, collect_corpus, compare, run_benchmark
+
+    inputs = collect_corpus(corpus)
+    if not inputs:
+        typer.echo(f"No scores found in {corpus}", err=True)
+        raise typer.Exit(2)
+
+    def progress(run: dict) -> None:
+        outcome = "ok" if run["ok"] else f"failed: {run.get('error', 'no MP3')}"
+        typer.echo(
+            f"{run['tool']:<10} {Path(run['file']).name} #{run['attempt']}: "
+            f"{run.get('wallSeconds', '-')} sec, {run.get('notes', '-')} notes, {outcome}"
+        )
+
+    work_dir = keep or Path(tempfile.mkdtemp(prefix="scoreapi-benchmark-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        runs = run_benchmark(
+            inputs,
+            [tool.value for tool in tools],
+            work_dir,
+            repeat=repeat,
+            stubs=stubs,
+            progress=progress,
+        )
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = build_report(runs, repeat, stubs)
+    output.write_text(json.dumps(report, indent=2))
+    typer.echo(f"Report written to {output}")
+
+    if baseline:
+        regressions = compare(
+            report["summary"], json.loads(baseline.read_text())["summary"], tolerance
+        )
+        for regression in regressions:
+            typer.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            raise typer.Exit(1)
+
+
+@app.command()
+def worker() -> None:
+    """
+    Run conversions from the job queue (`JOB_QUEUE`) on this node with
+    `OMR_WORKERS` worker processes, so OMR capacity scales apart from the API
+    nodes. Stops taking jobs on SIGINT/SIGTERM and finishes the running ones,
+    or returns them to the queue after `SHUTDOWN_TIMEOUT` seconds.
+    """
+    from src.api.v1.music.services.jobs import (
+        cancel_queued_job,
+        queued_job_ticket,
+        run_queued_job,
+    )
+    from src.core.queue import job_queue
+    from src.core.workers import serve_queue
+
+    queue = job_queue()
+    if queue is None:
+        typer.echo("Set JOB_QUEUE to the queue the API nodes use", err=True)
+        raise typer.Exit(2)
+    asyncio.run(
+        serve_queue(queue, run_queued_job, cancel_queued_job, queued_job_ticket)
+    )
+
+
+@app.command()
+def precompute(
+    library: Path = typer.Argument(
+        ..., exists=True, file_okay=False, help="Directory of PDFs/images to convert."
+    ),
+    tool: ToolTypeEnum = typer.Option(
+        ToolTypeEnum.AUTO, "--tool", "-t", help="Tool to convert with."
+    ),
+    workers: int = typer.Option(
+        os.cpu_count() or 1, "--workers", "-w", min=1, help="Worker processes."
+    ),
+    output: OutputFormatEnum = typer.Option(
+        OutputFormatEnum.MP3, "--format", help="Format of the results."
+    ),
+    tempo: int = typer.Option(120, min=40, max=240, help="Playback tempo in BPM."),
+    transpose: int = typer.Option(
+        0, min=-12, max=12, help="Transposition in semitones."
+    ),
+    soundfont: Optional[str] = typer.Option(None, help="SoundFont name for audio."),
+) -> None:
+    """
+    Convert every PDF/image below a directory into the result cache, so the
+    API answers requests for them (with the same settings) without running OMR.
+
+    Scores already cached are skipped, so running it again after an
+    interruption or on a grown library only converts what is missing;
+    half-converted scores resume from their checkpoint. Exits with status 1 if
+    any score failed.
+    """
+    from tqdm import tqdm
+
+    from src.core.benchmark import collect_corpus
+
+    inputs = collect_corpus(library)
+    if not inputs:
+        typer.echo(f"No scores found in {library}", err=True)
+        raise typer.Exit(2)
+    # Read by the worker processes to share the cores between them
+    os.environ["OMR_WORKERS"] = str(workers)
+    from src.core.precompute import precompute as run_precompute
+
+    with tqdm(total=len(inputs), unit="score") as bar:
+        counts = {"converted": 0, "cached": 0, "failed": 0}
+
+        def progress(path: Path, outcome: str) -> None:
+            counts[outcome] += 1
+            bar.set_postfix(counts, refresh=False)
+            bar.update()
+
+        summary = run_precompute(
+            inputs,
+            tool,
+            workers,
+            output=output,
+            tempo=tempo,
+            transpose=transpose,
+            soundfont=soundfont,
+            progress=progress,
+        )
+
+    typer.echo(
+        f"{summary.converted} converted, {summary.cached} already cached, "
+        f"{len(summary.failed)} failed"
+    )
+    for path, error in summary.failed.items():
+        typer.echo(f"Failed: {path}: {error}", err=True)
+    if summary.failed:
+        raise typer.Exit(1)
+
+
+@app.command("benchmark-merge")
+def benchmark_merge(
+    pages: int = typer.Option(100, min=1, help="Pages per document."),
+    seconds: float = typer.Option(10.0, min=0.1, help="Seconds of audio per page."),
+    audio: OutputFormatEnum = typer.Option(
+        OutputFormatEnum.MP3, "--format", help="Audio format to encode."
+    ),
+    repeat: int = typer.Option(3, min=1, help="Number of runs."),
+    output: Path = typer.Option(
+        Path("benchmark-merge.json"), "--output", "-o", help="Report to write."
+    ),
+    stubs: Optional[Path] = typer.Option(
+        None,
+        exists=True,
+        file_okay=False,
+        help="Directory of stand-in executables for the external tools "
+        "(see benchmarks/stubs).",
+    ),
+) -> None:
+    """
+    Merge, normalize and encode a synthetic many-page document and write a JSON
+    report with wall time, encoder CPU time, peak RSS and per-stage timings.
+    """
+    from src.core.benchmark import build_report, run_merge_benchmark
+
+    if not audio.is_audio:
+        typer.echo(f"{audio.value} is not an audio format", err=True)
+        raise typer.Exit(2)
+
+    def progress(run: dict) -> None:
+        outcome = "ok" if run["ok"] else f"failed: {run.get('error')}"
+        typer.echo(
+            f"{run['pages']} pages #{run['attempt']}: {run['wallSeconds']} sec, "
+            f"{run.get('peakRssMb')} MB peak RSS, {outcome}"
+        )
+
+    work_dir = Path(tempfile.mkdtemp(prefix="scoreapi-benchmark-merge-"))
+    try:
+        runs = run_merge_benchmark(
+            work_dir,
+            pages=pages,
+            seconds=seconds,
+            output=audio.value,
+            repeat=repeat,
+            stubs=stubs,
+            progress=progress,
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = build_report([{"tool": "MERGE", **run} for run in runs], repeat, stubs)
+    output.write_text(json.dumps(report, indent=2))
+    typer.echo(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    app()
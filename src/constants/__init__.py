@@ -1,4 +1,18 @@
-from src.constants.messages import ERROR, EXPIRED_TOKEN, INVALID_CRED, INVALID_TOKEN, SOMETHING_WENT_WRONG, SUCCESS
+from src.constants.messages import (
+    ARCHIVE_TOO_LARGE,
+    ERROR,
+    EXPIRED_TOKEN,
+    INVALID_CRED,
+    INVALID_PAGE_RANGE,
+    INVALID_TOKEN,
+    NO_SCORES_IN_UPLOAD,
+    NOT_READY,
+    RESULT_NOT_FOUND,
+    SHUTTING_DOWN,
+    SOMETHING_WENT_WRONG,
+    SUCCESS,
+    UNKNOWN_SOUNDFONT,
+)
 
 __all__ = [
     "EXPIRED_TOKEN",
@@ -7,4 +21,11 @@ __all__ = [
     "SUCCESS",
     "ERROR",
     "INVALID_CRED",
+    "NOT_READY",
+    "SHUTTING_DOWN",
+    "NO_SCORES_IN_UPLOAD",
+    "RESULT_NOT_FOUND",
+    "UNKNOWN_SOUNDFONT",
+    "INVALID_PAGE_RANGE",
+    "ARCHIVE_TOO_LARGE",
 ]
@@ -9,3 +9,17 @@ EXPIRED_TOKEN = "Expired Token!"
 ERROR = "Error"
 
 INVALID_CRED = "Invalid credentials"
+
+NOT_READY = "Service is starting up"
+
+SHUTTING_DOWN = "Server is shutting down, please retry"
+
+NO_SCORES_IN_UPLOAD = "No PDF or image files found in the upload"
+
+RESULT_NOT_FOUND = "Result not found, please convert the file again"
+
+UNKNOWN_SOUNDFONT = "Unknown SoundFont, see the tool info for the available ones"
+
+INVALID_PAGE_RANGE = "Invalid page selection, expected e.g. 3-7,12"
+
+ARCHIVE_TOO_LARGE = "Zip archive holds too many or too large files to unpack"
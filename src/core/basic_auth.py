@@ -1,3 +1,5 @@
+import secrets
+
 from fastapi import Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
@@ -5,7 +7,7 @@ from config.config import basic_auth_settings
 from src.api.v1.music.exceptions import InvalidCredsException
 
 
-def basic_auth(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+def basic_auth(credentials: HTTPBasicCredentials = Depends(HTTPBasic())) -> str:
     """
     Dependency function for required basic authentication.
     It uses the HTTPBasic instance to perform authentication.
@@ -14,16 +16,22 @@ def basic_auth(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
     - credentials: HTTPBasicCredentials object containing the provided username and password.
 
     Returns:
-    - True if authentication is successful.
+    - The username if authentication is successful (`BASIC_USERNAME` or one
+      of `BASIC_USERS`).
 
     Raises:
     - InvalidCredsException: If authentication fails.
     """
 
-    if (
-        credentials.username == basic_auth_settings.BASIC_USERNAME
-        and credentials.password == basic_auth_settings.BASIC_PASSWORD
+    accounts = dict(basic_auth_settings.BASIC_USERS)
+    if basic_auth_settings.BASIC_USERNAME is not None:
+        accounts[basic_auth_settings.BASIC_USERNAME] = (
+            basic_auth_settings.BASIC_PASSWORD
+        )
+    password = accounts.get(credentials.username)
+    if password is not None and secrets.compare_digest(
+        credentials.password.encode(), password.encode()
     ):
-        return True
+        return credentials.username
     else:
         raise InvalidCredsException
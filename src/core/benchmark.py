@@ -0,0 +1,431 @@
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import wave
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from xml.etree import ElementTree
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_XML_SUFFIXES = (".xml", ".musicxml")
+
+
+def collect_corpus(corpus: Path) -> list[Path]:
+    """
+    Return the scores to benchmark: `corpus` itself if it is a file, otherwise
+    every PDF/image below it, sorted by path.
+    """
+
+    from src.api.v1.music.services.music import SCORE_SUFFIXES
+
+    if corpus.is_file():
+        return [corpus]
+    return sorted(
+        path
+        for path in corpus.rglob("*")
+        if path.is_file() and path.suffix.lower() in SCORE_SUFFIXES
+    )
+
+
+def count_musicxml_notes(xml_path: Path) -> int:
+    """
+    Count the notes (not rests) in a MusicXML file, compressed (.mxl) or not.
+    """
+
+    if xml_path.suffix.lower() == ".mxl":
+        with zipfile.ZipFile(xml_path) as archive:
+            name = next(
+                name
+                for name in archive.namelist()
+                if not name.startswith("META-INF") and name.endswith(_XML_SUFFIXES)
+            )
+            root = ElementTree.fromstring(archive.read(name))
+    else:
+        root = ElementTree.parse(xml_path).getroot()
+    return sum(1 for note in root.iter("note") if note.find("rest") is None)
+
+
+def count_notes(output_dir: Path) -> int:
+    """
+    Count the notes recognized in a job: the notes of every MusicXML file the
+    OMR tools wrote. Copies re-saved by MuseScore are left out.
+    """
+
+    return sum(
+        count_musicxml_notes(path)
+        for path in output_dir.rglob("*")
+        if path.suffix.lower() in (*_XML_SUFFIXES, ".mxl")
+        and not path.name.endswith(".fixed.xml")
+    )
+
+
+def _cpu_seconds(usage: resource.struct_rusage) -> float:
+    return usage.ru_utime + usage.ru_stime
+
+
+def _measure(tool: str, input_path: Path, run_dir: Path) -> dict:
+    """
+    Convert one score and measure it. Runs in a fresh process per run, so peak
+    RSS and CPU time belong to this run alone.
+
+    CPU time and child peak RSS include the external tools (Audiveris, FluidSynth,
+    FFmpeg, ...) and the processes OEMER forks.
+    """
+
+    from src.api.v1.music.enums import ToolTypeEnum
+    from src.api.v1.music.services.jobs import run_job
+    from src.core.warmup import WARMUP_MODULES, preload
+
+    # Import time is a startup cost, not part of the conversion
+    preload(WARMUP_MODULES)
+
+    output_dir = run_dir / "output"
+    record = {"ok": False}
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        result = run_job(
+            ToolTypeEnum(tool), input_path, output_dir, job_id=run_dir.name
+        )
+    except Exception as e:
+        record["error"] = str(e)
+        result = None
+    wall = time.perf_counter() - start
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    record.update(
+        wallSeconds=round(wall, 3),
+        cpuSeconds=round(
+            _cpu_seconds(self_after)
+            - _cpu_seconds(self_before)
+            + _cpu_seconds(children_after)
+            - _cpu_seconds(children_before),
+            3,
+        ),
+        peakRssMb=round(self_after.ru_maxrss * _RSS_UNIT / 2**20, 1),
+        childPeakRssMb=round(children_after.ru_maxrss * _RSS_UNIT / 2**20, 1),
+        notes=count_notes(output_dir),
+    )
+    if result is not None:
+        pages = result.stats.get("pages") or 0
+        record.update(
+            ok=bool(result.output_path and result.output_path.exists()),
+            pages=pages,
+            skippedPages=result.skipped_pages,
+            secondsPerPage=round(wall / pages, 3) if pages else None,
+            stages=result.stats.get("stages", {}),
+        )
+    return record
+
+
+@contextmanager
+def _environment(work_dir: Path, run_dir: Path, stubs: Path | None):
+    """
+    Set the environment a run process is spawned with.
+
+    The settings are read when the spawned process imports them, which happens
+    before it is handed any work, so they can only be passed this way.
+    """
+
+    env = {
+        # A fresh page cache per run, so repeats measure OMR and not the cache
+        "CACHE_DIR": str(run_dir / "cache"),
+        "METRICS_DB": str(work_dir / "metrics.sqlite3"),
+    }
+    if stubs:
+        stubs = stubs.resolve()
+        env["PATH"] = f"{stubs}{os.pathsep}{os.environ.get('PATH', '')}"
+        env["AUDIVERIS_BIN"] = str(stubs / "audiveris")
+        env["HOMR_BIN"] = str(stubs / "homr")
+
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def run_benchmark(
+    inputs: list[Path],
+    tools: list[str],
+    work_dir: Path,
+    repeat: int = 1,
+    stubs: Path | None = None,
+    progress=None,
+) -> list[dict]:
+    """
+    Convert every input with every tool, `repeat` times, one process per run.
+
+    Parameters:
+        inputs (list[Path]): Scores to convert.
+        tools (list[str]): Tool names (`ToolTypeEnum` values).
+        work_dir (Path): Directory for the runs' inputs, outputs and caches.
+        repeat (int): Runs per tool and input.
+        stubs (Path | None): Directory of stand-in executables used instead of
+            the installed OMR tools, MuseScore, FluidSynth and FFmpeg.
+        progress (Callable | None): Called with every finished run record.
+
+    Returns:
+        list[dict]: One record per run.
+    """
+
+    runs = []
+    spawn = multiprocessing.get_context("spawn")
+    for tool in tools:
+        for input_path in inputs:
+            for attempt in range(1, repeat + 1):
+                run_dir = work_dir / f"{tool}-{input_path.stem}-{attempt}"
+                (run_dir / "input").mkdir(parents=True, exist_ok=True)
+                run_input = run_dir / "input" / input_path.name
+                shutil.copyfile(input_path, run_input)
+
+                with _environment(work_dir, run_dir, stubs), ProcessPoolExecutor(
+                    1, mp_context=spawn
+                ) as executor:
+                    try:
+                        record = executor.submit(
+                            _measure, tool, run_input, run_dir
+                        ).result()
+                    except Exception as e:
+                        # The run process itself died (e.g. killed for memory)
+                        record = {"ok": False, "error": str(e)}
+
+                record = {
+                    "tool": tool,
+                    "file": str(input_path),
+                    "attempt": attempt,
+                    **record,
+                }
+                runs.append(record)
+                if progress:
+                    progress(record)
+    return runs
+
+
+def write_test_pages(
+    directory: Path, pages: int, seconds: float, rate: int = 44100
+) -> list[Path]:
+    """
+    Write `pages` stereo 16-bit WAV files of `seconds` each, shaped like rendered
+    pages: a tone whose loudness differs from page to page, then a second of
+    silence.
+    """
+
+    import numpy as np
+
+    directory.mkdir(parents=True, exist_ok=True)
+    time_axis = np.arange(int(seconds * rate)) / rate
+    paths = []
+    for page in range(1, pages + 1):
+        amplitude = 0.05 + 0.45 * (page % 7) / 6
+        tone = amplitude * np.sin(2 * np.pi * (220 + 20 * (page % 12)) * time_axis)
+        samples = np.concatenate([tone, np.zeros(rate)])
+        frames = np.repeat((samples * (2**15 - 1)).astype("<i2"), 2)
+
+        path = directory / f"page_{page}.wav"
+        with wave.open(str(path), "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(frames.tobytes())
+        paths.append(path)
+    return paths
+
+
+def _measure_merge(wav_paths: list[Path], output_path: Path, output: str) -> dict:
+    """
+    Merge and encode one document's pages (see `audio.encode_wavs`) and measure
+    it, in a fresh process like `_measure`.
+    """
+
+    from src.api.v1.music.enums import OutputFormatEnum
+    from src.api.v1.music.services.audio import encode_wavs
+    from src.core import metrics
+
+    metrics.start_job(output_path.stem, "MERGE", time.time())
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        encode_wavs(wav_paths, output_path, OutputFormatEnum(output))
+        record = {"ok": output_path.exists()}
+    except Exception as e:
+        record = {"ok": False, "error": str(e)}
+    wall = time.perf_counter() - start
+    stats = metrics.finish_job(success=record["ok"])
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    record.update(
+        wallSeconds=round(wall, 3),
+        childCpuSeconds=round(
+            _cpu_seconds(children_after) - _cpu_seconds(children_before), 3
+        ),
+        peakRssMb=round(self_after.ru_maxrss * _RSS_UNIT / 2**20, 1),
+        outputMb=(
+            round(output_path.stat().st_size / 2**20, 1) if record["ok"] else None
+        ),
+        stages=stats.get("stages", {}),
+    )
+    return record
+
+
+def run_merge_benchmark(
+    work_dir: Path,
+    pages: int = 100,
+    seconds: float = 10.0,
+    output: str = "mp3",
+    repeat: int = 1,
+    stubs: Path | None = None,
+    progress=None,
+) -> list[dict]:
+    """
+    Benchmark the final merge and encode of a job on synthetic pages, one
+    process per run.
+
+    Parameters:
+        work_dir (Path): Directory for the pages, outputs and metrics.
+        pages (int): Pages per document.
+        seconds (float): Length of each page's tone.
+        output (str): Audio format (`OutputFormatEnum` value).
+        repeat (int): Number of runs.
+        stubs (Path | None): Directory of stand-in executables (see `run_benchmark`).
+        progress (Callable | None): Called with every finished run record.
+
+    Returns:
+        list[dict]: One record per run.
+    """
+
+    from src.api.v1.music.enums import OutputFormatEnum
+
+    suffix = OutputFormatEnum(output).suffix
+    wav_paths = write_test_pages(work_dir / "pages", pages, seconds)
+    runs = []
+    spawn = multiprocessing.get_context("spawn")
+    for attempt in range(1, repeat + 1):
+        run_dir = work_dir / f"merge-{attempt}"
+        run_dir.mkdir(parents=True, exist_ok=True)
+        # The file name doubles as the job id of the run's measurements
+        output_path = run_dir / f"{uuid.uuid4().hex}{suffix}"
+        with _environment(work_dir, run_dir, stubs), ProcessPoolExecutor(
+            1, mp_context=spawn
+        ) as executor:
+            try:
+                record = executor.submit(
+                    _measure_merge, wav_paths, output_path, output
+                ).result()
+            except Exception as e:
+                record = {"ok": False, "error": str(e)}
+
+        record = {"pages": pages, "pageSeconds": seconds, "attempt": attempt, **record}
+        runs.append(record)
+        if progress:
+            progress(record)
+    return runs
+
+
+def _median(values: list) -> float | None:
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+def summarize(runs: list[dict]) -> dict:
+    """
+    Aggregate the runs per tool: medians of the timings and note counts, the
+    highest peak RSS and the success rate.
+    """
+
+    summary = {}
+    for tool in dict.fromkeys(run["tool"] for run in runs):
+        tool_runs = [run for run in runs if run["tool"] == tool]
+        stages = dict.fromkeys(
+            stage for run in tool_runs for stage in run.get("stages", {})
+        )
+        summary[tool] = {
+            "runs": len(tool_runs),
+            "successRate": round(
+                sum(run["ok"] for run in tool_runs) / len(tool_runs), 3
+            ),
+            "wallSeconds": _median([run.get("wallSeconds") for run in tool_runs]),
+            "secondsPerPage": _median([run.get("secondsPerPage") for run in tool_runs]),
+            "cpuSeconds": _median([run.get("cpuSeconds") for run in tool_runs]),
+            "peakRssMb": max(
+                (run.get("peakRssMb", 0) for run in tool_runs), default=None
+            ),
+            "notes": _median([run.get("notes") for run in tool_runs]),
+            "stages": {
+                stage: _median([run.get("stages", {}).get(stage) for run in tool_runs])
+                for stage in stages
+            },
+        }
+    return summary
+
+
+def compare(summary: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    """
+    List the regressions of `summary` against the summary of an earlier report.
+
+    Timings and peak RSS regress when they grow by more than `tolerance` (a
+    fraction); the success rate regresses when it drops at all and the note
+    count when it changes, since recognition output should be deterministic.
+    """
+
+    regressions = []
+    for tool, current in summary.items():
+        before = baseline.get(tool)
+        if not before:
+            continue
+        for key in ("secondsPerPage", "wallSeconds", "cpuSeconds", "peakRssMb"):
+            old, new = before.get(key), current.get(key)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{tool} {key}: {old} -> {new}")
+        if current["successRate"] < before.get("successRate", 0):
+            regressions.append(
+                f"{tool} successRate: {before['successRate']} -> {current['successRate']}"
+            )
+        if before.get("notes") is not None and current["notes"] != before["notes"]:
+            regressions.append(f"{tool} notes: {before['notes']} -> {current['notes']}")
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(runs: list[dict], repeat: int, stubs: Path | None) -> dict:
+    return {
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "stubs": stubs is not None,
+        "repeat": repeat,
+        "summary": summarize(runs),
+        "runs": runs,
+    }
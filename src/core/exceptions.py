@@ -67,6 +67,14 @@ class UnprocessableEntityError(CustomException):
     status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
+class ServiceUnavailableError(CustomException):
+    """
+    Custom exception for representing a Service Unavailable (HTTP 503) error.
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+
+
 class InvalidJWTTokenException(CustomException):
     """
     Custom exception for representing an Unauthorized (HTTP 401) error due to an invalid JWT token.
@@ -0,0 +1,404 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from config.config import app_settings
+from src.core.utils import core_logger
+
+# Upper bounds (seconds) of the histogram buckets. Stages range from a few
+# milliseconds (enhance) to minutes (OEMER on a dense page).
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320, 640)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_buckets (
+    tool TEXT NOT NULL, stage TEXT NOT NULL, le REAL NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tool, stage, le)
+);
+CREATE TABLE IF NOT EXISTS stage_totals (
+    tool TEXT NOT NULL, stage TEXT NOT NULL,
+    sum REAL NOT NULL DEFAULT 0, count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tool, stage)
+);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id TEXT NOT NULL, stage TEXT NOT NULL,
+    seconds REAL NOT NULL DEFAULT 0, count INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY, tool TEXT NOT NULL, finished_at REAL NOT NULL,
+    seconds REAL NOT NULL, queue_wait REAL NOT NULL, pages INTEGER NOT NULL,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_tool ON jobs (tool, finished_at);
+CREATE INDEX IF NOT EXISTS jobs_by_age ON jobs (finished_at);
+CREATE TABLE IF NOT EXISTS job_totals (
+    tool TEXT NOT NULL, success INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tool, success)
+);
+"""
+
+# Stage timings of a job are kept in memory and written in one transaction
+# every FLUSH_INTERVAL seconds, or when the job stops.
+FLUSH_INTERVAL = 30.0
+
+_local = threading.local()
+
+# tool -> (expiry, statistics) of `tool_stats`
+_stats_cache: dict[str, tuple[float, dict]] = {}
+
+# The job this process is working on. OMR worker processes run one job at a
+# time; processes started by a job get it through `adopt_job`.
+_job: dict = {}
+
+# Timings not written yet, as (tool, stage, seconds), and when they were last
+# written (see `_flush`)
+_pending: list[tuple[str, str, float]] = []
+_pending_lock = threading.Lock()
+_flushed_at = 0.0
+
+
+def _connection() -> sqlite3.Connection:
+    """
+    Per-thread connection to the metrics store shared by every process on the node.
+    """
+
+    # A connection must not be shared with a forked child process
+    if getattr(_local, "pid", None) != os.getpid():
+        path = Path(app_settings.METRICS_DB)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_SCHEMA)
+        try:
+            # Stores created before job_stages were pruned by age
+            connection.execute(
+                "ALTER TABLE job_stages ADD COLUMN updated_at REAL NOT NULL DEFAULT 0"
+            )
+        except sqlite3.OperationalError:
+            pass
+        _local.connection = connection
+        _local.pid = os.getpid()
+    return _local.connection
+
+
+def observe(stage: str, seconds: float, tool: str | None = None) -> None:
+    """
+    Record one stage duration for the current job.
+
+    Failures are logged and swallowed: metrics must never break a conversion.
+    """
+
+    with _pending_lock:
+        _pending.append((tool or _job.get("tool", "UNKNOWN"), stage, seconds))
+    # Processes adopting a job (`adopt_job`) may be stopped at any time, so
+    # only the process that started it keeps timings back
+    if (
+        _job.get("pid") != os.getpid()
+        or time.monotonic() - _flushed_at >= FLUSH_INTERVAL
+    ):
+        _flush()
+
+
+def _flush() -> None:
+    """
+    Write the pending timings in one transaction.
+    """
+
+    global _flushed_at
+    with _pending_lock:
+        _flushed_at = time.monotonic()
+        observations = list(_pending)
+        _pending.clear()
+    if not observations:
+        return
+
+    buckets: dict[tuple[str, str, float], int] = {}
+    totals: dict[tuple[str, str], list] = {}
+    for tool, stage, seconds in observations:
+        for le in (*BUCKETS, float("inf")):
+            if seconds <= le:
+                buckets[tool, stage, le] = buckets.get((tool, stage, le), 0) + 1
+        total = totals.setdefault((tool, stage), [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+    job_id = _job.get("job_id")
+    try:
+        connection = _connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO stage_buckets (tool, stage, le) VALUES (?, ?, ?)",
+                [
+                    (tool, stage, le)
+                    for tool, stage in totals
+                    for le in (*BUCKETS, float("inf"))
+                ],
+            )
+            connection.executemany(
+                "UPDATE stage_buckets SET count = count + ? "
+                "WHERE tool = ? AND stage = ? AND le = ?",
+                [(count, *key) for key, count in buckets.items()],
+            )
+            connection.executemany(
+                "INSERT INTO stage_totals (tool, stage, sum, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (tool, stage) DO UPDATE SET "
+                "sum = sum + excluded.sum, count = count + excluded.count",
+                [(tool, stage, *total) for (tool, stage), total in totals.items()],
+            )
+            if job_id:
+                connection.executemany(
+                    "INSERT INTO job_stages (job_id, stage, seconds, count, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (job_id, stage) DO UPDATE SET "
+                    "seconds = seconds + excluded.seconds, "
+                    "count = count + excluded.count, updated_at = excluded.updated_at",
+                    [
+                        (job_id, stage, *total, time.time())
+                        for (_, stage), total in totals.items()
+                    ],
+                )
+    except sqlite3.Error as e:
+        core_logger.warning(f"Could not record {len(observations)} timing(s): {e}")
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time a block (or, used as a decorator, a function call) as one page of `stage`.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def start_job(job_id: str, tool: str, submitted_at: float | None = None) -> None:
+    """
+    Attribute the timings recorded by this process to `job_id` from now on.
+    """
+
+    now = time.time()
+    _flush()
+    _job.clear()
+    _job.update(
+        job_id=job_id,
+        tool=tool,
+        pid=os.getpid(),
+        started_at=now,
+        queue_wait=max(now - submitted_at, 0.0) if submitted_at else 0.0,
+    )
+
+
+def job_context() -> dict:
+    """
+    The job this process is working on, for handing to worker processes.
+    """
+
+    return dict(_job)
+
+
+def adopt_job(context: dict) -> None:
+    """
+    Attribute the timings recorded by this process to a job started in another
+    process (pass as a process pool initializer with `job_context()`).
+    """
+
+    _job.clear()
+    _job.update(context)
+
+
+def suspend_job() -> None:
+    """
+    Stop attributing timings to the current job without recording an outcome,
+    for a job that gave up its worker and runs again later (its stage timings
+    keep adding up under the same id).
+    """
+
+    _flush()
+    _job.clear()
+
+
+def finish_job(success: bool) -> dict:
+    """
+    Record the job outcome and return its measured timings.
+
+    Jobs and stage timings older than `STATS_WINDOW` are deleted on the way,
+    so the store only holds what `tool_stats` reads.
+
+    Returns:
+        dict: Total and per-page seconds, queue wait, page count and the seconds
+        spent in every stage, summed over pages.
+    """
+
+    seconds = time.time() - _job.get("started_at", time.time())
+    stats = {"processingTime": round(seconds, 2), "queueWait": 0.0, "pages": 0}
+    _flush()
+    job_id = _job.get("job_id")
+    if not job_id:
+        return stats
+    stats["queueWait"] = round(_job["queue_wait"], 2)
+
+    try:
+        connection = _connection()
+        stages = {
+            stage: round(total, 2)
+            for stage, total in connection.execute(
+                "SELECT stage, seconds FROM job_stages WHERE job_id = ?", (job_id,)
+            )
+        }
+        row = connection.execute(
+            "SELECT count FROM job_stages WHERE job_id = ? AND stage = 'rasterize'",
+            (job_id,),
+        ).fetchone()
+        pages = row[0] if row else 0
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    _job["tool"],
+                    now,
+                    seconds,
+                    _job["queue_wait"],
+                    pages,
+                    int(success),
+                ),
+            )
+            connection.execute(
+                "INSERT INTO job_totals (tool, success, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (tool, success) DO UPDATE SET count = count + 1",
+                (_job["tool"], int(success)),
+            )
+            # Finished: its stage timings are returned below. Those of jobs
+            # that never finished (a crashed worker) are dropped with age.
+            connection.execute(
+                "DELETE FROM job_stages WHERE job_id = ? OR updated_at < ?",
+                (job_id, now - app_settings.STATS_WINDOW),
+            )
+            connection.execute(
+                "DELETE FROM jobs WHERE finished_at < ?",
+                (now - app_settings.STATS_WINDOW,),
+            )
+    except sqlite3.Error as e:
+        core_logger.warning(f"Could not record job {job_id}: {e}")
+        return stats
+    finally:
+        _job.clear()
+
+    stats.update(
+        pages=pages,
+        secondsPerPage=round(seconds / pages, 2) if pages else None,
+        stages=stages,
+    )
+    return stats
+
+
+def _percentile(values: list[float], percent: float) -> float | None:
+    """
+    Nearest-rank percentile of `values`, or None if there are none.
+    """
+
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, round(percent / 100 * len(values)))
+    return round(values[rank - 1], 2)
+
+
+def tool_stats(tool: str) -> dict:
+    """
+    Rolling statistics of the jobs a tool finished in the last `STATS_WINDOW`
+    seconds on this node.
+
+    Results are cached for `STATS_TTL` seconds, so frequent polling does not
+    hit the store.
+
+    Returns:
+        dict: Job count, success rate, and p50/p95 of seconds per page (of
+        successful jobs) and of queue wait. Values are None without jobs.
+    """
+
+    now = time.time()
+    cached = _stats_cache.get(tool)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    try:
+        rows = (
+            _connection()
+            .execute(
+                "SELECT seconds, queue_wait, pages, success FROM jobs "
+                "WHERE tool = ? AND finished_at >= ?",
+                (tool, now - app_settings.STATS_WINDOW),
+            )
+            .fetchall()
+        )
+    except sqlite3.Error as e:
+        core_logger.warning(f"Could not read statistics of {tool}: {e}")
+        rows = []
+
+    per_page = [seconds / pages for seconds, _, pages, ok in rows if ok and pages]
+    waits = [wait for _, wait, _, _ in rows]
+    stats = {
+        "jobs": len(rows),
+        "success_rate": (
+            round(sum(ok for *_, ok in rows) / len(rows), 3) if rows else None
+        ),
+        "seconds_per_page_p50": _percentile(per_page, 50),
+        "seconds_per_page_p95": _percentile(per_page, 95),
+        "queue_wait_p50": _percentile(waits, 50),
+        "queue_wait_p95": _percentile(waits, 95),
+        "window_seconds": app_settings.STATS_WINDOW,
+    }
+    _stats_cache[tool] = (now + app_settings.STATS_TTL, stats)
+    return stats
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus() -> str:
+    """
+    Render the stage histograms and job counters in the Prometheus text format.
+    """
+
+    connection = _connection()
+    lines = [
+        "# HELP scoreapi_stage_seconds Time spent on one page in a pipeline stage.",
+        "# TYPE scoreapi_stage_seconds histogram",
+    ]
+    for tool, stage, le, count in connection.execute(
+        "SELECT tool, stage, le, count FROM stage_buckets ORDER BY tool, stage, le"
+    ):
+        bound = "+Inf" if le == float("inf") else f"{le:g}"
+        lines.append(
+            f'scoreapi_stage_seconds_bucket{{tool="{_label(tool)}",stage="{_label(stage)}",le="{bound}"}} {count}'
+        )
+    for tool, stage, total, count in connection.execute(
+        "SELECT tool, stage, sum, count FROM stage_totals ORDER BY tool, stage"
+    ):
+        labels = f'tool="{_label(tool)}",stage="{_label(stage)}"'
+        lines.append(f"scoreapi_stage_seconds_sum{{{labels}}} {total}")
+        lines.append(f"scoreapi_stage_seconds_count{{{labels}}} {count}")
+
+    lines += [
+        "# HELP scoreapi_jobs_total Finished conversion jobs.",
+        "# TYPE scoreapi_jobs_total counter",
+    ]
+    for tool, success, count in connection.execute(
+        "SELECT tool, success, count FROM job_totals"
+    ):
+        outcome = "success" if success else "failure"
+        lines.append(
+            f'scoreapi_jobs_total{{tool="{_label(tool)}",outcome="{outcome}"}} {count}'
+        )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,159 @@
+import shutil
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable
+
+from config.config import app_settings
+from src.api.v1.music.enums import OutputFormatEnum, ToolTypeEnum
+from src.api.v1.music.services.checkpoint import remove_workspace, workspace_lock
+from src.api.v1.music.services.jobs import run_job
+from src.api.v1.music.services.music import conversion_key
+from src.api.v1.music.services.results import ResultCache, file_hash
+from src.core.storage import TieredCache
+from src.core.utils import core_logger
+from src.core.workers import create_executor
+
+
+@dataclass
+class PrecomputeSummary:
+    """
+    Outcome of a `precompute` run.
+
+    Attributes:
+        converted (int): Scores converted and added to the result cache.
+        cached (int): Scores whose result was already cached (or that
+            duplicate a score converted in the same run).
+        failed (dict[str, str]): Error per score that could not be converted.
+    """
+
+    converted: int = 0
+    cached: int = 0
+    failed: dict[str, str] = field(default_factory=dict)
+
+
+def precompute(
+    inputs: Iterable[Path],
+    tool: ToolTypeEnum,
+    workers: int,
+    output: OutputFormatEnum = OutputFormatEnum.MP3,
+    tempo: int = 120,
+    transpose: int = 0,
+    soundfont: str | None = None,
+    progress: Callable[[Path, str], None] | None = None,
+) -> PrecomputeSummary:
+    """
+    Convert the scores that are not in the result cache yet, so requests for
+    them are answered from the cache.
+
+    Scores are looked up by content hash and settings exactly as the API does
+    (see `conversion_key`), and converted by `run_job` on `workers` worker
+    processes. Every job runs in the workspace the API would use
+    (`WORK_DIR/<key>`), so an interrupted run is resumed by running it again:
+    finished scores are found in the cache, half-converted ones continue from
+    their checkpoint.
+
+    Parameters:
+        inputs (Iterable[Path]): PDFs and images to convert.
+        tool (ToolTypeEnum): Backend to use.
+        workers (int): Worker processes.
+        output (OutputFormatEnum): Format of the results.
+        tempo (int): Playback tempo in BPM.
+        transpose (int): Transposition in semitones.
+        soundfont (str | None): SoundFont name for audio; the default if None.
+        progress (Callable | None): Called with every score and its outcome:
+            "converted", "cached" or "failed".
+
+    Returns:
+        PrecomputeSummary: Counts of converted and cached scores, and errors.
+    """
+
+    cache = ResultCache()
+    summary = PrecomputeSummary()
+    submitted: set[str] = set()
+    # Score, cache key, workspace and its lock of every running job
+    running: dict[Future, tuple[Path, str, Path, ExitStack]] = {}
+
+    def report(path: Path, outcome: str) -> None:
+        if progress:
+            progress(path, outcome)
+
+    def collect(done: set[Future]) -> None:
+        for future in done:
+            path, key, job_dir, lock = running.pop(future)
+            try:
+                with lock:
+                    result = future.result()
+                    if not result.output_path or not result.output_path.exists():
+                        raise FileNotFoundError(f"{output.value} not created")
+                    cache.put(
+                        key,
+                        result.output_path,
+                        filename=f"{path.stem}{output.suffix}",
+                        media_type=output.media_type,
+                        skipped_pages=result.skipped_pages,
+                        stats=result.stats,
+                    )
+            except Exception as e:
+                # The workspace stays for the next run to resume
+                core_logger.error(f"Converting {path} failed: {e}")
+                summary.failed[str(path)] = str(e)
+                report(path, "failed")
+                continue
+            remove_workspace(job_dir)
+            summary.converted += 1
+            report(path, "converted")
+
+    executor = create_executor(workers)
+    try:
+        for path in inputs:
+            try:
+                input_hash = file_hash(path)
+            except OSError as e:
+                summary.failed[str(path)] = str(e)
+                report(path, "failed")
+                continue
+            key = conversion_key(input_hash, tool, tempo, transpose, output, soundfont)
+            if key in submitted or cache.get(key):
+                summary.cached += 1
+                report(path, "cached")
+                continue
+            submitted.add(key)
+
+            job_dir = Path(app_settings.WORK_DIR) / key
+            lock = ExitStack()
+            lock.enter_context(workspace_lock(job_dir))
+            input_path = job_dir / "input" / f"score{path.suffix.lower()}"
+            input_path.parent.mkdir(exist_ok=True)
+            shutil.copyfile(path, input_path)
+            future = executor.submit(
+                run_job,
+                tool,
+                input_path,
+                job_dir / "output",
+                tempo,
+                transpose,
+                output,
+                uuid.uuid4().hex,
+                time.time(),
+                soundfont,
+            )
+            running[future] = (path, key, job_dir, lock)
+            # A few jobs more than workers, so none waits for its next input
+            if len(running) >= 2 * workers:
+                collect(wait(running, return_when=FIRST_COMPLETED).done)
+        while running:
+            collect(wait(running, return_when=FIRST_COMPLETED).done)
+    except BaseException:
+        # Interrupted: the workspaces stay for the next run to resume
+        executor.shutdown(wait=False, cancel_futures=True)
+        for *_, lock in running.values():
+            lock.close()
+        raise
+    executor.shutdown()
+    # Results are uploaded to the shared cache store in the background
+    TieredCache.flush()
+    return summary
@@ -0,0 +1,216 @@
+import os
+import signal
+import subprocess
+import time
+from pathlib import Path
+
+from config.config import tool_settings
+from src.core.utils import core_logger
+
+# External tools (OMR backends, MuseScore, FluidSynth, FFmpeg) run through this
+# module instead of plain `subprocess.run`, so that none of them can keep a
+# worker busy forever:
+# - every call has a timeout per stage (`TOOL_TIMEOUTS`);
+# - every tool runs in a process group of its own, so killing it also kills
+#   what it spawned (the JVM of Audiveris, OEMER's Python, ...);
+# - CPU time and memory of every tool are capped (`TOOL_CPU_SECONDS`,
+#   `TOOL_MEMORY_MB`);
+# - a running job is cancelled by creating its cancel file (see `cancel_file`),
+#   which the waiting loop checks, e.g. when the client disconnects.
+# A job can also be asked to yield its worker to a shorter one by creating its
+# preempt file (see `preempt_file`); unlike cancellation this is only checked
+# between pages, so no work is lost.
+
+# Seconds between checks for cancellation and timeout while a tool runs.
+POLL_INTERVAL = 0.2
+
+# Cancel and preempt files watched by this process (see `watch_cancellation`).
+_cancel_file: Path | None = None
+_preempt_file: Path | None = None
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job that was cancelled, e.g. because its client went away.
+    """
+
+
+class JobPreempted(Exception):
+    """
+    Raised between two pages of a job asked to give its worker to another
+    job. The job is run again later and resumes from its checkpoint.
+    """
+
+
+def cancel_file(job_dir: Path, job_id: str) -> Path:
+    """
+    The file whose existence cancels job `job_id` running in `job_dir`. Files
+    work across processes and, with a job queue, across machines sharing
+    `WORK_DIR`.
+    """
+
+    return job_dir / f".cancel.{job_id}"
+
+
+def preempt_file(job_dir: Path, job_id: str) -> Path:
+    """
+    The file whose existence makes job `job_id` running in `job_dir` stop at
+    its next page (see `check_preempted`).
+    """
+
+    return job_dir / f".preempt.{job_id}"
+
+
+def watch_cancellation(path: Path | None, preempt_path: Path | None = None) -> None:
+    """
+    Make the tools run by this process (and `check_cancelled`) stop once
+    `path` exists, and `check_preempted` raise once `preempt_path` exists;
+    None stops watching.
+    """
+
+    global _cancel_file, _preempt_file
+    _cancel_file = path
+    _preempt_file = preempt_path
+
+
+def watched_cancel_file() -> Path | None:
+    """
+    The cancel file of this process, for handing to worker processes.
+    """
+
+    return _cancel_file
+
+
+def cancelled() -> bool:
+    return _cancel_file is not None and _cancel_file.exists()
+
+
+def check_cancelled() -> None:
+    """
+    Raises:
+        JobCancelled: If the job of this process was cancelled.
+    """
+
+    if cancelled():
+        raise JobCancelled("Job cancelled")
+
+
+def check_preempted() -> None:
+    """
+    Called between pages.
+
+    Raises:
+        JobPreempted: If the job of this process is to give up its worker.
+    """
+
+    if _preempt_file is not None and _preempt_file.exists():
+        raise JobPreempted("Job preempted")
+
+
+def _limit_resources(pid: int) -> None:
+    import resource
+
+    if not hasattr(resource, "prlimit"):
+        return
+    # Set on the started process rather than in preexec_fn, which is unsafe in
+    # the threaded page pipelines
+    try:
+        if tool_settings.TOOL_CPU_SECONDS:
+            seconds = tool_settings.TOOL_CPU_SECONDS
+            resource.prlimit(pid, resource.RLIMIT_CPU, (seconds, seconds + 5))
+        if tool_settings.TOOL_MEMORY_MB:
+            size = tool_settings.TOOL_MEMORY_MB * 2**20
+            resource.prlimit(pid, resource.RLIMIT_AS, (size, size))
+    except (OSError, ValueError) as e:
+        core_logger.warning(f"Cannot limit resources of process {pid}: {e}")
+
+
+def start_tool(command: list[str], **kwargs) -> subprocess.Popen:
+    """
+    Start an external tool in a process group of its own, with the resource
+    limits applied. Takes the keyword arguments of `subprocess.Popen`.
+    """
+
+    process = subprocess.Popen(command, start_new_session=True, **kwargs)
+    _limit_resources(process.pid)
+    return process
+
+
+def kill_tool(process: subprocess.Popen) -> None:
+    """
+    Kill a tool started with `start_tool` and everything it spawned.
+    """
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def tool_timeout(stage: str) -> float | None:
+    return tool_settings.TOOL_TIMEOUTS.get(stage)
+
+
+def wait_tool(
+    process: subprocess.Popen,
+    stage: str,
+    input: str | bytes | None = None,
+) -> tuple:
+    """
+    Wait for a tool started with `start_tool`, killing it on timeout or
+    cancellation.
+
+    Returns:
+        tuple: stdout and stderr, as `Popen.communicate` returns them.
+
+    Raises:
+        subprocess.TimeoutExpired: If it ran longer than the stage allows.
+        JobCancelled: If the job was cancelled meanwhile.
+    """
+
+    timeout = tool_timeout(stage)
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        while True:
+            try:
+                return process.communicate(input, timeout=POLL_INTERVAL)
+            except subprocess.TimeoutExpired:
+                # Input is sent by the first call only
+                input = None
+            check_cancelled()
+            if deadline and time.monotonic() > deadline:
+                core_logger.warning(
+                    f"{stage}: killing {process.args[0]} after {timeout} sec"
+                )
+                raise subprocess.TimeoutExpired(process.args, timeout)
+    except BaseException:
+        kill_tool(process)
+        raise
+
+
+def run_tool(
+    command: list[str],
+    stage: str,
+    check: bool = True,
+    **kwargs,
+) -> subprocess.CompletedProcess:
+    """
+    Run an external tool to completion, like `subprocess.run` (same keyword
+    arguments), under the timeout of `stage` and the resource limits.
+
+    Raises:
+        subprocess.CalledProcessError: If `check` and the tool failed.
+        subprocess.TimeoutExpired: If it ran longer than the stage allows.
+        JobCancelled: If the job was cancelled meanwhile.
+    """
+
+    check_cancelled()
+    input = kwargs.pop("input", None)
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    process = start_tool(command, **kwargs)
+    stdout, stderr = wait_tool(process, stage, input)
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
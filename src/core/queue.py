@@ -0,0 +1,517 @@
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import cache
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from config.config import app_settings
+from src.core.scheduler import user_weight
+from src.core.utils import core_logger
+
+# Seconds a finished job's result is kept for the API node to collect.
+RESULT_TTL = 24 * 60 * 60
+
+
+class JobQueue(ABC):
+    """
+    Conversion jobs shared by the API nodes and the standalone workers.
+
+    API nodes `put` jobs and poll `pop_result`; workers `take` jobs and
+    `finish` them. Payloads and results are JSON-serializable dicts.
+
+    A taken job is leased to its worker for `lease` seconds, renewed by
+    `heartbeat`. If the worker dies the lease runs out and the job is handed to
+    another worker, which resumes it from its checkpoint (see
+    `services.checkpoint`).
+    """
+
+    def __init__(self, lease: float = 60):
+        self.lease = lease
+
+    @abstractmethod
+    def put(self, job_id: str, payload: dict) -> None:
+        """
+        Queue a job.
+        """
+
+    @abstractmethod
+    def take(self, timeout: float) -> tuple[str, dict] | None:
+        """
+        Claim the next queued job, waiting up to `timeout` seconds for one.
+
+        Returns:
+            tuple[str, dict] | None: Job id and payload, or None on timeout.
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str) -> None:
+        """
+        Renew the lease of a running job.
+        """
+
+    @abstractmethod
+    def finish(self, job_id: str, result: dict) -> None:
+        """
+        Store the result of a job for the API node waiting on it.
+        """
+
+    @abstractmethod
+    def release(self, job_id: str) -> None:
+        """
+        Give up a running job without finishing it, e.g. on shutdown: it is
+        queued again right away, to be resumed by the next worker instead of
+        after its lease runs out.
+        """
+
+    @abstractmethod
+    def pop_result(self, job_id: str) -> dict | None:
+        """
+        Return and remove the result of a job, or None while it is not finished.
+        """
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    job_id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL,
+    result TEXT, queued_at REAL NOT NULL, started_at REAL, finished_at REAL,
+    heartbeat_at REAL, user TEXT NOT NULL DEFAULT '', cost REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS queue_by_state ON queue (state, queued_at);
+CREATE TABLE IF NOT EXISTS fair_share (user TEXT PRIMARY KEY, usage REAL NOT NULL);
+"""
+
+
+class SQLiteQueue(JobQueue):
+    """
+    Job queue in a SQLite file, for API and worker processes on one node.
+
+    Workers claim jobs inside an immediate transaction, so a job goes to
+    exactly one of them. Jobs still running without a heartbeat for `lease`
+    seconds are claimed again. Waiting for jobs and results is done by polling.
+
+    Queued jobs are claimed fairly between the users in their payloads, shortest
+    first within a user, like in an API node's OMR pool (see
+    `FairShareScheduler`): every claim charges the job's user its estimated
+    `cost` divided by the user's weight in the `fair_share` table, and the
+    next claim goes to the least charged user. A user who had no jobs queued
+    or running is first brought up to the least charged of the active users.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path: Path, lease: float = 60):
+        super().__init__(lease)
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Per thread and process, like the metrics store
+        if getattr(self._local, "pid", None) != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(queue)")}
+            # Queue files created before leases and fair sharing existed
+            for column, definition in (
+                ("heartbeat_at", "REAL"),
+                ("user", "TEXT NOT NULL DEFAULT ''"),
+                ("cost", "REAL NOT NULL DEFAULT 0"),
+            ):
+                if column not in columns:
+                    connection.execute(
+                        f"ALTER TABLE queue ADD COLUMN {column} {definition}"
+                    )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def put(self, job_id: str, payload: dict) -> None:
+        user, cost = payload.get("user", ""), payload.get("cost", 0.0)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            active = connection.execute(
+                "SELECT 1 FROM queue WHERE user = ? AND state IN ('queued', 'running') "
+                "LIMIT 1",
+                (user,),
+            ).fetchone()
+            if not active:
+                # Idle time is not saved up to crowd out the active users later
+                connection.execute(
+                    "INSERT INTO fair_share (user, usage) SELECT ?, COALESCE(("
+                    "SELECT MIN(usage) FROM fair_share WHERE user IN ("
+                    "SELECT user FROM queue WHERE state IN ('queued', 'running'))"
+                    "), 0) ON CONFLICT (user) DO UPDATE SET "
+                    "usage = MAX(usage, excluded.usage)",
+                    (user,),
+                )
+            connection.execute(
+                "INSERT INTO queue (job_id, payload, state, queued_at, user, cost) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(payload), time.time(), user, cost),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _claim(self) -> tuple[str, dict] | None:
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died go first, they were started already
+            row = connection.execute(
+                "SELECT job_id, payload, state FROM queue "
+                "WHERE state = 'running' AND heartbeat_at < ? "
+                "ORDER BY queued_at LIMIT 1",
+                (now - self.lease,),
+            ).fetchone()
+            if row is None:
+                row = connection.execute(
+                    "SELECT job_id, payload, state, queue.user, cost FROM queue "
+                    "LEFT JOIN fair_share ON fair_share.user = queue.user "
+                    "WHERE state = 'queued' "
+                    "ORDER BY COALESCE(usage, 0), cost, queued_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    user, cost = row[3], row[4]
+                    connection.execute(
+                        "INSERT INTO fair_share (user, usage) VALUES (?, ?) "
+                        "ON CONFLICT (user) DO UPDATE SET "
+                        "usage = usage + excluded.usage",
+                        (user, cost / user_weight(user)),
+                    )
+            if row:
+                connection.execute(
+                    "UPDATE queue SET state = 'running', started_at = ?, "
+                    "heartbeat_at = ? WHERE job_id = ?",
+                    (now, now, row[0]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if row and row[2] == "running":
+            core_logger.warning(f"Lease of job {row[0]} expired, running it again")
+        return (row[0], json.loads(row[1])) if row else None
+
+    def take(self, timeout: float) -> tuple[str, dict] | None:
+        deadline = time.monotonic() + timeout
+        while (job := self._claim()) is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+        return job
+
+    def heartbeat(self, job_id: str) -> None:
+        self._connection().execute(
+            "UPDATE queue SET heartbeat_at = ? WHERE job_id = ? AND state = 'running'",
+            (time.time(), job_id),
+        )
+
+    def finish(self, job_id: str, result: dict) -> None:
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "UPDATE queue SET state = 'done', result = ?, finished_at = ? "
+            "WHERE job_id = ?",
+            (json.dumps(result), now, job_id),
+        )
+        # Results nobody collected, e.g. because the API node went away
+        connection.execute(
+            "DELETE FROM queue WHERE state = 'done' AND finished_at < ?",
+            (now - RESULT_TTL,),
+        )
+
+    def release(self, job_id: str) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT user, cost FROM queue WHERE job_id = ? AND state = 'running'",
+                (job_id,),
+            ).fetchone()
+            if row:
+                # Charged again when it is taken next
+                connection.execute(
+                    "UPDATE fair_share SET usage = MAX(usage - ?, 0) WHERE user = ?",
+                    (row[1] / user_weight(row[0]), row[0]),
+                )
+                connection.execute(
+                    "UPDATE queue SET state = 'queued', started_at = NULL, "
+                    "heartbeat_at = NULL WHERE job_id = ?",
+                    (job_id,),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def pop_result(self, job_id: str) -> dict | None:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT result FROM queue WHERE job_id = ? AND state = 'done'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute("DELETE FROM queue WHERE job_id = ?", (job_id,))
+        return json.loads(row[0])
+
+
+class RespError(Exception):
+    """
+    Error reply from a Redis-protocol server.
+    """
+
+
+class RespClient:
+    """
+    Minimal client for the Redis serialization protocol (RESP2): just enough for
+    `RedisQueue`, so any server speaking the protocol will do and no client
+    library is needed. Not thread-safe; use one per thread.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: str | None = None,
+        timeout: float = 10,
+    ):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._socket: socket.socket | None = None
+        self._reader = None
+
+    def _connect(self) -> None:
+        self._socket = socket.create_connection(self.address, self.timeout)
+        self._reader = self._socket.makefile("rb")
+        if self.password:
+            self._call(["AUTH", self.password])
+        if self.db:
+            self._call(["SELECT", str(self.db)])
+
+    def close(self) -> None:
+        if self._socket:
+            self._reader.close()
+            self._socket.close()
+        self._socket = self._reader = None
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        kind, value = line[:1], line[1:-2]
+        match kind:
+            case b"+":
+                return value.decode()
+            case b"-":
+                raise RespError(value.decode())
+            case b":":
+                return int(value)
+            case b"$":
+                size = int(value)
+                return None if size < 0 else self._reader.read(size + 2)[:-2]
+            case b"*":
+                size = int(value)
+                return None if size < 0 else [self._read() for _ in range(size)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    def _call(self, args: list[str], timeout: float | None = None):
+        request = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode()
+            request += [f"${len(data)}\r\n".encode(), data, b"\r\n"]
+        self._socket.settimeout(timeout or self.timeout)
+        self._socket.sendall(b"".join(request))
+        return self._read()
+
+    def execute(self, *args: str, timeout: float | None = None):
+        """
+        Send one command and return its reply. Reconnects once if the
+        connection was lost.
+
+        Raises:
+            RespError: If the server answers with an error.
+        """
+
+        for attempt in range(2):
+            try:
+                if self._socket is None:
+                    self._connect()
+                return self._call(list(args), timeout)
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+
+class RedisQueue(JobQueue):
+    """
+    Job queue on a Redis-protocol server, for API nodes and workers on several
+    machines. Jobs are a list (LPUSH/BRPOPLPUSH); results are keys that expire
+    after `RESULT_TTL`. Jobs are taken in the order they were queued: a list
+    cannot be reordered atomically without server-side scripting, so there is
+    no fair sharing between users here, unlike with `SQLiteQueue`.
+
+    Taking a job moves it to a processing list and sets a lease key expiring
+    after `lease` seconds. Workers scan the processing list every `lease`
+    seconds and push jobs whose lease was gone on two scans in a row back onto
+    the queue; the second look spares jobs taken just before their lease key
+    was set.
+    """
+
+    def __init__(self, client_factory, prefix: str = "scoreapi", lease: float = 60):
+        super().__init__(lease)
+        self._client_factory = client_factory
+        self._local = threading.local()
+        self.queue_key = f"{prefix}:queue"
+        self.processing_key = f"{prefix}:processing"
+        self.lease_prefix = f"{prefix}:lease:"
+        self.result_prefix = f"{prefix}:result:"
+        # Raw list entries of the jobs this process runs, to remove on finish
+        self._taken: dict[str, str] = {}
+        self._expired: set[str] = set()
+        self._next_scan = 0.0
+        self._scan_lock = threading.Lock()
+
+    @property
+    def _client(self) -> RespClient:
+        # BRPOP blocks its connection, so every thread gets its own
+        if getattr(self._local, "client", None) is None:
+            self._local.client = self._client_factory()
+        return self._local.client
+
+    def put(self, job_id: str, payload: dict) -> None:
+        self._client.execute(
+            "LPUSH", self.queue_key, json.dumps({"id": job_id, "payload": payload})
+        )
+
+    def _renew(self, job_id: str) -> None:
+        self._client.execute(
+            "SET", self.lease_prefix + job_id, "1", "EX", str(math.ceil(self.lease))
+        )
+
+    def _requeue_expired(self) -> None:
+        with self._scan_lock:
+            if time.monotonic() < self._next_scan:
+                return
+            self._next_scan = time.monotonic() + self.lease
+        expired = set()
+        for raw in self._client.execute("LRANGE", self.processing_key, "0", "-1"):
+            raw = raw.decode()
+            if self._client.execute(
+                "EXISTS", self.lease_prefix + json.loads(raw)["id"]
+            ):
+                continue
+            if raw not in self._expired:
+                expired.add(raw)
+            elif self._client.execute("LREM", self.processing_key, "1", raw):
+                # Only the worker that removed it puts it back
+                core_logger.warning("Lease of a queued job expired, running it again")
+                self._client.execute("RPUSH", self.queue_key, raw)
+        self._expired = expired
+
+    def take(self, timeout: float) -> tuple[str, dict] | None:
+        self._requeue_expired()
+        seconds = max(1, math.ceil(timeout))
+        raw = self._client.execute(
+            "BRPOPLPUSH",
+            self.queue_key,
+            self.processing_key,
+            str(seconds),
+            timeout=seconds + 5,
+        )
+        if raw is None:
+            return None
+        raw = raw.decode()
+        job = json.loads(raw)
+        self._renew(job["id"])
+        self._taken[job["id"]] = raw
+        return job["id"], job["payload"]
+
+    def heartbeat(self, job_id: str) -> None:
+        self._renew(job_id)
+
+    def finish(self, job_id: str, result: dict) -> None:
+        self._client.execute(
+            "SET",
+            self.result_prefix + job_id,
+            json.dumps(result),
+            "EX",
+            str(RESULT_TTL),
+        )
+        if raw := self._taken.pop(job_id, None):
+            self._client.execute("LREM", self.processing_key, "1", raw)
+        self._client.execute("DEL", self.lease_prefix + job_id)
+
+    def release(self, job_id: str) -> None:
+        raw = self._taken.pop(job_id, None)
+        # Only if still ours, not already requeued as expired
+        if raw and self._client.execute("LREM", self.processing_key, "1", raw):
+            # Jobs are taken from the right: it goes next
+            self._client.execute("RPUSH", self.queue_key, raw)
+        self._client.execute("DEL", self.lease_prefix + job_id)
+
+    def pop_result(self, job_id: str) -> dict | None:
+        key = self.result_prefix + job_id
+        value = self._client.execute("GET", key)
+        if value is None:
+            return None
+        self._client.execute("DEL", key)
+        return json.loads(value)
+
+
+def open_queue(url: str) -> JobQueue:
+    """
+    Open the job queue at `url`: `sqlite:///path/to/queue.sqlite3` (or
+    `sqlite://relative.sqlite3`) or `redis://[:password@]host[:port][/db]`.
+
+    Raises:
+        ValueError: If the URL scheme is not supported.
+    """
+
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "sqlite":
+            return SQLiteQueue(
+                Path(parsed.netloc + parsed.path), lease=app_settings.JOB_LEASE
+            )
+        case "redis":
+            password = unquote(parsed.password) if parsed.password else None
+            db = int(parsed.path.strip("/") or 0)
+            return RedisQueue(
+                lambda: RespClient(
+                    parsed.hostname or "localhost",
+                    parsed.port or 6379,
+                    db=db,
+                    password=password,
+                ),
+                lease=app_settings.JOB_LEASE,
+            )
+    raise ValueError(f"Unsupported job queue: {url}")
+
+
+@cache
+def job_queue() -> JobQueue | None:
+    """
+    The queue configured in `JOB_QUEUE`, or None to run jobs in-process.
+    """
+
+    if not app_settings.JOB_QUEUE:
+        return None
+    queue = open_queue(app_settings.JOB_QUEUE)
+    core_logger.info(f"Using job queue {type(queue).__name__}")
+    return queue
@@ -0,0 +1,143 @@
+import heapq
+import itertools
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from config.config import app_settings
+
+_sequence = itertools.count()
+
+
+def user_weight(user: str) -> float:
+    """
+    Share of the workers `user` is entitled to, relative to the others
+    (`USER_WEIGHTS`, 1 by default).
+    """
+
+    return max(app_settings.USER_WEIGHTS.get(user, 1.0), 0.001)
+
+
+@dataclass
+class Ticket:
+    """
+    A job waiting for, or holding, an OMR worker.
+
+    Attributes:
+        user (str): Who submitted the job; workers are shared fairly between users.
+        cost (float): Estimated seconds of work left (see `services.estimate`).
+        preempt_file (Path | None): File that makes the job give up its worker
+            at its next page (see `processes.preempt_file`); None if it cannot.
+        preempted (bool): Whether the job was asked to give up its worker.
+        seq (int): Order of submission, breaking ties.
+    """
+
+    user: str = ""
+    cost: float = 0.0
+    preempt_file: Path | None = None
+    preempted: bool = False
+    seq: int = field(default_factory=lambda: next(_sequence))
+
+
+class FairShareScheduler:
+    """
+    Order in which waiting jobs get a worker.
+
+    Users are served by weighted fair queueing: every started job charges its
+    user its estimated cost divided by the user's weight (`USER_WEIGHTS`), and
+    the next job comes from the user charged least. A user who had nothing
+    waiting starts from the charge of the last job started, so idle time is not
+    saved up to crowd out the others later. Within a user, the job with the
+    lowest estimated cost goes first (shortest job first), submission order
+    breaking ties.
+    """
+
+    def __init__(self) -> None:
+        self._waiting: dict[str, list[tuple[float, int, Ticket, Any]]] = {}
+        self._usage: dict[str, float] = {}
+        self._virtual_time = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(jobs) for jobs in self._waiting.values())
+
+    def waiting_cost(self) -> float:
+        """
+        Estimated seconds of work of all waiting jobs.
+        """
+
+        return sum(entry[0] for jobs in self._waiting.values() for entry in jobs)
+
+    def push(self, ticket: Ticket, item: Any) -> None:
+        """
+        Queue `item` (anything the caller needs to start the job) under `ticket`.
+        """
+
+        if ticket.user not in self._waiting:
+            self._usage[ticket.user] = max(
+                self._usage.get(ticket.user, 0.0), self._virtual_time
+            )
+        heapq.heappush(
+            self._waiting.setdefault(ticket.user, []),
+            (ticket.cost, ticket.seq, ticket, item),
+        )
+
+    def _next_user(self) -> str | None:
+        if not self._waiting:
+            return None
+        return min(
+            self._waiting,
+            key=lambda user: (self._usage[user], self._waiting[user][0][1]),
+        )
+
+    def peek(self) -> Ticket | None:
+        """
+        The ticket `pop` would return next, or None if nothing waits.
+        """
+
+        user = self._next_user()
+        return self._waiting[user][0][2] if user is not None else None
+
+    def pop(self) -> tuple[Ticket, Any] | None:
+        """
+        Take the next job to start and charge its user for it.
+
+        Returns:
+            tuple[Ticket, Any] | None: Its ticket and item, or None if nothing waits.
+        """
+
+        user = self._next_user()
+        if user is None:
+            return None
+        _, _, ticket, item = heapq.heappop(self._waiting[user])
+        if not self._waiting[user]:
+            del self._waiting[user]
+        self._virtual_time = self._usage[user]
+        self._usage[user] += ticket.cost / user_weight(user)
+        return ticket, item
+
+    def refund(self, ticket: Ticket, seconds: float) -> None:
+        """
+        Give back the charge for `seconds` of a started job's estimated cost it
+        did not use, e.g. because it was preempted and is queued again.
+        """
+
+        if ticket.user in self._usage:
+            self._usage[ticket.user] -= seconds / user_weight(ticket.user)
+
+    def remove(self, ticket: Ticket) -> bool:
+        """
+        Withdraw a waiting job, e.g. because its client went away.
+
+        Returns:
+            bool: Whether it was still waiting.
+        """
+
+        jobs = self._waiting.get(ticket.user, [])
+        for position, entry in enumerate(jobs):
+            if entry[2] is ticket:
+                jobs.pop(position)
+                heapq.heapify(jobs)
+                if not jobs:
+                    del self._waiting[ticket.user]
+                return True
+        return False
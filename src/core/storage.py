@@ -0,0 +1,396 @@
+import hashlib
+import hmac
+import os
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from functools import cache
+from pathlib import Path
+from urllib.parse import quote, urlparse
+
+from config.config import app_settings
+from src.core.utils import core_logger
+
+# Read size for streaming objects to and from the store.
+CHUNK_SIZE = 1 << 20
+
+
+class ObjectStore(ABC):
+    """
+    Store of cache objects shared by all nodes, behind each node's local cache
+    in `CACHE_DIR` (see `ResultCache` and `PageCache`).
+
+    Objects are files addressed by a relative name such as
+    "results/<key>.json". Writing an object replaces it as a whole, so readers
+    never see a partial one.
+    """
+
+    @abstractmethod
+    def fetch(self, name: str, target: Path) -> bool:
+        """
+        Copy object `name` to the file `target`.
+
+        Returns:
+            bool: False if there is no such object.
+        """
+
+    @abstractmethod
+    def store(self, name: str, source: Path) -> None:
+        """
+        Write the file `source` as object `name`.
+        """
+
+
+class FilesystemStore(ObjectStore):
+    """
+    Objects as files below a directory, e.g. on a filesystem (NFS, CephFS,
+    ...) mounted on every node.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def fetch(self, name: str, target: Path) -> bool:
+        try:
+            shutil.copyfile(self.root / name, target)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, name: str, source: Path) -> None:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Renaming is atomic on the shared filesystem too
+        partial = path.with_name(f".{path.name}.{os.uname().nodename}.{os.getpid()}")
+        shutil.copyfile(source, partial)
+        partial.replace(path)
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def sign_request(
+    method: str,
+    url: str,
+    headers: dict[str, str],
+    payload_hash: str,
+    region: str,
+    access_key: str,
+    secret_key: str,
+    now: datetime | None = None,
+) -> dict[str, str]:
+    """
+    Sign a request without query string for S3 with AWS Signature Version 4.
+
+    Parameters:
+        method (str): HTTP method.
+        url (str): Full URL; its path must already be URI-encoded.
+        headers (dict[str, str]): Headers to sign besides Host and the x-amz ones.
+        payload_hash (str): Hex SHA-256 of the body, or "UNSIGNED-PAYLOAD".
+        region (str): Region of the bucket.
+        access_key (str): Access key id.
+        secret_key (str): Secret access key.
+        now (datetime | None): Time of the request; the current time if None.
+
+    Returns:
+        dict[str, str]: `headers` (with lowercase names) plus x-amz-date,
+            x-amz-content-sha256 and Authorization.
+    """
+
+    parsed = urlparse(url)
+    timestamp = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    signed = {
+        **{name.lower(): value.strip() for name, value in headers.items()},
+        "host": parsed.netloc,
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": timestamp,
+    }
+    names = sorted(signed)
+    canonical_request = "\n".join(
+        [
+            method,
+            parsed.path or "/",
+            "",
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            ";".join(names),
+            payload_hash,
+        ]
+    )
+    scope = f"{timestamp[:8]}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            timestamp,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = f"AWS4{secret_key}".encode()
+    for part in (timestamp[:8], region, "s3", "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    signed["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={';'.join(names)}, Signature={signature}"
+    )
+    # httpx sends Host itself
+    del signed["host"]
+    return signed
+
+
+class S3Store(ObjectStore):
+    """
+    Objects in a bucket of an S3-compatible object store (AWS S3, MinIO, ...),
+    spoken to over plain HTTP with httpx and Signature Version 4, so no AWS
+    SDK is needed.
+
+    Bodies are streamed and sent as UNSIGNED-PAYLOAD, so large results are
+    neither hashed nor held in memory first. With `endpoint` set (MinIO and
+    most other S3-compatible stores) buckets are addressed by path, otherwise
+    as AWS virtual-hosted buckets.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint: str | None = None,
+        region: str = "us-east-1",
+        access_key: str | None = None,
+        secret_key: str | None = None,
+        timeout: float = 30,
+    ):
+        import httpx
+
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix.strip("/")
+        if endpoint:
+            self.base_url = f"{endpoint.rstrip('/')}/{bucket}"
+        else:
+            self.base_url = f"https://{bucket}.s3.{region}.amazonaws.com"
+        self._client = httpx.Client(timeout=timeout)
+
+    def _url(self, name: str) -> str:
+        key = f"{self.prefix}/{name}" if self.prefix else name
+        return f"{self.base_url}/{quote(key, safe='/-_.~')}"
+
+    def _headers(
+        self, method: str, url: str, headers: dict[str, str] | None = None
+    ) -> dict[str, str]:
+        headers = headers or {}
+        if not self.access_key or not self.secret_key:
+            # Anonymous access, e.g. to a public bucket
+            return headers
+        return sign_request(
+            method,
+            url,
+            headers,
+            "UNSIGNED-PAYLOAD",
+            self.region,
+            self.access_key,
+            self.secret_key,
+        )
+
+    def fetch(self, name: str, target: Path) -> bool:
+        url = self._url(name)
+        with self._client.stream("GET", url, headers=self._headers("GET", url)) as r:
+            if r.status_code == 404:
+                return False
+            r.raise_for_status()
+            with open(target, "wb") as f:
+                for chunk in r.iter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+        return True
+
+    def store(self, name: str, source: Path) -> None:
+        url = self._url(name)
+        headers = {"Content-Length": str(source.stat().st_size)}
+        with open(source, "rb") as f:
+            self._client.put(
+                url,
+                content=iter(lambda: f.read(CHUNK_SIZE), b""),
+                headers=self._headers("PUT", url, headers),
+            ).raise_for_status()
+
+
+def open_store(url: str) -> ObjectStore:
+    """
+    Open the object store at `url`: `file:///shared/directory` or
+    `s3://bucket[/prefix]` (endpoint, region and credentials from the `S3_*`
+    settings).
+
+    Raises:
+        ValueError: If the URL scheme is not supported.
+    """
+
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "file":
+            return FilesystemStore(Path(parsed.netloc + parsed.path))
+        case "s3":
+            return S3Store(
+                parsed.netloc,
+                parsed.path,
+                endpoint=app_settings.S3_ENDPOINT,
+                region=app_settings.S3_REGION,
+                access_key=app_settings.S3_ACCESS_KEY,
+                secret_key=app_settings.S3_SECRET_KEY,
+            )
+    raise ValueError(f"Unsupported cache store: {url}")
+
+
+@cache
+def shared_store() -> ObjectStore | None:
+    """
+    The store configured in `CACHE_STORE`, or None to cache on this node only.
+    """
+
+    if not app_settings.CACHE_STORE:
+        return None
+    store = open_store(app_settings.CACHE_STORE)
+    core_logger.info(f"Using cache store {type(store).__name__}")
+    return store
+
+
+class TieredCache:
+    """
+    A local cache directory in front of the shared store, if any.
+
+    Reads go through: an object missing locally is fetched from the store and
+    kept locally (`fetch`). Writes go behind: objects are written locally and
+    uploaded to the store from a background thread (`store_later`), so a
+    request does not wait for the upload. Once a shared store holds
+    everything, the local directory is only a hot tier: `trim` keeps it under
+    `CACHE_LOCAL_MB` by removing the least recently used objects.
+    """
+
+    # Seconds between two trims of the local tier.
+    TRIM_INTERVAL = 60
+
+    _uploads = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-upload")
+    _pending: dict[Path, Future] = {}
+    _guard = threading.Lock()
+    _next_trim: dict[Path, float] = {}
+
+    def __init__(self, root: Path, prefix: str, store: ObjectStore | None = None):
+        self.root = root
+        self.prefix = prefix
+        self.store = store
+
+    def _name(self, path: Path) -> str:
+        return f"{self.prefix}/{path.relative_to(self.root)}"
+
+    def fetch(self, path: Path) -> bool:
+        """
+        Make sure the object at local `path` is there, fetching it from the
+        store if needed.
+
+        Returns:
+            bool: Whether it is there now.
+        """
+
+        if path.exists():
+            return True
+        if self.store is None:
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}.{os.getpid()}.fetch")
+        try:
+            if not self.store.fetch(self._name(path), partial):
+                return False
+            partial.replace(path)
+        except Exception as e:
+            core_logger.warning(f"Cache store read of {self._name(path)} failed: {e}")
+            return False
+        finally:
+            partial.unlink(missing_ok=True)
+        return True
+
+    def store_later(self, *paths: Path) -> None:
+        """
+        Upload local objects to the store in the background, in order.
+        """
+
+        if self.store is None:
+            return
+
+        def upload() -> None:
+            for path in paths:
+                try:
+                    self.store.store(self._name(path), path)
+                except Exception as e:
+                    core_logger.warning(
+                        f"Cache store write of {self._name(path)} failed: {e}"
+                    )
+                    return
+            self.trim()
+
+        future = self._uploads.submit(upload)
+        with self._guard:
+            for path in paths:
+                self._pending[path] = future
+        future.add_done_callback(lambda _: self._forget(paths, future))
+
+    def _forget(self, paths: tuple[Path, ...], future: Future) -> None:
+        with self._guard:
+            for path in paths:
+                if self._pending.get(path) is future:
+                    del self._pending[path]
+
+    @classmethod
+    def flush(cls) -> None:
+        """
+        Wait for the uploads started by this process, e.g. before it exits.
+        """
+
+        with cls._guard:
+            pending = list(cls._pending.values())
+        wait(pending)
+
+    def trim(self) -> None:
+        """
+        Remove the least recently used local objects beyond `CACHE_LOCAL_MB`
+        (at most every `TRIM_INTERVAL` seconds), except those not uploaded yet.
+        Only done with a shared store, which still holds them.
+        """
+
+        now = time.monotonic()
+        with self._guard:
+            if self.store is None or self._next_trim.get(self.root, 0) > now:
+                return
+            self._next_trim[self.root] = now + self.TRIM_INTERVAL
+            pending = set(self._pending)
+
+        files = []
+        for path in self.root.rglob("*"):
+            try:
+                if path.is_file() and not path.name.startswith("."):
+                    files.append((path.stat().st_mtime, path.stat().st_size, path))
+            except FileNotFoundError:
+                continue
+        size = sum(size for _, size, _ in files)
+        limit = app_settings.CACHE_LOCAL_MB * 2**20
+        for _, file_size, path in sorted(files):
+            if size <= limit:
+                break
+            if path in pending:
+                continue
+            path.unlink(missing_ok=True)
+            size -= file_size
+
+    @staticmethod
+    def touch(path: Path) -> None:
+        """
+        Mark a local object as used, for `trim`.
+        """
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
@@ -1,5 +1,6 @@
 import logging
 
+from src.core.utils.etag import etag_matches, etag_response
 from src.core.utils.schema import BaseResponse, CamelCaseModel
 
 
@@ -41,4 +42,6 @@ __all__ = [
     "BaseResponse",
     "CamelCaseModel",
     "core_logger",
+    "etag_matches",
+    "etag_response",
 ]
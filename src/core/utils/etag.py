@@ -0,0 +1,47 @@
+import hashlib
+
+from fastapi import Request, Response, status
+from pydantic import BaseModel
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Whether the request's If-None-Match header matches `etag` (a quoted tag).
+    """
+
+    candidates = {
+        tag.strip().removeprefix("W/")
+        for tag in request.headers.get("if-none-match", "").split(",")
+    }
+    return etag in candidates or "*" in candidates
+
+
+def etag_response(
+    request: Request, response: Response, body: BaseModel, max_age: int = 0
+) -> BaseModel | Response:
+    """
+    Tag a JSON response body with an ETag and answer conditional requests.
+
+    Parameters:
+        request (Request): Incoming request, checked for If-None-Match.
+        response (Response): Response FastAPI will send the body with.
+        body (BaseModel): Response body.
+        max_age (int): Seconds clients may reuse the response without asking.
+
+    Returns:
+        BaseModel | Response: `body`, or an empty 304 response if the client
+        already has this exact body.
+    """
+
+    etag = (
+        '"'
+        + hashlib.sha1(body.model_dump_json(by_alias=True).encode()).hexdigest()
+        + '"'
+    )
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return body
@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+
+from src.core.utils import core_logger
+
+# Conversion backends together with the heavy libraries they use at runtime.
+# None of these are imported while the app starts; each OMR worker process
+# imports them when it is spawned (see `src.core.workers`).
+WARMUP_MODULES = [
+    "src.api.v1.music.services.audiveris",
+    "src.api.v1.music.services.homr",
+    "src.api.v1.music.services.oemer",
+    "src.api.v1.music.services.auto",
+    "music21",
+    "pdf2image",
+    "fitz",
+    "PIL.Image",
+    "cv2",
+    "numpy",
+]
+
+_ready = threading.Event()
+
+
+def preload(modules: list[str]) -> None:
+    """
+    Import the given modules, logging (not raising) the ones that are missing.
+    """
+
+    start = time.perf_counter()
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            core_logger.warning(f"Warm-up could not import {name}: {e}")
+    core_logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f} sec")
+
+
+def _warmup() -> None:
+    from src.core.workers import omr_pool
+
+    omr_pool.warm_up()
+    _ready.set()
+
+
+def start_warmup(prewarm: bool = True) -> None:
+    """
+    Spawn the OMR worker processes, which load the conversion backends, from a
+    background thread.
+
+    The server starts accepting connections right away; `/readiness` reports
+    not-ready until every worker has loaded the backends. With `prewarm` disabled
+    the app is ready immediately and backends are loaded on first use.
+    """
+
+    if not prewarm:
+        _ready.set()
+        return
+    threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+
+
+def is_ready() -> bool:
+    """
+    Whether the conversion backends are loaded.
+    """
+
+    return _ready.is_set()
@@ -0,0 +1,355 @@
+import asyncio
+import functools
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Any, Callable
+
+from config.config import app_settings
+from src import constants
+from src.core.exceptions import ServiceUnavailableError
+from src.core.processes import JobPreempted
+from src.core.queue import JobQueue
+from src.core.scheduler import FairShareScheduler, Ticket
+from src.core.utils import core_logger
+
+# Seconds between checks whether a running job should yield to a waiting one.
+PREEMPT_CHECK_INTERVAL = 5.0
+
+# Seconds a queued job cancelled at shutdown gets to stop its tools.
+CANCEL_GRACE = 10.0
+
+
+def _preload() -> None:
+    """
+    Worker initializer: import the conversion backends and map the SoundFonts
+    before the first job.
+    """
+    from src.api.v1.music.services.soundfonts import soundfonts
+    from src.core.warmup import WARMUP_MODULES, preload
+
+    preload(WARMUP_MODULES)
+    soundfonts.load()
+
+
+def _noop() -> None:
+    pass
+
+
+def create_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Pool of worker processes for running conversions (see `jobs.run_job`),
+    recycled after `OMR_MAX_TASKS_PER_CHILD` jobs.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        # max_tasks_per_child needs a non-fork start method
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_preload if app_settings.PREWARM else None,
+        max_tasks_per_child=app_settings.OMR_MAX_TASKS_PER_CHILD,
+    )
+
+
+class OMRPool:
+    """
+    Pool of OMR worker processes owned by one web worker.
+
+    Conversions run here instead of in the event loop, so a web worker keeps
+    serving requests while pages are being recognized. Worker processes are
+    replaced after `OMR_MAX_TASKS_PER_CHILD` jobs to give back memory leaked by
+    music21 and the OMR models.
+
+    The pool starts at most one job per worker process and keeps the others
+    waiting in its own fair-share queue rather than in the executor's FIFO.
+    """
+
+    def __init__(self) -> None:
+        self._executor: ProcessPoolExecutor | None = None
+        self._in_flight = 0
+        self._scheduler = FairShareScheduler()
+        # Started jobs by ticket sequence, with their start time
+        self._running: dict[int, tuple[Ticket, float]] = {}
+        self._preempt_timer: asyncio.TimerHandle | None = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.draining = False
+
+    def start(self) -> None:
+        self.draining = False
+        self._executor = create_executor(app_settings.omr_workers)
+        core_logger.info(f"Started {app_settings.omr_workers} OMR worker process(es)")
+
+    def warm_up(self) -> None:
+        """
+        Spawn every worker process now instead of on the first jobs.
+
+        Worker processes are created on demand, one per task submitted while no
+        worker is idle, so one no-op task per worker starts them all.
+        """
+        if self._executor is None:
+            return
+        wait([self._executor.submit(_noop) for _ in range(app_settings.omr_workers)])
+
+    async def run(
+        self, func: Callable[..., Any], *args: Any, ticket: Ticket | None = None
+    ) -> Any:
+        """
+        Run `func(*args)` in a worker process and wait for the result.
+
+        While every worker is busy, jobs wait in the order of the fair-share
+        scheduler (see `FairShareScheduler`), by the user and estimated cost in
+        `ticket`. A job with a preempt file may be asked to give up its worker
+        between two pages to a much shorter waiting job; `func` then raises
+        `JobPreempted` and is queued again here with the work it has left, to
+        resume from its checkpoint. The caller only sees the final result.
+
+        Raises:
+            ServiceUnavailableError: If the pool is draining for shutdown.
+        """
+        if self.draining or self._executor is None:
+            raise ServiceUnavailableError(constants.SHUTTING_DOWN)
+
+        ticket = ticket or Ticket()
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight += 1
+        self._idle.clear()
+        self._scheduler.push(ticket, (func, args, future))
+        self._dispatch()
+        try:
+            return await future
+        finally:
+            # Gave up while waiting: withdraw the job
+            self._scheduler.remove(ticket)
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    def _dispatch(self) -> None:
+        """
+        Start waiting jobs while there are idle workers.
+        """
+        loop = asyncio.get_running_loop()
+        while len(self._running) < app_settings.omr_workers and (
+            job := self._scheduler.pop()
+        ):
+            ticket, (func, args, future) = job
+            if future.done():
+                continue
+            ticket.preempted = False
+            try:
+                work = loop.run_in_executor(self._executor, func, *args)
+            except Exception as e:
+                # E.g. a broken pool; fails this job, not the dispatching caller
+                future.set_exception(e)
+                continue
+            self._running[ticket.seq] = (ticket, time.monotonic())
+            work.add_done_callback(
+                functools.partial(self._finished, ticket, func, args, future)
+            )
+        self._preempt_if_needed()
+
+    def _finished(
+        self,
+        ticket: Ticket,
+        func: Callable[..., Any],
+        args: tuple,
+        future: asyncio.Future,
+        work: asyncio.Future,
+    ) -> None:
+        _, started = self._running.pop(ticket.seq)
+        error = None if work.cancelled() else work.exception()
+        if isinstance(error, JobPreempted) and not future.done():
+            left = max(ticket.cost - (time.monotonic() - started), 0.0)
+            self._scheduler.refund(ticket, left)
+            ticket.cost = left
+            core_logger.info(f"Job of {ticket.user!r} preempted, ~{left:.0f} sec left")
+            self._scheduler.push(ticket, (func, args, future))
+        elif not future.done():
+            if work.cancelled():
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(work.result())
+        if self._executor is not None:
+            self._dispatch()
+
+    def _preempt_if_needed(self) -> None:
+        """
+        Ask the running job with the most work left to yield its worker if the
+        next waiting job is much shorter (see `PREEMPT_FACTOR`). Checked again
+        every `PREEMPT_CHECK_INTERVAL` seconds while jobs wait.
+        """
+        if self._preempt_timer is not None:
+            self._preempt_timer.cancel()
+            self._preempt_timer = None
+        waiting = self._scheduler.peek()
+        if waiting is None:
+            return
+        self._preempt_timer = asyncio.get_running_loop().call_later(
+            PREEMPT_CHECK_INTERVAL, self._preempt_if_needed
+        )
+        if any(ticket.preempted for ticket, _ in self._running.values()):
+            return
+
+        now = time.monotonic()
+        candidates = [
+            (ticket.cost - (now - started), ticket)
+            for ticket, started in self._running.values()
+            if ticket.preempt_file and now - started >= app_settings.PREEMPT_MIN_RUN
+        ]
+        if not candidates:
+            return
+        left, ticket = max(candidates, key=lambda candidate: candidate[0])
+        if left > app_settings.PREEMPT_FACTOR * max(waiting.cost, 1.0):
+            core_logger.info(
+                f"Preempting job of {ticket.user!r} (~{left:.0f} sec left) for "
+                f"a job of {waiting.user!r} (~{waiting.cost:.0f} sec)"
+            )
+            ticket.preempted = True
+            ticket.preempt_file.parent.mkdir(parents=True, exist_ok=True)
+            ticket.preempt_file.touch()
+
+    def expected_wait(self) -> float:
+        """
+        Seconds a job submitted now would wait for a worker if the jobs ahead
+        took as long as estimated: the estimated work left of the running and
+        waiting jobs, spread over the workers. Fair sharing lets a user with
+        little work queued get ahead, so it is an upper bound for them.
+        """
+        if len(self._running) < app_settings.omr_workers:
+            return 0.0
+        now = time.monotonic()
+        left = self._scheduler.waiting_cost() + sum(
+            max(ticket.cost - (now - started), 0.0)
+            for ticket, started in self._running.values()
+        )
+        return round(left / app_settings.omr_workers, 2)
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Stop accepting jobs, let in-flight ones finish, then stop the workers.
+
+        Jobs still running after `timeout` seconds are abandoned.
+        """
+        self.draining = True
+        if self._in_flight:
+            core_logger.info(f"Waiting for {self._in_flight} conversion(s) to finish")
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                core_logger.warning(
+                    f"Abandoning {self._in_flight} conversion(s) after {timeout} sec"
+                )
+        if self._preempt_timer is not None:
+            self._preempt_timer.cancel()
+            self._preempt_timer = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+omr_pool = OMRPool()
+
+
+async def serve_queue(
+    queue: JobQueue,
+    handle: Callable[[dict], dict],
+    cancel: Callable[[dict], None] | None = None,
+    ticket: Callable[[dict], Ticket] | None = None,
+) -> None:
+    """
+    Run jobs from `queue` on this node's OMR pool until SIGINT or SIGTERM.
+
+    One consumer per OMR worker process takes a job, runs `handle(payload)` in
+    the pool and stores what it returns (or the error) as the job's result,
+    renewing the job's lease while it runs. The pool schedules it by
+    `ticket(payload)`. One more consumer keeps a job waiting in the pool while
+    every worker is busy, so that a much shorter job can preempt a long one
+    (see `OMRPool.run`).
+
+    On a signal the consumers stop taking jobs and the running ones are given
+    `SHUTDOWN_TIMEOUT` seconds to finish, as on an API node. Jobs still running
+    then are stopped with `cancel(payload)` and released back to the queue,
+    where the next worker resumes them from their checkpoint.
+    """
+
+    stop = asyncio.Event()
+    abandon = asyncio.Event()
+    running: dict[str, dict] = {}
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    async def keep_leased(job_id: str) -> None:
+        while True:
+            await asyncio.sleep(queue.lease / 3)
+            try:
+                await asyncio.to_thread(queue.heartbeat, job_id)
+            except Exception as e:
+                core_logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+    async def run(job_id: str, payload: dict) -> None:
+        heartbeat = asyncio.create_task(keep_leased(job_id))
+        running[job_id] = payload
+        try:
+            result = await omr_pool.run(
+                handle, payload, ticket=ticket(payload) if ticket else None
+            )
+        except asyncio.CancelledError:
+            await asyncio.to_thread(queue.release, job_id)
+            raise
+        except Exception as e:
+            if abandon.is_set():
+                # Stopped by the shutdown, not failed
+                await asyncio.to_thread(queue.release, job_id)
+                return
+            core_logger.error(f"Queued job {job_id} failed: {e}")
+            result = {"error": str(e)}
+        finally:
+            running.pop(job_id, None)
+            heartbeat.cancel()
+        await asyncio.to_thread(queue.finish, job_id, result)
+
+    async def consume() -> None:
+        while not stop.is_set():
+            job = await asyncio.to_thread(queue.take, 1.0)
+            if job is None:
+                continue
+            job_id, payload = job
+            if stop.is_set():
+                # Taken just as the shutdown began
+                await asyncio.to_thread(queue.release, job_id)
+                return
+            core_logger.info(f"Running queued job {job_id}")
+            await run(job_id, payload)
+
+    omr_pool.start()
+    if app_settings.PREWARM:
+        threading.Thread(target=omr_pool.warm_up, name="warmup", daemon=True).start()
+    core_logger.info("Waiting for queued jobs")
+    consumers = [
+        asyncio.create_task(consume()) for _ in range(app_settings.omr_workers + 1)
+    ]
+    await stop.wait()
+
+    timeout = app_settings.SHUTDOWN_TIMEOUT
+    if running:
+        core_logger.info(f"Waiting for {len(running)} job(s) to finish")
+    _, pending = await asyncio.wait(consumers, timeout=timeout)
+    if pending:
+        core_logger.warning(
+            f"Returning {len(running)} job(s) to the queue after {timeout} sec"
+        )
+        abandon.set()
+        if cancel is not None:
+            for payload in list(running.values()):
+                cancel(payload)
+            _, pending = await asyncio.wait(pending, timeout=CANCEL_GRACE)
+        # Not stopped in time: released without waiting for them
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    await omr_pool.drain(timeout=0)
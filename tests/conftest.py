@@ -0,0 +1,55 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Keep the caches and metrics of the tests out of the working directory; set
+# before `config.config` is imported by the modules under test.
+_scratch = Path(tempfile.mkdtemp(prefix="scoreapi-tests-"))
+os.environ.setdefault("CACHE_DIR", str(_scratch / "cache"))
+os.environ.setdefault("WORK_DIR", str(_scratch / "jobs"))
+os.environ.setdefault("METRICS_DB", str(_scratch / "metrics.sqlite3"))
+
+
+def draw_page(
+    path: Path,
+    staves: int = 4,
+    notes: list[tuple[int, int, bool]] = (),
+    angle: float = 0.0,
+) -> Path:
+    """
+    Draw a synthetic score page (A4 at 150 dpi) and save it to `path`.
+
+    Parameters:
+        staves (int): Number of five-line staves.
+        notes (list): Noteheads as (x, staff, filled).
+        angle (float): Rotation of the page in degrees, like a skewed photo.
+    """
+
+    from PIL import Image, ImageDraw
+
+    img = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(img)
+    for staff in range(staves):
+        top = 200 + staff * 350
+        for line in range(5):
+            y = top + line * 16
+            draw.rectangle((100, y, 1140, y + 1), fill=0)
+    for x, staff, filled in notes:
+        y = 200 + staff * 350 + 24
+        draw.ellipse(
+            (x, y, x + 20, y + 14), outline=0, width=3, fill=0 if filled else 255
+        )
+    if angle:
+        img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    img.save(path)
+    return path
+
+
+@pytest.fixture
+def page(tmp_path):
+    def make(name: str = "page.png", **kwargs) -> Path:
+        return draw_page(tmp_path / name, **kwargs)
+
+    return make
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import time
+import wave
+from pathlib import Path
+
+import pytest
+
+from config.config import tool_settings
+from src.api.v1.music.enums import OutputFormatEnum
+from src.api.v1.music.services.audio import encode_wavs, wav_format
+
+STUBS = Path(__file__).parent.parent / "benchmarks" / "stubs"
+
+
+def write_wav(path: Path, seconds: float, rate: int = 8000) -> Path:
+    import numpy as np
+
+    t = np.arange(int(rate * seconds)) / rate
+    samples = (np.sin(2 * np.pi * 440 * t) * 8000).astype("<i2")
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return path
+
+
+def use_ffmpeg(monkeypatch, directory: Path) -> None:
+    monkeypatch.setenv("PATH", f"{directory}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_wav_format(tmp_path):
+    assert wav_format(write_wav(tmp_path / "a.wav", 0.1)) == (1, 2, 8000)
+    not_wav = tmp_path / "b.wav"
+    not_wav.write_bytes(b"RIFF\x04\x00\x00\x00WAVE")
+    with pytest.raises(ValueError):
+        wav_format(not_wav)
+
+
+def test_encode_wavs_merges_in_order(tmp_path, monkeypatch):
+    use_ffmpeg(monkeypatch, STUBS)
+    wavs = [write_wav(tmp_path / f"{n}.wav", 0.5 + n) for n in range(2)]
+    frames = b""
+    for wav_path in wavs:
+        with wave.open(str(wav_path), "rb") as wav:
+            frames += wav.readframes(wav.getnframes())
+
+    audio_path = encode_wavs(wavs, tmp_path / "out.mp3", OutputFormatEnum.MP3)
+    # The stub writes out what it was piped
+    assert audio_path.read_bytes() == frames
+
+
+def test_encode_wavs_stalled_tool_times_out(tmp_path, monkeypatch):
+    # An encoder that never reads its input: the pipe fills up
+    stub = tmp_path / "bin" / "ffmpeg"
+    stub.parent.mkdir()
+    stub.write_text("#!/bin/sh\nsleep 30\n")
+    stub.chmod(0o755)
+    use_ffmpeg(monkeypatch, stub.parent)
+    monkeypatch.setitem(tool_settings.TOOL_TIMEOUTS, "encode", 1)
+    wavs = [write_wav(tmp_path / "long.wav", 60)]
+
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        encode_wavs(wavs, tmp_path / "out.mp3")
+    assert time.monotonic() - start < 10
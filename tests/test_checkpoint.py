@@ -0,0 +1,112 @@
+from pathlib import Path
+
+from src.api.v1.music.services.audiveris import enhance_image
+from src.api.v1.music.services.checkpoint import Checkpoint
+from src.api.v1.music.services.pipeline import JobResult
+
+
+def rasterize(directory: Path, count: int, calls: list[int]):
+    directory.mkdir(exist_ok=True)
+    for n in range(count):
+        calls.append(n)
+        img_path = directory / f"page_{n + 1:03}.png"
+        img_path.write_bytes(b"page")
+        yield img_path
+
+
+def test_stage_resumes(tmp_path):
+    page = tmp_path / "page_001.png"
+    page.write_bytes(b"page")
+    calls = []
+
+    def convert(img_path: Path) -> Path:
+        calls.append(img_path)
+        produced = img_path.with_suffix(".xml")
+        produced.write_text("xml")
+        return produced
+
+    assert Checkpoint(tmp_path).stage("omr", convert)(page) == tmp_path / "page_001.xml"
+
+    resumed = Checkpoint(tmp_path)
+    assert resumed.resuming
+    assert resumed.stage("omr", convert)(page) == tmp_path / "page_001.xml"
+    assert calls == [page]
+
+    # A produced file that is gone is produced again
+    (tmp_path / "page_001.xml").unlink()
+    Checkpoint(tmp_path).stage("omr", convert)(page)
+    assert calls == [page, page]
+
+
+def test_batch_stage_runs_unfinished_pages_only(tmp_path):
+    pages = [tmp_path / f"page_{n:03}.png" for n in range(1, 4)]
+    batches = []
+
+    def convert(images: list[Path]) -> list[Path | None]:
+        batches.append(images)
+        produced = []
+        for img_path in images:
+            if img_path.stem == "page_002":
+                produced.append(None)
+                continue
+            produced.append(img_path.with_suffix(".xml"))
+            produced[-1].write_text("xml")
+        return produced
+
+    checkpoint = Checkpoint(tmp_path)
+    assert checkpoint.batch_stage("omr", convert)(pages[:2]) == [
+        tmp_path / "page_001.xml",
+        None,
+    ]
+    resumed = Checkpoint(tmp_path).batch_stage("omr", convert)(pages)
+    assert resumed[0] == tmp_path / "page_001.xml"
+    assert batches == [pages[:2], pages[1:]]
+
+
+def test_pages_replayed_once_rasterizing_finished(tmp_path):
+    image_dir = tmp_path / "images"
+    calls = []
+
+    # Interrupted after the first page: rasterized again on resume
+    pages = Checkpoint(tmp_path).pages(rasterize(image_dir, 3, calls))
+    next(pages)
+    assert len(list(Checkpoint(tmp_path).pages(rasterize(image_dir, 3, calls)))) == 3
+    assert calls == [0, 0, 1, 2]
+
+    replayed = list(Checkpoint(tmp_path).pages(rasterize(image_dir, 3, calls)))
+    assert replayed == [image_dir / f"page_{n:03}.png" for n in range(1, 4)]
+    assert calls == [0, 0, 1, 2]
+
+    # A missing page makes the whole document be rasterized again
+    replayed[1].unlink()
+    assert len(list(Checkpoint(tmp_path).pages(rasterize(image_dir, 3, calls)))) == 3
+    assert calls == [0, 0, 1, 2, 0, 1, 2]
+
+
+def test_enhanced_page_survives_rasterizing_again(page, tmp_path):
+    original = page("page_001.png", notes=[(400, 0, True)])
+    raw = original.read_bytes()
+    checkpoint = Checkpoint(tmp_path)
+    enhance = checkpoint.stage(
+        "enhance", lambda img_path: enhance_image(img_path, tmp_path)
+    )
+
+    enhanced = enhance(original)
+    assert enhanced != original
+    assert original.read_bytes() == raw
+
+    # The page is rasterized again over the same path before resuming
+    page("page_001.png", notes=[(400, 0, True)])
+    assert Checkpoint(tmp_path).stage("enhance", None)(original) == enhanced
+    assert enhanced.read_bytes() != original.read_bytes()
+
+
+def test_finished(tmp_path):
+    output = tmp_path / "score.mp3"
+    output.write_bytes(b"mp3")
+    assert Checkpoint(tmp_path).finished() is None
+
+    Checkpoint(tmp_path).finish(JobResult(output_path=output, skipped_pages=[2]))
+    assert Checkpoint(tmp_path).finished() == JobResult(
+        output_path=output, skipped_pages=[2]
+    )
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from config.config import app_settings
+from src.core import metrics
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_settings, "METRICS_DB", str(tmp_path / "metrics.sqlite3"))
+    monkeypatch.setattr(metrics._local, "pid", None, raising=False)
+    metrics._stats_cache.clear()
+    yield metrics._connection()
+    metrics._job.clear()
+    metrics._pending.clear()
+
+
+def test_job_timings_written_once(store):
+    metrics.start_job("job1", "HOMR")
+    for _ in range(3):
+        metrics.observe("rasterize", 0.2)
+        metrics.observe("omr", 3.0)
+    # Kept back while the job runs
+    assert store.execute("SELECT COUNT(*) FROM job_stages").fetchone() == (0,)
+
+    stats = metrics.finish_job(success=True)
+    assert stats["pages"] == 3
+    assert stats["stages"] == {"rasterize": 0.6, "omr": 9.0}
+    assert store.execute(
+        "SELECT count FROM stage_buckets WHERE tool = 'HOMR' AND stage = 'omr' "
+        "AND le IN (2.5, 5)"
+    ).fetchall() == [(0,), (3,)]
+    assert store.execute(
+        "SELECT sum, count FROM stage_totals WHERE stage = 'rasterize'"
+    ).fetchone() == (pytest.approx(0.6), 3)
+
+
+def test_outside_a_job_written_at_once(store):
+    metrics.observe("route", 0.1, tool="AUTO")
+    assert store.execute("SELECT count FROM stage_totals").fetchone() == (1,)
+
+
+def test_old_jobs_pruned(store, monkeypatch):
+    monkeypatch.setattr(app_settings, "STATS_WINDOW", 60)
+    old = time.time() - 120
+    store.execute("INSERT INTO jobs VALUES ('old', 'HOMR', ?, 10, 0, 1, 1)", (old,))
+    store.execute("INSERT INTO job_stages VALUES ('crashed', 'omr', 5, 1, ?)", (old,))
+    store.commit()
+
+    metrics.start_job("job1", "HOMR")
+    metrics.observe("rasterize", 0.1)
+    metrics.finish_job(success=True)
+
+    assert store.execute("SELECT job_id FROM jobs").fetchall() == [("job1",)]
+    assert store.execute("SELECT COUNT(*) FROM job_stages").fetchone() == (0,)
+    # The counter does not go down with the pruned rows
+    metrics.start_job("job2", "HOMR")
+    metrics.finish_job(success=True)
+    assert 'scoreapi_jobs_total{tool="HOMR",outcome="success"} 2' in (
+        metrics.render_prometheus()
+    )
@@ -0,0 +1,116 @@
+import pytest
+from PIL import Image
+
+from src.api.v1.music.services.pages import (
+    PageCache,
+    count_staves,
+    filter_pages,
+    is_blank,
+    page_hash,
+    parse_page_ranges,
+    select_pages,
+)
+
+
+@pytest.mark.parametrize(
+    "spec, pages",
+    [
+        ("3", [3]),
+        ("3-7,12", [3, 4, 5, 6, 7, 12]),
+        (" 5-6 , 1 ", [1, 5, 6]),
+        ("2-4,3-5", [2, 3, 4, 5]),
+    ],
+)
+def test_parse_page_ranges(spec, pages):
+    assert parse_page_ranges(spec) == pages
+
+
+@pytest.mark.parametrize("spec", ["", "a", "0", "5-3", "1-", "-2", "1-20000"])
+def test_parse_page_ranges_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec)
+
+
+def test_select_pages():
+    assert select_pages(None, 3) == [1, 2, 3]
+    assert select_pages([2, 5], 3) == [2]
+
+
+def test_page_hash_same_pixels(page, tmp_path):
+    png = page(notes=[(400, 0, True)])
+    bmp = tmp_path / "page.bmp"
+    Image.open(png).save(bmp)
+    assert page_hash(png) == page_hash(bmp)
+    assert page_hash(png) == page_hash(page("again.png", notes=[(400, 0, True)]))
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        [(400, 0, False)],  # hollow instead of filled notehead
+        [(400, 0, True), (700, 2, True)],  # one more note
+    ],
+)
+def test_page_hash_small_difference(page, other):
+    assert page_hash(page("a.png", notes=[(400, 0, True)])) != page_hash(
+        page("b.png", notes=other)
+    )
+
+
+def test_page_cache_reuses_identical_pages_only(page, tmp_path):
+    cache = PageCache("TEST", root=tmp_path / "cache")
+    calls = []
+
+    def recognize(images):
+        calls.append([img_path.name for img_path in images])
+        results = []
+        for img_path in images:
+            xml_path = img_path.with_suffix(".musicxml")
+            xml_path.write_text(img_path.stem)
+            results.append(xml_path)
+        return results
+
+    filled = page("filled.png", notes=[(400, 0, True)])
+    copy = page("copy.png", notes=[(400, 0, True)])
+    hollow = page("hollow.png", notes=[(400, 0, False)])
+    results = cache.recognize_batch([filled, copy, hollow], recognize)
+
+    assert calls == [["filled.png", "hollow.png"]]
+    assert [xml_path.read_text() for xml_path in results] == [
+        "filled",
+        "filled",
+        "hollow",
+    ]
+    again = page("again.png", notes=[(400, 0, False)])
+    assert cache.recognize(again, lambda img_path: None).read_text() == "hollow"
+
+
+def test_is_blank(page, tmp_path):
+    assert is_blank(page(staves=0))
+    assert not is_blank(page())
+    dark = tmp_path / "dark.png"
+    Image.new("L", (1240, 1754), 0).save(dark)
+    assert is_blank(dark)
+
+
+def test_count_staves(page):
+    assert count_staves(page(staves=4, notes=[(400, 1, True)])) == 4
+    assert count_staves(page(staves=0)) == 0
+
+
+@pytest.mark.parametrize("angle", [1, 2.5, -3, 5])
+def test_count_staves_skewed(page, angle):
+    # Phone photos and scans are rarely straight
+    assert count_staves(page(staves=4, notes=[(400, 1, True)], angle=angle)) == 4
+
+
+def test_filter_pages(page, tmp_path):
+    text = tmp_path / "text.png"
+    img = Image.new("L", (1240, 1754), 255)
+    img.paste(0, (100, 100, 600, 140))
+    img.save(text)
+    images = [page("music.png"), page("blank.png", staves=0), text]
+
+    skipped = []
+    assert list(filter_pages(images, skipped, [4, 5, 6])) == images[:1]
+    assert skipped == [5, 6]
@@ -0,0 +1,60 @@
+import struct
+
+import pytest
+
+from src.api.v1.music.exceptions import UnknownSoundFontException
+from src.api.v1.music.services.soundfonts import (
+    SoundFontRegistry,
+    map_soundfont,
+    validate_soundfont,
+)
+
+
+def chunk(chunk_id: bytes, data: bytes) -> bytes:
+    # RIFF chunks are padded to an even size
+    return chunk_id + struct.pack("<I", len(data)) + data + b"\0" * (len(data) & 1)
+
+
+def soundfont(*lists: bytes) -> bytes:
+    body = b"sfbk" + b"".join(chunk(b"LIST", name + b"odd") for name in lists)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def test_valid_soundfont():
+    validate_soundfont(soundfont(b"INFO", b"sdta", b"pdta"))
+
+
+def test_not_a_soundfont():
+    with pytest.raises(ValueError, match="not a SoundFont 2 file"):
+        validate_soundfont(b"RIFF\0\0\0\0WAVE")
+    with pytest.raises(ValueError, match="not a SoundFont 2 file"):
+        validate_soundfont(b"")
+
+
+def test_truncated_soundfont():
+    data = soundfont(b"INFO", b"sdta", b"pdta")
+    with pytest.raises(ValueError, match="truncated"):
+        validate_soundfont(data[:-4])
+
+
+def test_missing_lists():
+    with pytest.raises(ValueError, match="missing pdta, sdta"):
+        validate_soundfont(soundfont(b"INFO"))
+
+
+def test_registry(tmp_path):
+    good = tmp_path / "good.sf2"
+    good.write_bytes(soundfont(b"INFO", b"sdta", b"pdta"))
+    bad = tmp_path / "bad.sf2"
+    bad.write_bytes(b"not a font")
+
+    font = map_soundfont("good", good)
+    assert font.size == good.stat().st_size
+    font.mapping.close()
+
+    registry = SoundFontRegistry({"default": str(good), "bad": str(bad)})
+    assert registry.names == ["default"]
+    assert "not a SoundFont 2 file" in registry.errors["bad"]
+    assert registry.resolve() == good.resolve()
+    with pytest.raises(UnknownSoundFontException):
+        registry.resolve("bad")
@@ -0,0 +1,55 @@
+import zipfile
+
+import pytest
+
+from config.config import app_settings
+from src.api.v1.music.exceptions import ArchiveTooLargeException
+from src.api.v1.music.services.music import unpack_scores
+
+
+def make_zip(path, members: dict[str, bytes]):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return path
+
+
+def test_unpack_scores(tmp_path):
+    upload = make_zip(
+        tmp_path / "scores.zip",
+        {"a/score.pdf": b"%PDF", "b/score.pdf": b"%PDF", "notes.txt": b"text"},
+    )
+    scores = unpack_scores(upload, tmp_path, 3)
+    assert [path.name for path in scores] == ["003_score.pdf", "004_score.pdf"]
+    assert not upload.exists()
+
+
+def test_single_score_kept(tmp_path):
+    upload = tmp_path / "000_score.png"
+    upload.write_bytes(b"png")
+    assert unpack_scores(upload, tmp_path, 0) == [upload]
+
+
+@pytest.mark.parametrize(
+    "setting, value, members",
+    [
+        ("BATCH_MAX_FILES", 2, {"1.pdf": b"1", "2.pdf": b"2", "3.pdf": b"3"}),
+        # Compresses to a few KB
+        ("BATCH_MAX_FILE_MB", 1, {"bomb.pdf": bytes(2 * 2**20)}),
+        (
+            "BATCH_MAX_UNPACKED_MB",
+            1,
+            {"1.pdf": bytes(2**19), "2.pdf": bytes(2**19 + 1)},
+        ),
+    ],
+)
+def test_limits_checked_before_extracting(
+    tmp_path, monkeypatch, setting, value, members
+):
+    monkeypatch.setattr(app_settings, setting, value)
+    upload = make_zip(tmp_path / "upload.zip", members)
+    out = tmp_path / "input"
+    out.mkdir()
+    with pytest.raises(ArchiveTooLargeException):
+        unpack_scores(upload, out, 0)
+    assert not any(out.iterdir())